@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Допуск запросов к дорогим эндпоинтам (/api/system/*) и сброс нагрузки
+Проба запускает docker ps, сканирует volume с бэкапами - всплеск вкладок дашборда
+или краулер не должен занимать все потоки gunicorn. Перед пробой запрос проходит
+два ограничения: число одновременных проб на воркер и token bucket на клиента.
+Не прошедший запрос не ждет в очереди: эндпоинт сразу отдает последний удачный
+результат с пометкой stale или 503 с Retry-After.
+
+Ограничения действуют в пределах воркера: при N воркерах сайт целиком пропускает
+до N * concurrency проб одновременно. Клиент определяется по X-Real-IP (его ставит nginx);
+заголовок можно подделать в обход nginx, но ограничение одновременных проб от этого не зависит.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from prometheus_client import Counter, Gauge
+from prometheus_client.core import GaugeMetricFamily
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "app_admission_in_flight", "Admitted probe requests in progress", multiprocess_mode="livesum"
+)
+ADMISSION_SHED = Counter(
+    "app_admission_shed_total", "Probe requests not admitted",
+    ["endpoint", "reason", "response"]
+)
+
+# admitted - можно выполнять пробу; иначе reason (concurrency/rate_limited) и через сколько секунд повторить
+Decision = namedtuple("Decision", ["admitted", "reason", "retry_after"])
+
+ADMITTED = Decision(True, None, 0)
+
+
+class ClientRateLimiter:
+    """Token bucket на клиента: rate запросов в секунду, всплеск до burst
+
+    Хранится не больше max_clients корзин; дольше всех не обращавшиеся вытесняются
+    (полная корзина и отсутствующая равнозначны).
+    """
+
+    def __init__(self, rate=2.0, burst=10, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def acquire(self, client):
+        """(допущен, секунд до следующего токена)"""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                tokens = float(self.burst)
+            else:
+                tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1.0 - tokens) / self.rate
+
+
+class ConcurrencyLimiter:
+    """Не больше limit одновременно; без ожидания свободного места"""
+
+    def __init__(self, limit=4):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def try_acquire(self):
+        with self._lock:
+            if self.limit > 0 and self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class AdmissionControl:
+    """Ограничение одновременных проб и частоты запросов клиента для группы эндпоинтов
+
+        decision = admission.try_enter(client)
+        if decision.admitted:
+            try: ... finally: admission.leave()
+    """
+
+    def __init__(self, concurrency=4, rate=2.0, burst=10, retry_after=1.0, max_clients=10000):
+        self.concurrency = ConcurrencyLimiter(concurrency)
+        self.rate_limiter = ClientRateLimiter(rate, burst, max_clients)
+        # Retry-After при занятых слотах: пробы короткие, ждать больше секунды незачем
+        self.retry_after = retry_after
+
+    def try_enter(self, client):
+        allowed, wait = self.rate_limiter.acquire(client)
+        if not allowed:
+            return Decision(False, "rate_limited", wait)
+        if not self.concurrency.try_acquire():
+            return Decision(False, "concurrency", self.retry_after)
+        ADMISSION_IN_FLIGHT.inc()
+        return ADMITTED
+
+    def leave(self):
+        self.concurrency.release()
+        ADMISSION_IN_FLIGHT.dec()
+
+    @staticmethod
+    def record_shed(endpoint, decision, response):
+        """response - что получил клиент вместо пробы: stale или unavailable (503)"""
+        ADMISSION_SHED.labels(endpoint=endpoint, reason=decision.reason, response=response).inc()
+
+    @staticmethod
+    def retry_after_header(decision):
+        return str(max(1, math.ceil(decision.retry_after)))
+
+    def describe(self):
+        """Без вызова collect() при регистрации"""
+        return []
+
+    def collect(self):
+        """Настроенные ограничения (на воркер) - вычисляются при скрейпе, поэтому не зависят от preload"""
+        limits = GaugeMetricFamily("app_admission_limit", "Admission limits per worker for probe endpoints",
+                                   labels=["limit"])
+        limits.add_metric(["concurrency"], self.concurrency.limit)
+        limits.add_metric(["rate_per_second"], self.rate_limiter.rate)
+        limits.add_metric(["burst"], self.rate_limiter.burst)
+        yield limits
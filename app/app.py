@@ -1,74 +1,224 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST, Gauge
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, g
+import math
 import os
+import queue
+import shutil
+import sys
 import time
-import requests
 from datetime import datetime
 from translations import translations, _
+from docker_state import ContainerStateCollector
+from live_updates import UpdateBroadcaster, PolledTopic, format_sse
+from page_cache import PageCache
+from instrumentation import RequestInstrumentation, parse_buckets
+from structured_logging import RequestLogging, setup_logging
+from spans import SpanTiming, span
+from metrics_registry import ExpositionCache, register_collector
+from system_metrics import SystemCollector
+from probes import ProbeRunner
+from admission import AdmissionControl, ConcurrencyLimiter
+from disk_history import DiskHistory
+from container_stats import ContainerStatsSampler, DockerEngineClient, DEFAULT_DOCKER_HOST
+from query_frontend import QueryFrontend, QueryError
+from log_query import LogQueryProxy
+from warmup import warm_up
+
+# Общие модули бэкапов (infra/backup): в контейнере скопированы в /opt/devops-portfolio/infra/backup
+BACKUP_TOOLS_DIR = os.environ.get('BACKUP_TOOLS_DIR', '/opt/devops-portfolio/infra/backup')
+if not os.path.isdir(BACKUP_TOOLS_DIR):
+    # Локальная разработка: берем модули прямо из репозитория
+    BACKUP_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'infra', 'backup')
+sys.path.append(BACKUP_TOOLS_DIR)
+
+from backup_catalog import BackupCatalog, backup_age_text, backup_health, backup_verification
+from cron_status import CronStatusProvider
+from backup_store import StoreStats
+
+
+def format_size(size):
+    """Размер в B/KB/MB для отображения на дашборде"""
+    if size < 1024:
+        return f"{size} B"
+    elif size < 1024*1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024*1024):.1f} MB"
 
 
 def create_app() -> Flask:
+    # До создания Flask: app.logger не получит собственный синхронный обработчик
+    setup_logging()
     app = Flask(__name__, template_folder="templates", static_folder="static")
     app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
-    request_counter = Counter("http_requests_total", "HTTP requests total", ["path"]) 
-    app_uptime_seconds = Gauge("app_uptime_seconds", "Application uptime in seconds")
-    active_connections = Gauge("app_active_connections", "Number of active connections")
-    response_time = Gauge("app_response_time_seconds", "Response time in seconds", ["path"])
+    RequestInstrumentation(app, buckets=parse_buckets(os.environ.get('METRICS_LATENCY_BUCKETS')))
+    RequestLogging(app, slow_ms=float(os.environ.get('LOG_SLOW_REQUEST_MS', '1000')))
+    # Разбивка по фазам для медленных запросов; профилировщик - только с заголовком X-Profile: $PROFILE_SECRET
+    SpanTiming(
+        app,
+        slow_ms=float(os.environ.get('SPAN_SLOW_REQUEST_MS', '500')),
+        profile_secret=os.environ.get('PROFILE_SECRET'),
+        profile_interval=float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+    )
     start_time = time.time()
 
-    @app.before_request
-    def _before_request():
-        app_uptime_seconds.set(time.time() - start_time)
-        active_connections.inc()
-        request.start_time = time.time()
-    
-    @app.after_request
-    def _after_request(response):
-        active_connections.dec()
-        if hasattr(request, 'start_time'):
-            duration = time.time() - request.start_time
-            response_time.labels(path=request.path).set(duration)
-        return response
+    # В Docker контейнере /opt/backups монтируется как volume, локально используем test-backups
+    backup_dir = os.environ.get('BACKUP_DIR') or (
+        "/opt/backups" if os.path.exists("/opt/backups") else os.path.join(os.getcwd(), "test-backups")
+    )
+    backup_catalog = BackupCatalog(backup_dir)
+    # Инкрементальное хранилище с дедупликацией (backup_store.py) - рядом с архивами
+    store_stats = StoreStats(os.environ.get('BACKUP_STORE_DIR') or os.path.join(backup_dir, "store"))
+    cron_status = CronStatusProvider()
+
+    broadcaster = UpdateBroadcaster()
+    container_state = ContainerStateCollector(
+        ttl=float(os.environ.get('DOCKER_SNAPSHOT_TTL', '15')),
+        timeout=float(os.environ.get('DOCKER_PROBE_TIMEOUT', '10')),
+        broadcaster=broadcaster,
+        watch_events=os.environ.get('DOCKER_EVENTS_ENABLED', 'true') == 'true'
+    )
+
+    page_cache = PageCache(
+        app,
+        watch_dirs=[os.path.join(app.root_path, app.template_folder)],
+        check_interval=float(os.environ.get('PAGE_CACHE_CHECK_INTERVAL', '2'))
+    )
+
+    def render_page(template_name):
+        """Рендерит страницу с переводами; результат кешируется по языку"""
+        lang = translations.get_language()
+        context = lambda: {"t": translations.get_all_translations(), "translations": translations}
+        if not translations.has_language(lang):
+            # Неизвестный ?lang= не кешируем, чтобы не раздувать кеш
+            with span("render.template"):
+                return render_template(template_name, **context())
+        # Версия каталога переводов инвалидирует страницу после горячей перезагрузки
+        return page_cache.render(template_name, lang, context, version=translations.catalog(lang).version)
+
+    # Пробы выполняются в отдельном пуле с таймаутом: медленный диск или Docker не занимают потоки запросов
+    probes = ProbeRunner(
+        max_workers=int(os.environ.get('PROBE_WORKERS', '4')),
+        ttl=float(os.environ.get('PROBE_CACHE_TTL', '2'))
+    )
+    probe_timeouts = {
+        "disk": float(os.environ.get('PROBE_DISK_TIMEOUT', '2')),
+        "docker": float(os.environ.get('PROBE_DOCKER_TIMEOUT', '3')),
+        "backups": float(os.environ.get('PROBE_BACKUPS_TIMEOUT', '5')),
+        # Скрейп почти не ждет: при медленном диске отдаем последние значения
+        "metrics": float(os.environ.get('PROBE_METRICS_TIMEOUT', '0.25')),
+    }
+
+    # Системные gauge вычисляются только при скрейпе, а готовый ответ кешируется на несколько секунд
+    register_collector(SystemCollector(start_time, backup_catalog=backup_catalog, container_state=container_state,
+                                       store_stats=store_stats, probes=probes,
+                                       probe_timeout=probe_timeouts["metrics"]))
+    metrics_cache = ExpositionCache(ttl=float(os.environ.get('METRICS_CACHE_TTL', '5')))
 
     @app.route("/")
     def index():
-        request_counter.labels(path="/").inc()
-        return render_template("index.html", t=translations.get_all_translations(), translations=translations)
+        return render_page("index.html")
 
     @app.route("/about")
     def about():
-        request_counter.labels(path="/about").inc()
-        return render_template("about.html", t=translations.get_all_translations(), translations=translations)
+        return render_page("about.html")
 
     @app.route("/metrics")
     def metrics():
-        return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+        body, headers = metrics_cache.render(request.headers.get("Accept"), request.headers.get("Accept-Encoding"))
+        return body, 200, headers
+
+    # PromQL запросы дашбордов идут через кеширующий фронтенд, а не напрямую в Prometheus
+    query_frontend = QueryFrontend(
+        os.environ.get('PROMETHEUS_URL', 'http://prometheus:9090'),
+        split_interval=float(os.environ.get('QUERY_SPLIT_INTERVAL', '3600')),
+        max_splits=int(os.environ.get('QUERY_MAX_SPLITS', '64')),
+        cache_entries=int(os.environ.get('QUERY_CACHE_ENTRIES', '512')),
+        cache_samples=int(os.environ.get('QUERY_CACHE_SAMPLES', '2000000')),
+        parallelism=int(os.environ.get('QUERY_PARALLELISM', '4')),
+        timeout=float(os.environ.get('QUERY_TIMEOUT', '30')),
+        freshness=float(os.environ.get('QUERY_CACHE_FRESHNESS', '300'))
+    )
 
-    @app.route("/query")
+    def query_response(handler):
+        try:
+            payload, cache = handler(request.values)
+        except QueryError as e:
+            return e.payload(), e.status_code
+        if cache["hits"] == cache["subqueries"]:
+            status = "hit"
+        elif cache["hits"]:
+            status = "partial"
+        else:
+            status = "miss"
+        return payload, 200, {"X-Query-Cache": status, "X-Query-Subqueries": str(cache["subqueries"])}
+
+    @app.route("/query", methods=["GET", "POST"])
     def query_redirect():
-        return redirect("https://pishchik-dev.tech/prometheus/", code=302)
+        # Без PromQL выражения - по-прежнему ссылка на UI Prometheus
+        if "query" not in request.values:
+            return redirect("https://pishchik-dev.tech/prometheus/", code=302)
+        return query_response(query_frontend.query)
+
+    @app.route("/query/api/v1/query", methods=["GET", "POST"])
+    def query_instant():
+        return query_response(query_frontend.query)
+
+    @app.route("/query/api/v1/query_range", methods=["GET", "POST"])
+    def query_range():
+        return query_response(query_frontend.query_range)
+
+    # Grafana шлет labels и series методом POST - параметры формы уходят в Prometheus как GET
+    @app.route("/query/api/v1/<path:endpoint>", methods=["GET", "POST"])
+    def query_passthrough(endpoint):
+        return query_response(lambda params: query_frontend.passthrough(endpoint, params))
+
+    @app.route("/query/stats")
+    def query_stats():
+        return query_frontend.stats()
 
     @app.route("/loki")
     def loki():
-        request_counter.labels(path="/loki").inc()
         return render_template("loki.html")
+
+    # Поиск по логам со страницы /loki: окна по времени параллельно, строки отдаются по мере готовности
+    log_query = LogQueryProxy(
+        os.environ.get('LOKI_URL', 'http://loki:3100'),
+        shard_interval=float(os.environ.get('LOG_QUERY_SHARD_INTERVAL', '900')),
+        parallelism=int(os.environ.get('LOG_QUERY_PARALLELISM', '4')),
+        timeout=float(os.environ.get('LOG_QUERY_TIMEOUT', '30')),
+        cache_entries=int(os.environ.get('LOG_QUERY_CACHE_ENTRIES', '256')),
+        cache_lines=int(os.environ.get('LOG_QUERY_CACHE_LINES', '200000')),
+        freshness=float(os.environ.get('LOG_QUERY_CACHE_FRESHNESS', '300')),
+        max_limit=int(os.environ.get('LOG_QUERY_MAX_LIMIT', '5000'))
+    )
+
+    @app.route("/api/logs/query_range")
+    def logs_query_range():
+        try:
+            args = log_query.prepare(request.args)
+        except QueryError as e:
+            return {"error": str(e), "errorType": e.error_type}, e.status_code
+        return Response(log_query.stream(*args), mimetype="application/x-ndjson", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+
+    @app.route("/api/logs/stats")
+    def logs_stats():
+        return log_query.stats()
     
     @app.route("/monitoring")
     def monitoring():
-        request_counter.labels(path="/monitoring").inc()
         try:
-            t = translations.get_all_translations()
-            app.logger.info(f"Monitoring page - Language: {translations.get_language()}, Translations keys: {list(t.keys())}")
-            return render_template("monitoring.html", t=t, translations=translations)
+            app.logger.debug("Monitoring page - Language: %s", translations.get_language())
+            return render_page("monitoring.html")
         except Exception as e:
-            app.logger.error(f"Error in monitoring route: {str(e)}")
+            app.logger.exception("Error in monitoring route: %s", e)
             return f"Error: {str(e)}", 500
     
     @app.route("/architecture")
     def architecture():
-        request_counter.labels(path="/architecture").inc()
-        return render_template("architecture.html", t=translations.get_all_translations(), translations=translations)
+        return render_page("architecture.html")
     
     @app.route("/set_language/<lang>")
     def set_language(lang):
@@ -76,136 +226,138 @@ def create_app() -> Flask:
             translations.set_language(lang)
             return redirect(request.referrer or url_for('index'))
         except Exception as e:
-            app.logger.error(f"Error setting language {lang}: {str(e)}")
+            app.logger.error("Error setting language %s: %s", lang, e)
             return redirect(request.referrer or url_for('index'))
     
-    @app.route("/api/system/disk")
-    def system_disk():
-        import shutil
-        disk_usage = shutil.disk_usage('/')
+    # Допуск к пробам: одновременные пробы на воркер и частота запросов клиента.
+    # Не допущенный запрос не ждет - получает последний удачный результат или 503 с Retry-After
+    admission = AdmissionControl(
+        concurrency=int(os.environ.get('ADMISSION_CONCURRENCY', '4')),
+        rate=float(os.environ.get('ADMISSION_RATE', '2')),
+        burst=int(os.environ.get('ADMISSION_BURST', '10'))
+    )
+    register_collector(admission)
+    admission_client_header = os.environ.get('ADMISSION_CLIENT_HEADER', 'X-Real-IP')
+
+    def admission_client():
+        if admission_client_header:
+            client = request.headers.get(admission_client_header)
+            if client:
+                return client
+        return request.remote_addr or "-"
+
+    def overloaded_error(decision):
+        if decision.reason == "rate_limited":
+            return "Слишком много запросов, повторите позже"
+        return "Сервер перегружен, повторите позже"
+
+    def shed_probe_response(name, decision):
+        # Отказ по перегрузке пишется в access лог как INFO - под LOG_SAMPLING, число отказов - в метриках
+        g.shed = decision.reason
+        cached = probes.cached(name)
+        if cached is None:
+            admission.record_shed(name, decision, "unavailable")
+            return ({"error": overloaded_error(decision), "stale": True, "shed": decision.reason}, 503,
+                    {"Retry-After": admission.retry_after_header(decision)})
+        admission.record_shed(name, decision, "stale")
+        if cached.fresh:
+            return cached.value
+        return dict(cached.value, stale=True, probe_error=overloaded_error(decision),
+                    probe_age_seconds=cached.age_seconds, shed=decision.reason)
+
+    def probe_response(name, fn):
+        cached = probes.cached(name)
+        if cached is not None and cached.fresh:
+            # Ответ из кеша ничего не стоит - допуск нужен только для запуска пробы
+            return cached.value
+        decision = admission.try_enter(admission_client())
+        if not decision.admitted:
+            return shed_probe_response(name, decision)
+        try:
+            result = probes.call(name, fn, probe_timeouts[name])
+        finally:
+            admission.leave()
+        if result.value is None:
+            return {"error": result.error, "stale": True}, 503
+        if result.fresh:
+            return result.value
+        # Последний удачный результат с пометкой, насколько он устарел
+        return dict(result.value, stale=True, probe_error=result.error, probe_age_seconds=result.age_seconds)
+
+    def disk_probe():
+        with span("disk.usage"):
+            disk_usage = shutil.disk_usage('/')
         return {
             "total": disk_usage.total,
             "used": disk_usage.used,
             "free": disk_usage.free,
             "percent_used": round((disk_usage.used / disk_usage.total) * 100, 2)
         }
+
+    @app.route("/api/system/disk")
+    def system_disk():
+        return probe_response("disk", disk_probe)
+
+    # История диска и I/O для спарклайнов: фоновая выборка в кольцевые буферы, без обращения к Prometheus.
+    # Чтение идет через пул проб - медленный statvfs не держит поток выборки дольше таймаута;
+    # результат пробы кешируется на PROBE_CACHE_TTL, поэтому интервал выборки не меньше его
+    disk_history = DiskHistory(
+        paths=[p.strip() for p in os.environ.get('DISK_HISTORY_PATHS', f"/,{backup_dir}").split(',') if p.strip()],
+        interval=float(os.environ.get('DISK_HISTORY_INTERVAL', '30')),
+        retention=float(os.environ.get('DISK_HISTORY_RETENTION', '86400')),
+        trend_window=float(os.environ.get('DISK_HISTORY_TREND_WINDOW', '21600')),
+        runner=lambda fn: probes.value("disk_history", fn, probe_timeouts["disk"])
+    )
+
+    # CPU, память и сеть контейнеров: ограниченный пул запросов /stats, сбор не дольше бюджета
+    container_stats_enabled = os.environ.get('CONTAINER_STATS_ENABLED', 'true') == 'true'
+    container_stats = ContainerStatsSampler(
+        DockerEngineClient(os.environ.get('DOCKER_HOST', DEFAULT_DOCKER_HOST),
+                           timeout=float(os.environ.get('CONTAINER_STATS_TIMEOUT', '5'))),
+        interval=float(os.environ.get('CONTAINER_STATS_INTERVAL', '15')),
+        workers=int(os.environ.get('CONTAINER_STATS_WORKERS', '8')),
+        budget=float(os.environ.get('CONTAINER_STATS_BUDGET', '5'))
+    )
+    if container_stats_enabled:
+        register_collector(container_stats)
+
+    @app.before_request
+    def start_samplers():
+        # Выборка должна идти с первого запроса к воркеру, а не с первого открытия графика
+        disk_history.start()
+        if container_stats_enabled:
+            container_stats.start()
+
+    def docker_probe():
+        snapshot = container_state.get_snapshot()
+        return container_stats.annotate(snapshot) if container_stats_enabled else snapshot
+
+    @app.route("/api/system/disk/history")
+    def system_disk_history():
+        """Прореженные ряды по точкам монтирования: ?mount=/&window=3600&points=60"""
+        try:
+            window = float(request.args.get("window", "3600"))
+            points = int(request.args.get("points", "60"))
+        except ValueError:
+            return {"error": "window и points должны быть числами"}, 400
+        # float() принимает nan и inf - такое окно не поделить на интервалы
+        if not math.isfinite(window) or window <= 0 or not 0 < points <= 500:
+            return {"error": "window > 0, points от 1 до 500"}, 400
+        return disk_history.history(request.args.getlist("mount") or None, window, points)
     
     @app.route("/api/system/docker")
     def system_docker():
-        try:
-            import subprocess
-            import json
-            
-            # Попытка получить реальную информацию о контейнерах через Docker API
-            try:
-                # Используем docker ps для получения информации о контейнерах
-                result = subprocess.run([
-                    'docker', 'ps', '-a', '--format', 
-                    '{"Names":"{{.Names}}","Status":"{{.Status}}","State":"{{.State}}","Image":"{{.Image}}"}'
-                ], capture_output=True, text=True, timeout=10)
-                
-                if result.returncode == 0:
-                    containers = []
-                    for line in result.stdout.strip().split('\n'):
-                        if line.strip():
-                            try:
-                                container_info = json.loads(line)
-                                # Определяем статус и иконку
-                                if 'Up' in container_info.get('Status', ''):
-                                    container_info['State'] = 'running'
-                                    container_info['status_icon'] = '🟢'
-                                    container_info['status_text'] = 'UP'
-                                else:
-                                    container_info['State'] = 'stopped'
-                                    container_info['status_icon'] = '🔴'
-                                    container_info['status_text'] = 'DOWN'
-                                containers.append(container_info)
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    if containers:
-                        return {"containers": containers, "debug": {"method": "docker_api", "count": len(containers)}}
-                
-            except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.CalledProcessError) as e:
-                app.logger.warning(f"Docker API недоступен: {str(e)}")
-            
-            # Fallback - пытаемся получить информацию через docker.sock
-            try:
-                import docker
-                client = docker.from_env()
-                containers = []
-                
-                for container in client.containers.list(all=True):
-                    status = container.status
-                    if status == 'running':
-                        status_icon = '🟢'
-                        status_text = 'UP'
-                        state = 'running'
-                    else:
-                        status_icon = '🔴'
-                        status_text = 'DOWN'
-                        state = 'stopped'
-                    
-                    containers.append({
-                        'Names': container.name,
-                        'Status': container.status,
-                        'State': state,
-                        'status_icon': status_icon,
-                        'status_text': status_text,
-                        'Image': container.image.tags[0] if container.image.tags else 'unknown'
-                    })
-                
-                return {"containers": containers, "debug": {"method": "docker_python", "count": len(containers)}}
-                
-            except Exception as e:
-                app.logger.warning(f"Docker Python API недоступен: {str(e)}")
-            
-            # Последний fallback - статическая информация с предупреждением
-            static_containers = [
-                {'Names': 'app', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'nginx', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'prometheus', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'grafana', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'loki', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'promtail', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'alertmanager', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'},
-                {'Names': 'node-exporter', 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'}
-            ]
-            return {"containers": static_containers, "debug": {"method": "static_fallback", "warning": "Real Docker API unavailable"}}
-            
-        except Exception as e:
-            return {"error": str(e), "containers": [], "debug": {"exception": str(e)}}
+        # Ответ из памяти: Docker опрашивает фоновый сборщик; таймаут ограничивает только ожидание первого сбора
+        return probe_response("docker", docker_probe)
     
-    @app.route("/api/system/backups")
-    def system_backups():
+    def backups_probe():
         try:
-            import os
-            import glob
-            import subprocess
-            from datetime import datetime, timedelta
-            
-            # Определяем директорию бэкапов в зависимости от среды
-            # В Docker контейнере /opt/backups монтируется как volume
-            if os.path.exists("/opt/backups"):
-                # Продакшен: читаем бэкапы напрямую из /opt/backups
-                backup_dir = "/opt/backups"
-                
-                # Проверяем есть ли большие бэкапы (автоматические)
-                backup_files = glob.glob(os.path.join(backup_dir, "devops-portfolio-backup-*.tar.gz"))
-                if backup_files:
-                    # Сортируем по размеру, берем самый большой
-                    backup_files.sort(key=lambda x: os.path.getsize(x), reverse=True)
-                    largest_backup = backup_files[0]
-                    largest_size = os.path.getsize(largest_backup)
-                    
-                    # Если есть бэкап больше 1MB, используем его для статистики
-                    if largest_size > 1024*1024:  # Больше 1MB
-                        # Используем только большие бэкапы для статистики
-                        backup_files = [f for f in backup_files if os.path.getsize(f) > 1024*1024]
-            else:
-                # Локальная разработка
-                backup_dir = os.path.join(os.getcwd(), "test-backups")
-                backup_files = glob.glob(os.path.join(backup_dir, "devops-portfolio-backup-*.tar.gz"))
+            # Каталог держит список бэкапов в памяти и пересканирует директорию только при ее изменении
+            with span("backups.catalog"):
+                snapshot = backup_catalog.snapshot()
+            if snapshot.largest_size > 1024*1024:
+                # Если есть бэкап больше 1MB, используем только большие (автоматические) бэкапы для статистики
+                snapshot = snapshot.filter(min_size=1024*1024)
             
             backup_stats = {
                 "total_backups": 0,
@@ -216,119 +368,47 @@ def create_app() -> Flask:
                 "cron_status": "Unknown",
                 "backup_health": "Unknown",
                 "debug": {
-                    "backup_dir": backup_dir,
-                    "backup_files_count": len(backup_files) if 'backup_files' in locals() else 0
+                    "backup_dir": backup_catalog.backup_dir,
+                    "backup_files_count": snapshot.count
                 }
             }
             
             # Проверяем существование директории бэкапов
-            if os.path.exists(backup_dir):
-                # backup_files уже определены выше
-                if not backup_files:
-                    backup_files = glob.glob(os.path.join(backup_dir, "devops-portfolio-backup-*.tar.gz"))
-                backup_files.sort(key=os.path.getmtime, reverse=True)
-                
-                backup_stats["total_backups"] = len(backup_files)
+            if backup_catalog.exists:
+                backup_stats["total_backups"] = snapshot.count
                 
-                if backup_files:
+                if snapshot.count:
                     # Размер всех бэкапов
-                    total_size = sum(os.path.getsize(f) for f in backup_files)
-                    if total_size < 1024:
-                        backup_stats["total_size"] = f"{total_size} B"
-                    elif total_size < 1024*1024:
-                        backup_stats["total_size"] = f"{total_size / 1024:.1f} KB"
-                    else:
-                        backup_stats["total_size"] = f"{total_size / (1024*1024):.1f} MB"
-                    
-                    # Последний бэкап
-                    last_backup = backup_files[0]
-                    last_backup_time = datetime.fromtimestamp(os.path.getmtime(last_backup))
-                    backup_stats["last_backup"] = last_backup_time.strftime("%Y-%m-%d %H:%M:%S")
+                    backup_stats["total_size"] = format_size(snapshot.total_size)
                     
-                    # Самый старый бэкап
-                    oldest_backup = backup_files[-1]
-                    oldest_backup_time = datetime.fromtimestamp(os.path.getmtime(oldest_backup))
-                    backup_stats["oldest_backup"] = oldest_backup_time.strftime("%Y-%m-%d %H:%M:%S")
+                    # Последний и самый старый бэкапы
+                    backup_stats["last_backup"] = datetime.fromtimestamp(snapshot.newest.mtime).strftime("%Y-%m-%d %H:%M:%S")
+                    backup_stats["oldest_backup"] = datetime.fromtimestamp(snapshot.oldest.mtime).strftime("%Y-%m-%d %H:%M:%S")
                     
                     # Детали по каждому бэкапу
-                    for backup_file in backup_files[:10]:  # Показываем только последние 10
-                        file_stat = os.stat(backup_file)
-                        file_size = file_stat.st_size
-                        file_time = datetime.fromtimestamp(file_stat.st_mtime)
-                        
-                        # Определяем возраст бэкапа
-                        age_days = (datetime.now() - file_time).days
-                        if age_days == 0:
-                            age_text = "Сегодня"
-                        elif age_days == 1:
-                            age_text = "Вчера"
-                        else:
-                            age_text = f"{age_days} дн. назад"
-                        
-                        # Правильное вычисление размера
-                        if file_size < 1024:
-                            size_text = f"{file_size} B"
-                        elif file_size < 1024*1024:
-                            size_text = f"{file_size / 1024:.1f} KB"
-                        else:
-                            size_text = f"{file_size / (1024*1024):.1f} MB"
-                        
+                    now = datetime.now()
+                    for entry in snapshot.top(10):  # Показываем только последние 10
                         backup_stats["backups"].append({
-                            "filename": os.path.basename(backup_file),
-                            "size": size_text,
-                            "date": file_time.strftime("%Y-%m-%d %H:%M:%S"),
-                            "age": age_text,
-                            "path": backup_file
+                            "filename": entry.filename,
+                            "size": format_size(entry.size),
+                            "date": datetime.fromtimestamp(entry.mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                            "age": backup_age_text(entry.mtime, now),
+                            "path": entry.path,
+                            "verification": backup_verification(entry)
                         })
-                    
-                    # Проверяем здоровье бэкапов
-                    recent_backup = backup_files[0]
-                    recent_backup_time = datetime.fromtimestamp(os.path.getmtime(recent_backup))
-                    hours_since_backup = (datetime.now() - recent_backup_time).total_seconds() / 3600
-                    
-                    if hours_since_backup < 25:  # Бэкап был в последние 25 часов
-                        backup_stats["backup_health"] = "Healthy"
-                    elif hours_since_backup < 49:  # Бэкап был в последние 49 часов
-                        backup_stats["backup_health"] = "Warning"
-                    else:
-                        backup_stats["backup_health"] = "Critical"
-                else:
-                    backup_stats["backup_health"] = "No Backups"
+                
+                # Проверяем здоровье бэкапов
+                backup_stats["backup_health"] = backup_health(snapshot)
+            
+            # Логический (сумма всех бэкапов) и физический (на диске после дедупликации) размер
+            with span("backups.store"):
+                backup_stats["incremental"] = store_stats.summary(format_size)
             
             # Проверяем статус cron задач
             try:
-                cron_found = False
-                cron_method = "none"
-                
-                # Проверяем cron через файлы crontab
-                cron_files = [
-                    '/etc/crontab',
-                    '/var/spool/cron/crontabs/ubuntu',
-                    '/var/spool/cron/crontabs/root',
-                    '/var/spool/cron/ubuntu',
-                    '/var/spool/cron/root'
-                ]
-                
-                for cron_file in cron_files:
-                    try:
-                        with open(cron_file, 'r') as f:
-                            content = f.read()
-                            if 'backup.sh' in content or 'devops-portfolio' in content:
-                                cron_found = True
-                                cron_method = f"file:{cron_file}"
-                                break
-                    except:
-                        continue
-                
-                # Дополнительная проверка через crontab -l
-                if not cron_found:
-                    try:
-                        result = subprocess.run(['crontab', '-l'], capture_output=True, text=True, timeout=5)
-                        if result.returncode == 0 and ('backup.sh' in result.stdout or 'devops-portfolio' in result.stdout):
-                            cron_found = True
-                            cron_method = "crontab"
-                    except:
-                        pass
+                # Файлы crontab и crontab -l проверяются заново только при изменении их mtime
+                with span("backups.cron"):
+                    cron_found, cron_method = cron_status.status()
                 
                 # Проверяем через переменные окружения (для Docker)
                 if not cron_found:
@@ -340,27 +420,17 @@ def create_app() -> Flask:
                         pass
                 
                 # Эвристическая проверка - если есть свежие бэкапы, считаем что автоматизация работает
-                if not cron_found and backup_stats["total_backups"] > 0:
-                    if backup_files:
-                        last_backup_time = datetime.fromtimestamp(os.path.getmtime(backup_files[0]))
-                        hours_since_backup = (datetime.now() - last_backup_time).total_seconds() / 3600
-                        
-                        # Если бэкап был в последние 25 часов и есть несколько бэкапов
-                        if hours_since_backup < 25 and backup_stats["total_backups"] >= 2:
-                            cron_found = True
-                            cron_method = "heuristic"
-                        # Если есть регулярные бэкапы (проверяем интервалы)
-                        elif len(backup_files) >= 2:
-                            # Проверяем интервалы между бэкапами
-                            times = [os.path.getmtime(f) for f in backup_files[:3]]
-                            times.sort(reverse=True)
-                            
-                            if len(times) >= 2:
-                                interval = times[0] - times[1]
-                                # Если интервал между 20-28 часов (ежедневные бэкапы)
-                                if 20 * 3600 <= interval <= 28 * 3600:
-                                    cron_found = True
-                                    cron_method = "pattern_analysis"
+                if not cron_found and snapshot.count > 0:
+                    hours_since_backup = (time.time() - snapshot.newest.mtime) / 3600
+                    
+                    # Если бэкап был в последние 25 часов и есть несколько бэкапов
+                    if hours_since_backup < 25 and snapshot.count >= 2:
+                        cron_found = True
+                        cron_method = "heuristic"
+                    # Если есть регулярные бэкапы: интервал между двумя последними 20-28 часов (ежедневные бэкапы)
+                    elif snapshot.count >= 2 and 20 * 3600 <= snapshot.intervals(2)[0] <= 28 * 3600:
+                        cron_found = True
+                        cron_method = "pattern_analysis"
                 
                 if cron_found:
                     backup_stats["cron_status"] = "Active"
@@ -387,8 +457,152 @@ def create_app() -> Flask:
                 "backup_health": "Error"
             }
     
+    @app.route("/api/system/backups")
+    def system_backups():
+        return probe_response("backups", backups_probe)
+
+    summary_probes = {
+        "disk": disk_probe,
+        "docker": docker_probe,
+        "backups": backups_probe,
+    }
+
+    def shed_summary_response(cached, decision, started):
+        """Секции из последних удачных результатов без запуска проб; 503, если нет ни одной"""
+        g.shed = decision.reason
+        sections = {}
+        for name, result in cached.items():
+            if result is None:
+                sections[name] = {"status": "error", "duration_ms": 0.0, "error": overloaded_error(decision)}
+                continue
+            section = {"status": "ok" if result.fresh else "stale", "duration_ms": 0.0, "data": result.value}
+            if not result.fresh:
+                section.update(error=overloaded_error(decision), age_seconds=result.age_seconds)
+            sections[name] = section
+        body = {
+            "sections": sections,
+            "complete": all(s["status"] == "ok" for s in sections.values()),
+            "shed": decision.reason,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        if all("data" not in s for s in sections.values()):
+            admission.record_shed("summary", decision, "unavailable")
+            return body, 503, {"Retry-After": admission.retry_after_header(decision)}
+        admission.record_shed("summary", decision, "stale")
+        return body
+
+    @app.route("/api/system/summary")
+    def system_summary():
+        """Диск, контейнеры и бэкапы за один запрос: пробы параллельно, у каждой свой таймаут
+
+        Секция, не успевшая к сроку, отдается с последним удачным значением (stale)
+        или без данных (timeout/error) - остальные секции от нее не ждут.
+        """
+        requested = request.args.get("sections")
+        names = [n.strip() for n in requested.split(",") if n.strip()] if requested else list(summary_probes)
+        unknown = [n for n in names if n not in summary_probes]
+        if unknown or not names:
+            return {"error": f"Неизвестные секции: {', '.join(unknown)}", "available": list(summary_probes)}, 400
+
+        started = time.perf_counter()
+        names = list(dict.fromkeys(names))
+        cached = {n: probes.cached(n) for n in names}
+        if not all(c is not None and c.fresh for c in cached.values()):
+            decision = admission.try_enter(admission_client())
+            if not decision.admitted:
+                return shed_summary_response(cached, decision, started)
+            try:
+                results = probes.gather({n: (summary_probes[n], probe_timeouts[n]) for n in names})
+            finally:
+                admission.leave()
+        else:
+            results = {n: (c, 0.0) for n, c in cached.items()}
+        sections = {}
+        for name, (result, seconds) in results.items():
+            section = {"status": "ok" if result.fresh else result.status, "duration_ms": round(seconds * 1000, 1)}
+            if result.value is not None:
+                section["data"] = result.value
+                if not result.fresh:
+                    section.update(status="stale", error=result.error, age_seconds=result.age_seconds)
+            else:
+                section["error"] = result.error
+            sections[name] = section
+        return {
+            "sections": sections,
+            "complete": all(s["status"] == "ok" for s in sections.values()),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    # Диск и бэкапы не имеют потока событий - один фоновый опрос на воркер вместо опроса из каждой вкладки
+    live_interval = float(os.environ.get('LIVE_UPDATES_INTERVAL', '30'))
+    disk_topic = PolledTopic("disk", lambda: probes.value("disk", disk_probe, probe_timeouts["disk"]),
+                             broadcaster, interval=live_interval)
+    backups_topic = PolledTopic("backups", lambda: probes.value("backups", backups_probe, probe_timeouts["backups"]),
+                                broadcaster, interval=live_interval)
+    stream_max_seconds = float(os.environ.get('LIVE_STREAM_MAX_SECONDS', '300'))
+    # Под gthread каждая открытая вкладка держит поток воркера до LIVE_STREAM_MAX_SECONDS -
+    # потокам для страниц и /metrics должно оставаться место. Гринлеты gevent дешевые, там без ограничения.
+    default_streams = 0 if os.environ.get('GUNICORN_WORKER_CLASS', 'gthread') == 'gevent' \
+        else max(1, int(os.environ.get('GUNICORN_THREADS', '8')) // 4)
+    streams = ConcurrencyLimiter(int(os.environ.get('LIVE_STREAM_MAX_CONCURRENT', str(default_streams))))
+
+    @app.route("/api/system/stream")
+    def system_stream():
+        """SSE: начальный снимок, затем только изменения"""
+        if not streams.try_acquire():
+            g.shed = "streams"
+            # EventSource не переподключается после 503 - страница переходит на опрос
+            return ({"error": "Слишком много открытых потоков обновлений, используйте опрос"}, 503,
+                    {"Retry-After": str(max(1, int(stream_max_seconds)))})
+        try:
+            disk_topic.start()
+            backups_topic.start()
+            # Подписываемся до снятия снимка, чтобы не потерять изменения между ними
+            subscription = broadcaster.subscribe()
+            snapshot = {
+                "docker": probes.value("docker", docker_probe, probe_timeouts["docker"]),
+                "disk": disk_topic.current(),
+                "backups": backups_topic.current()
+            }
+        except Exception:
+            streams.release()
+            raise
+
+        def generate():
+            yield "retry: 3000\n\n"
+            yield format_sse("snapshot", snapshot)
+            # Соединение периодически закрывается, браузер переподключается сам
+            deadline = time.monotonic() + stream_max_seconds
+            while not subscription.overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event, data = subscription.get(timeout=min(15, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+
+        def close():
+            # Вызывается сервером при закрытии ответа, даже если клиент ушел до первого события
+            broadcaster.unsubscribe(subscription)
+            streams.release()
+
+        response = Response(generate(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+        response.call_on_close(close)
+        return response
+
     # API endpoint для создания бэкапа удален - используем только автоматические бэкапы
 
+    # Первый запрос к воркеру не должен платить за загрузку переводов, шаблонов и модулей
+    if os.environ.get('APP_WARMUP', 'true') == 'true':
+        app.config["WARMUP"] = warm_up(app, translations, render_page,
+                                       pages=("index.html", "about.html", "monitoring.html", "architecture.html"))
+
     return app
 
 
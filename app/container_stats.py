@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Потребление ресурсов контейнеров: CPU, память и сеть по Docker Engine API
+container.stats() через SDK по одному контейнеру занимает около секунды на каждый.
+Здесь фоновый поток раз в interval берет список запущенных контейнеров и запрашивает
+/containers/{id}/stats?stream=false&one-shot=true параллельно в ограниченном пуле;
+сбор ждет не дольше budget секунд независимо от числа контейнеров. Не успевшие ответы
+дописываются по готовности, а контейнер, чей запрос еще выполняется, в следующий сбор
+не запрашивается повторно. CPU% и скорости сети считаются по разнице с прошлым ответом.
+
+API вызывается напрямую по HTTP (unix сокет или tcp из DOCKER_HOST) без docker SDK,
+поэтому его легко подменить заглушкой (infra/monitoring/stub_docker.py).
+"""
+
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import quote, urlsplit
+
+from prometheus_client.core import GaugeMetricFamily
+
+from spans import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCKER_HOST = "unix:///var/run/docker.sock"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP поверх unix сокета (как у docker CLI)"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DockerEngineClient:
+    """GET запросы к Docker Engine API; keep-alive соединение на поток"""
+
+    def __init__(self, docker_host=DEFAULT_DOCKER_HOST, timeout=5.0):
+        self.timeout = timeout
+        url = urlsplit(docker_host)
+        if url.scheme == "unix":
+            self._connect = lambda: UnixHTTPConnection(url.path, timeout=self.timeout)
+        elif url.scheme in ("tcp", "http"):
+            self._connect = lambda: http.client.HTTPConnection(url.hostname, url.port or 2375, timeout=self.timeout)
+        else:
+            raise ValueError(f"Неподдерживаемый DOCKER_HOST: {docker_host}")
+        self._local = threading.local()
+
+    def get_json(self, path):
+        for attempt in (1, 2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = self._local.connection = self._connect()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                # Сервер мог закрыть простаивавшее keep-alive соединение - одна повторная попытка
+                if attempt == 2:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(f"Docker API {path}: HTTP {response.status} {body[:200]!r}")
+            return json.loads(body)
+
+
+def parse_stats(stats):
+    """Счетчики из ответа /stats: накопленные CPU и сеть, текущая память"""
+    cpu = stats.get("cpu_stats") or {}
+    cpu_usage = cpu.get("cpu_usage") or {}
+    memory = stats.get("memory_stats") or {}
+    memory_details = memory.get("stats") or {}
+    networks = stats.get("networks") or {}
+    # Как docker stats: кеш страниц (inactive_file в cgroup v2, total_inactive_file в v1) не считается
+    cache = memory_details.get("inactive_file", memory_details.get("total_inactive_file", 0))
+    usage = memory.get("usage")
+    return {
+        "cpu_total": cpu_usage.get("total_usage"),
+        "system_total": cpu.get("system_cpu_usage"),
+        "online_cpus": cpu.get("online_cpus") or len(cpu_usage.get("percpu_usage") or []) or 1,
+        "memory_bytes": max(0, usage - cache) if usage is not None else None,
+        "memory_limit_bytes": memory.get("limit"),
+        "rx_bytes": sum(n.get("rx_bytes", 0) for n in networks.values()) if networks else None,
+        "tx_bytes": sum(n.get("tx_bytes", 0) for n in networks.values()) if networks else None,
+    }
+
+
+def compute_rates(previous, current, elapsed):
+    """CPU% и скорости сети по двум последовательным ответам"""
+    rates = {"cpu_percent": None, "net_rx_bps": None, "net_tx_bps": None}
+    if previous is None:
+        return rates
+    if None not in (current["cpu_total"], previous["cpu_total"], current["system_total"], previous["system_total"]):
+        cpu_delta = current["cpu_total"] - previous["cpu_total"]
+        system_delta = current["system_total"] - previous["system_total"]
+        if system_delta > 0 and cpu_delta >= 0:
+            rates["cpu_percent"] = round(cpu_delta / system_delta * current["online_cpus"] * 100, 2)
+    if elapsed > 0:
+        for key, rate in (("rx_bytes", "net_rx_bps"), ("tx_bytes", "net_tx_bps")):
+            if current[key] is not None and previous[key] is not None and current[key] >= previous[key]:
+                rates[rate] = round((current[key] - previous[key]) / elapsed, 1)
+    return rates
+
+
+class ContainerStatsSampler:
+    """Фоновый сбор статистики контейнеров с ограниченным пулом и бюджетом времени на сбор"""
+
+    def __init__(self, client, interval=15.0, workers=8, budget=5.0):
+        self.client = client
+        self.interval = interval
+        self.workers = workers
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._pid = None
+        # имя -> {"id", "counters", "at", "stats"}
+        self._containers = {}
+        self._inflight = set()
+        self.last_sample = {"at": None, "duration_seconds": None, "containers": 0, "completed": 0, "error": None}
+
+    def start(self):
+        # Потоки и пул не переживают fork - каждый воркер запускает свои
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="container-stats", daemon=True).start()
+
+    def _executor(self):
+        # Вызывается под self._lock
+        if self._pool_pid != os.getpid():
+            self._pool_pid = os.getpid()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="container-stats")
+            self._inflight = set()
+        return self._pool
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            self.sample()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def _fetch(self, name, container_id):
+        try:
+            with span("docker.stats"):
+                stats = self.client.get_json(f"/containers/{quote(container_id)}/stats?stream=false&one-shot=true")
+            self.record(name, container_id, parse_stats(stats), time.monotonic())
+        except Exception as e:
+            logger.debug("Статистика контейнера %s недоступна: %s", name, e)
+        finally:
+            with self._lock:
+                self._inflight.discard(container_id)
+
+    def record(self, name, container_id, counters, at):
+        with self._lock:
+            entry = self._containers.get(name)
+            previous = entry["counters"] if entry is not None and entry["id"] == container_id else None
+            elapsed = at - entry["at"] if previous is not None else 0.0
+            stats = {
+                "memory_bytes": counters["memory_bytes"],
+                "memory_limit_bytes": counters["memory_limit_bytes"],
+                "memory_percent": round(counters["memory_bytes"] / counters["memory_limit_bytes"] * 100, 2)
+                if counters["memory_bytes"] is not None and counters["memory_limit_bytes"] else None,
+                **compute_rates(previous, counters, elapsed),
+                "sampled_at": time.time(),
+            }
+            self._containers[name] = {"id": container_id, "counters": counters, "at": at, "stats": stats}
+
+    def sample(self):
+        """Один сбор: список контейнеров, затем параллельные запросы статистики не дольше budget"""
+        started = time.monotonic()
+        try:
+            with span("docker.list"):
+                items = self.client.get_json("/containers/json")
+        except Exception as e:
+            logger.warning("Список контейнеров для статистики недоступен: %s", e)
+            self.last_sample = dict(self.last_sample, at=time.time(), error=str(e))
+            return self.last_sample
+
+        running = {}
+        for item in items:
+            names = item.get("Names") or [item.get("Id", "")[:12]]
+            running[names[0].lstrip("/")] = item["Id"]
+
+        futures = []
+        with self._lock:
+            pool = self._executor()
+            # Остановленные и удаленные контейнеры больше не показываем
+            for name in list(self._containers):
+                if name not in running:
+                    del self._containers[name]
+            for name, container_id in running.items():
+                if container_id in self._inflight:
+                    continue
+                self._inflight.add(container_id)
+                futures.append(pool.submit(self._fetch, name, container_id))
+
+        wait(futures, timeout=self.budget)
+        with self._lock:
+            # Обновленные за этот сбор, включая опоздавшие ответы прошлых сборов
+            updated = sum(1 for entry in self._containers.values() if entry["at"] >= started)
+        self.last_sample = {
+            "at": time.time(),
+            "duration_seconds": round(time.monotonic() - started, 3),
+            "containers": len(running),
+            "completed": updated,
+            "error": None,
+        }
+        if updated < len(running):
+            logger.info("Статистика контейнеров: обновлено %d из %d за %.1f с", updated, len(running), self.budget)
+        return self.last_sample
+
+    def stats(self):
+        """{имя контейнера: статистика} из памяти"""
+        with self._lock:
+            return {name: dict(entry["stats"]) for name, entry in self._containers.items()}
+
+    def annotate(self, snapshot):
+        """Добавляет к снимку контейнеров (ContainerStateCollector) поле stats по имени"""
+        stats = self.stats()
+        containers = [dict(c, stats=stats[c.get("Names")]) if c.get("Names") in stats else c
+                      for c in snapshot.get("containers", [])]
+        return dict(snapshot, containers=containers)
+
+    def describe(self):
+        """Без вызова collect() при регистрации"""
+        return []
+
+    def collect(self):
+        """Gauge по контейнерам - при скрейпе, из памяти ответившего воркера"""
+        with self._lock:
+            entries = {name: entry["stats"] for name, entry in self._containers.items()}
+        families = {
+            "cpu_percent": GaugeMetricFamily("app_container_cpu_percent", "Container CPU usage percent",
+                                             labels=["container"]),
+            "memory_bytes": GaugeMetricFamily("app_container_memory_bytes", "Container memory usage without page cache",
+                                              labels=["container"]),
+            "memory_limit_bytes": GaugeMetricFamily("app_container_memory_limit_bytes", "Container memory limit",
+                                                    labels=["container"]),
+            "net_rx_bps": GaugeMetricFamily("app_container_network_receive_bytes_per_second",
+                                            "Container network receive rate", labels=["container"]),
+            "net_tx_bps": GaugeMetricFamily("app_container_network_transmit_bytes_per_second",
+                                            "Container network transmit rate", labels=["container"]),
+        }
+        for name, stats in entries.items():
+            for key, family in families.items():
+                if stats.get(key) is not None:
+                    family.add_metric([name], stats[key])
+        yield from families.values()
+        if self.last_sample["duration_seconds"] is not None:
+            yield GaugeMetricFamily("app_container_stats_sample_seconds", "Duration of the last container stats sample",
+                                    value=self.last_sample["duration_seconds"])
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+История диска и ввода-вывода в памяти процесса для спарклайнов дашборда
+Фоновый поток раз в interval секунд читает /proc/mounts, statvfs всех настоящих
+файловых систем (и явно заданных путей вроде /opt/backups) и /proc/diskstats.
+Значения пишутся в кольцевые буферы фиксированного размера на массивах array('d'),
+поэтому память не растет со временем: retention / interval точек на поле и точку монтирования.
+История отдается прореженной до нужного числа точек, время до заполнения - по тренду.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Псевдо файловые системы: их заполнение ничего не говорит о дисках
+PSEUDO_FSTYPES = frozenset((
+    "proc", "sysfs", "devtmpfs", "devpts", "tmpfs", "cgroup", "cgroup2", "mqueue", "debugfs", "tracefs",
+    "securityfs", "pstore", "bpf", "configfs", "fusectl", "hugetlbfs", "autofs", "binfmt_misc", "nsfs",
+    "rpc_pipefs", "squashfs", "ramfs", "efivarfs", "selinuxfs",
+))
+
+FIELDS = ("used_bytes", "avail_bytes", "inodes_used", "read_bps", "write_bps")
+
+SECTOR_SIZE = 512
+
+OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(path):
+    # В /proc/mounts пробелы и табуляции в путях записаны как \040, \011
+    return OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), path)
+
+
+def read_mounts(paths=(), proc_root="/proc", max_mounts=16):
+    """[(точка монтирования, устройство, тип ФС)] - настоящие ФС без повторов одного устройства
+
+    Явно заданные пути (paths) берутся всегда: в контейнере / - это overlay без устройства,
+    а /opt/backups - bind mount с того же диска, что и /etc/hosts.
+    """
+    entries = {}
+    with open(os.path.join(proc_root, "mounts")) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            device, mount, fstype = parts[0], _unescape(parts[1]), parts[2]
+            # Повторное монтирование поверх - последняя запись главная
+            entries[mount] = (device, fstype)
+
+    mounts = []
+    seen_devices = set()
+    for path in paths:
+        if os.path.isdir(path):
+            mount = _mount_point(path, entries)
+            device, fstype = entries.get(mount, ("", ""))
+            mounts.append((path, device, fstype))
+            seen_devices.add(_st_dev(path))
+    for mount, (device, fstype) in sorted(entries.items()):
+        if len(mounts) >= max_mounts:
+            break
+        if fstype in PSEUDO_FSTYPES or not device.startswith("/") or not os.path.isdir(mount):
+            # Не каталоги - bind mount отдельных файлов (/etc/hosts в контейнере)
+            continue
+        st_dev = _st_dev(mount)
+        if st_dev is None or st_dev in seen_devices:
+            continue
+        seen_devices.add(st_dev)
+        mounts.append((mount, device, fstype))
+    return mounts
+
+
+def _mount_point(path, entries):
+    path = os.path.realpath(path)
+    while path not in entries and path != "/":
+        path = os.path.dirname(path)
+    return path
+
+
+def _st_dev(path):
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def read_diskstats(proc_root="/proc"):
+    """{(major, minor): (прочитано байт, записано байт)} с момента загрузки"""
+    stats = {}
+    try:
+        with open(os.path.join(proc_root, "diskstats")) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 10:
+                    stats[(int(parts[0]), int(parts[1]))] = (int(parts[5]) * SECTOR_SIZE, int(parts[9]) * SECTOR_SIZE)
+    except OSError:
+        pass
+    return stats
+
+
+class RingBuffer:
+    """Кольцевой буфер на массивах double: время и по массиву на каждое поле"""
+
+    def __init__(self, capacity, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.times = array("d", bytes(8 * capacity))
+        self.values = {name: array("d", bytes(8 * capacity)) for name in fields}
+        self.count = 0
+        self._next = 0
+
+    def append(self, ts, values):
+        i = self._next
+        self.times[i] = ts
+        for name in self.fields:
+            value = values.get(name)
+            self.values[name][i] = math.nan if value is None else value
+        self._next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last_time(self):
+        return self.times[(self._next - 1) % self.capacity] if self.count else None
+
+    def indices(self, since=None):
+        """Индексы от старых к новым (с момента since)"""
+        start = (self._next - self.count) % self.capacity
+        for k in range(self.count):
+            i = (start + k) % self.capacity
+            if since is None or self.times[i] >= since:
+                yield i
+
+    def downsample(self, since, until, points):
+        """Среднее по points равным интервалам времени; пустой интервал - None
+
+        Проход по буферу один, память - O(points) независимо от размера буфера.
+        """
+        width = (until - since) / points
+        sums = {name: [0.0] * points for name in self.fields}
+        counts = {name: [0] * points for name in self.fields}
+        for i in self.indices(since):
+            bucket = min(points - 1, int((self.times[i] - since) / width))
+            for name in self.fields:
+                value = self.values[name][i]
+                if not math.isnan(value):
+                    sums[name][bucket] += value
+                    counts[name][bucket] += 1
+        series = {"t": [round(since + width * (b + 0.5)) for b in range(points)]}
+        for name in self.fields:
+            series[name] = [round(s / c, 1) if c else None for s, c in zip(sums[name], counts[name])]
+        return series
+
+    def trend(self, field, since):
+        """Наклон поля в единицах в секунду (наименьшие квадраты) и число точек"""
+        n = sum_t = sum_v = sum_tt = sum_tv = 0.0
+        values = self.values[field]
+        t0 = v0 = None
+        for i in self.indices(since):
+            value = values[i]
+            if math.isnan(value):
+                continue
+            if t0 is None:
+                # Отсчет от первой точки: суммы квадратов сотен гигабайт иначе теряют точность
+                t0, v0 = self.times[i], value
+            t = self.times[i] - t0
+            value -= v0
+            n += 1
+            sum_t += t
+            sum_v += value
+            sum_tt += t * t
+            sum_tv += t * value
+        denominator = n * sum_tt - sum_t * sum_t
+        if n < 3 or denominator <= 0:
+            return None, int(n)
+        return (n * sum_tv - sum_t * sum_v) / denominator, int(n)
+
+
+class DiskHistory:
+    """Фоновая выборка диска и I/O по всем точкам монтирования в кольцевые буферы
+
+    sample() выполняет чтение; runner(fn) позволяет вызывать его через пул проб
+    (под gevent statvfs иначе заблокировал бы весь воркер).
+    """
+
+    def __init__(self, paths=("/",), interval=30.0, retention=86400.0, trend_window=21600.0,
+                 proc_root="/proc", runner=None, max_mounts=16):
+        self.paths = tuple(paths)
+        self.interval = interval
+        self.retention = retention
+        self.trend_window = trend_window
+        self.proc_root = proc_root
+        self.max_mounts = max_mounts
+        self.capacity = max(2, int(math.ceil(retention / interval)))
+        self.runner = runner or (lambda fn: fn())
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._info = {}
+        self._io = {}
+        self._pid = None
+
+    def start(self):
+        # Потоки не переживают fork, поэтому запускаем в каждом воркере отдельно
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="disk-history", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        try:
+            readings = self.runner(self.sample)
+        except Exception as e:
+            logger.warning("Ошибка выборки диска: %s", e)
+            return
+        if readings is not None:
+            self.record(readings)
+
+    def sample(self):
+        """Одно чтение: время, {точка монтирования: значения}, счетчики I/O"""
+        ts = time.time()
+        diskstats = read_diskstats(self.proc_root)
+        readings = {}
+        for mount, device, fstype in read_mounts(self.paths, self.proc_root, self.max_mounts):
+            try:
+                st = os.statvfs(mount)
+                st_dev = os.stat(mount).st_dev
+            except OSError as e:
+                logger.debug("statvfs %s: %s", mount, e)
+                continue
+            total = st.f_blocks * st.f_frsize
+            readings[mount] = {
+                "device": device,
+                "fstype": fstype,
+                "total_bytes": total,
+                "used_bytes": total - st.f_bfree * st.f_frsize,
+                "avail_bytes": st.f_bavail * st.f_frsize,
+                "inodes_total": st.f_files or None,
+                "inodes_used": st.f_files - st.f_ffree if st.f_files else None,
+                # У overlay и btrfs анонимное устройство - счетчиков I/O для них нет
+                "io": diskstats.get((os.major(st_dev), os.minor(st_dev))),
+            }
+        return ts, readings
+
+    def record(self, readings):
+        ts, mounts = readings
+        with self._lock:
+            for mount, reading in mounts.items():
+                buffer = self._buffers.get(mount)
+                if buffer is None:
+                    if len(self._buffers) >= self.max_mounts:
+                        continue
+                    buffer = self._buffers[mount] = RingBuffer(self.capacity)
+                if buffer.last_time() is not None and ts <= buffer.last_time():
+                    # Повтор прошлого чтения (проба не успела и вернула последний результат)
+                    continue
+                values = dict(reading)
+                io, previous = reading["io"], self._io.get(mount)
+                if io is not None and previous is not None and ts > previous[0]:
+                    elapsed = ts - previous[0]
+                    # Счетчики сбрасываются при переподключении диска - отрицательную разницу не пишем
+                    values["read_bps"] = max(0.0, (io[0] - previous[1][0]) / elapsed)
+                    values["write_bps"] = max(0.0, (io[1] - previous[1][1]) / elapsed)
+                self._io[mount] = (ts, io) if io is not None else None
+                buffer.append(ts, values)
+                self._info[mount] = dict(values, io=None, ts=ts)
+
+    def time_to_full(self, mount, now=None):
+        """Секунд до исчерпания свободного места по тренду занятого; None, если места не убывает"""
+        with self._lock:
+            buffer, info = self._buffers.get(mount), self._info.get(mount)
+            if buffer is None:
+                return None
+            now = now or buffer.last_time()
+            slope, _ = buffer.trend("used_bytes", now - self.trend_window)
+        if slope is None or slope <= 0:
+            return None
+        return round(info["avail_bytes"] / slope)
+
+    def history(self, mounts=None, window=3600.0, points=60):
+        """Текущие значения, прореженные ряды и время до заполнения по точкам монтирования"""
+        window = min(window, self.retention)
+        result = []
+        with self._lock:
+            selected = [m for m in self._buffers if mounts is None or m in mounts]
+        for mount in selected:
+            with self._lock:
+                buffer, info = self._buffers[mount], self._info[mount]
+                until = buffer.last_time()
+                series = buffer.downsample(until - window, until, points)
+            total = info["total_bytes"]
+            result.append({
+                "mount": mount,
+                "device": info["device"],
+                "fstype": info["fstype"],
+                "total_bytes": total,
+                "used_bytes": info["used_bytes"],
+                "avail_bytes": info["avail_bytes"],
+                "percent_used": round(info["used_bytes"] / total * 100, 2) if total else None,
+                "inodes_total": info["inodes_total"],
+                "inodes_used": info["inodes_used"],
+                "read_bps": info.get("read_bps"),
+                "write_bps": info.get("write_bps"),
+                "time_to_full_seconds": self.time_to_full(mount),
+                "sampled_at": info["ts"],
+                "series": series,
+            })
+        return {"interval": self.interval, "window": window, "points": points, "mounts": result}
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновый сборщик состояния Docker контейнеров
+Один поток на процесс опрашивает Docker, запросы читают готовый снимок из памяти.
+Между опросами снимок обновляется по потоку событий Docker (docker events).
+"""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from spans import span
+
+logger = logging.getLogger(__name__)
+
+# Последний fallback - статическая информация, если Docker недоступен совсем
+STATIC_CONTAINERS = [
+    {'Names': name, 'Status': 'Up', 'State': 'running', 'status_icon': '🟢', 'status_text': 'UP'}
+    for name in ('app', 'nginx', 'prometheus', 'grafana', 'loki', 'promtail', 'alertmanager', 'node-exporter')
+]
+
+# Действия из docker events, меняющие UP/DOWN статус контейнера
+RUNNING_ACTIONS = {'start': 'Up', 'unpause': 'Up', 'restart': 'Up'}
+STOPPED_ACTIONS = {'die': 'Exited', 'stop': 'Exited', 'oom': 'Exited', 'pause': 'Paused', 'create': 'Created'}
+
+DOCKER_PS_FORMAT = '{"Names":"{{.Names}}","Status":"{{.Status}}","State":"{{.State}}","Image":"{{.Image}}"}'
+
+
+def container_view(name, status, running, image=None):
+    """Приводит контейнер к формату, который ожидает дашборд"""
+    info = {
+        'Names': name,
+        'Status': status,
+        'State': 'running' if running else 'stopped',
+        'status_icon': '🟢' if running else '🔴',
+        'status_text': 'UP' if running else 'DOWN',
+    }
+    if image is not None:
+        info['Image'] = image
+    return info
+
+
+def _visible_state(container):
+    # "Up 5 minutes" меняется каждую минуту, клиентам важен только UP/DOWN
+    return container.get('State'), container.get('Image')
+
+
+class ContainerStateCollector:
+    """Хранит общий снимок контейнеров и обновляет его в фоновом потоке"""
+
+    def __init__(self, ttl=15.0, timeout=10.0, broadcaster=None, watch_events=True, events_source=None):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.broadcaster = broadcaster
+        self.watch_events = watch_events
+        # Источник событий можно подменить (например, списком фейковых событий)
+        self.events_source = events_source
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wakeup = threading.Event()
+        self._snapshot = None
+        self._collected_at = 0.0
+        self._client = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Потоки не переживают fork, поэтому каждый gunicorn воркер запускает свой
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._client = None
+            self._ready.clear()
+            threading.Thread(target=self._run, name="docker-state", daemon=True).start()
+            if self.watch_events:
+                threading.Thread(target=self._watch_events, name="docker-events", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._wakeup.wait(self.ttl)
+            self._wakeup.clear()
+
+    def _watch_events(self):
+        backoff = 1.0
+        while True:
+            try:
+                for event in self._events():
+                    self.apply_event(event)
+                    backoff = 1.0
+            except Exception as e:
+                logger.warning("Поток событий Docker прерван: %s", e)
+            # После разрыва сверяем снимок полным опросом, события могли потеряться
+            self._wakeup.set()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def _events(self):
+        if self.events_source is not None:
+            return self.events_source()
+        import docker
+        # Отдельный клиент без таймаута чтения: поток событий может долго молчать
+        client = docker.from_env(timeout=None)
+        return client.events(decode=True, filters={'type': 'container'})
+
+    def _docker_client(self):
+        if self._client is None:
+            import docker
+            with span("docker.connect"):
+                self._client = docker.from_env(timeout=self.timeout)
+        return self._client
+
+    def _collect_sdk(self):
+        # Один запрос к /containers/json вместо inspect по каждому контейнеру
+        containers = []
+        client = self._docker_client()
+        with span("docker.sdk"):
+            items = client.api.containers(all=True)
+        for item in items:
+            names = item.get('Names') or ['unknown']
+            containers.append(container_view(
+                names[0].lstrip('/'),
+                item.get('Status', ''),
+                item.get('State') == 'running',
+                item.get('Image', 'unknown'),
+            ))
+        return containers
+
+    def _collect_cli(self):
+        with span("docker.cli"):
+            result = subprocess.run(
+                ['docker', 'ps', '-a', '--format', DOCKER_PS_FORMAT],
+                capture_output=True, text=True, timeout=self.timeout
+            )
+        containers = []
+        if result.returncode == 0:
+            for line in result.stdout.strip().split('\n'):
+                if not line.strip():
+                    continue
+                try:
+                    info = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                containers.append(container_view(
+                    info.get('Names'), info.get('Status', ''), 'Up' in info.get('Status', ''), info.get('Image')
+                ))
+        return containers
+
+    def collect(self):
+        """Однократно опрашивает Docker: SDK, затем docker ps, затем статический список"""
+        try:
+            containers = self._collect_sdk()
+            return {"containers": containers, "debug": {"method": "docker_python", "count": len(containers)}}
+        except Exception as e:
+            self._client = None
+            logger.warning("Docker Python API недоступен: %s", e)
+
+        try:
+            containers = self._collect_cli()
+            if containers:
+                return {"containers": containers, "debug": {"method": "docker_api", "count": len(containers)}}
+        except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.CalledProcessError) as e:
+            logger.warning("Docker API недоступен: %s", e)
+
+        return {
+            "containers": [dict(c) for c in STATIC_CONTAINERS],
+            "debug": {"method": "static_fallback", "warning": "Real Docker API unavailable"}
+        }
+
+    def refresh(self):
+        """Обновляет снимок; вызывается фоновым потоком"""
+        try:
+            snapshot = self.collect()
+        except Exception as e:
+            snapshot = {"error": str(e), "containers": [], "debug": {"exception": str(e)}}
+        with self._lock:
+            previous = self._snapshot
+            self._snapshot = snapshot
+            self._collected_at = time.time()
+        self._ready.set()
+        if previous is not None:
+            self._publish_diff(previous.get("containers", []), snapshot.get("containers", []))
+        return snapshot
+
+    def apply_event(self, event):
+        """Применяет одно событие Docker к снимку и публикует дельты"""
+        if event.get('Type') != 'container':
+            return []
+        # exec_start и подобные приходят как "exec_start: sh -c ..."
+        action = event.get('Action', event.get('status', '')).split(':')[0].strip()
+        attrs = event.get('Actor', {}).get('Attributes', {})
+        name = attrs.get('name')
+        if not name:
+            return []
+
+        with self._lock:
+            if self._snapshot is None:
+                return []
+            containers = {c['Names']: c for c in self._snapshot.get('containers', [])}
+            deltas = []
+            if action == 'destroy':
+                if containers.pop(name, None) is not None:
+                    deltas.append({"op": "remove", "name": name})
+            elif action == 'rename':
+                old_name = attrs.get('oldName', '').lstrip('/')
+                current = containers.pop(old_name, None) or container_view(name, 'Up', True, attrs.get('image'))
+                current = dict(current, Names=name)
+                containers[name] = current
+                if old_name:
+                    deltas.append({"op": "remove", "name": old_name})
+                deltas.append({"op": "upsert", "container": current})
+            elif action in RUNNING_ACTIONS or action in STOPPED_ACTIONS:
+                running = action in RUNNING_ACTIONS
+                status = RUNNING_ACTIONS.get(action) or STOPPED_ACTIONS[action]
+                image = attrs.get('image') or event.get('from')
+                current = container_view(name, status, running, image)
+                previous = containers.get(name)
+                if previous is None or _visible_state(previous) != _visible_state(current):
+                    containers[name] = current
+                    deltas.append({"op": "upsert", "container": current})
+            if not deltas:
+                return []
+            self._snapshot = dict(self._snapshot, containers=list(containers.values()))
+            self._collected_at = time.time()
+        for delta in deltas:
+            self._publish("docker", delta)
+        return deltas
+
+    def _publish_diff(self, old, new):
+        old_by_name = {c.get('Names'): c for c in old}
+        new_by_name = {c.get('Names'): c for c in new}
+        for name, container in new_by_name.items():
+            previous = old_by_name.get(name)
+            if previous is None or _visible_state(previous) != _visible_state(container):
+                self._publish("docker", {"op": "upsert", "container": container})
+        for name in old_by_name.keys() - new_by_name.keys():
+            self._publish("docker", {"op": "remove", "name": name})
+
+    def _publish(self, event, data):
+        if self.broadcaster is not None:
+            self.broadcaster.publish(event, data)
+
+    def peek(self):
+        """Текущий снимок без ожидания первичного сбора (None, если его еще нет)"""
+        self._ensure_started()
+        with self._lock:
+            return self._snapshot
+
+    def get_snapshot(self):
+        """Возвращает снимок из памяти (stale-while-revalidate)"""
+        self._ensure_started()
+        if not self._ready.is_set():
+            # Только самый первый запрос воркера ждет первичный сбор
+            self._ready.wait(self.timeout)
+
+        with self._lock:
+            snapshot = self._snapshot
+            collected_at = self._collected_at
+
+        if snapshot is None:
+            return {
+                "containers": [],
+                "error": "Docker state is not collected yet",
+                "debug": {"method": "pending"},
+                "collected_at": None,
+                "age_seconds": None,
+                "stale": True
+            }
+
+        age = time.time() - collected_at
+        stale = age > self.ttl
+        if stale:
+            # Фоновый поток мог уснуть на долгом ttl - будим его, но не ждем
+            self._wakeup.set()
+
+        response = dict(snapshot)
+        response["collected_at"] = datetime.fromtimestamp(collected_at).strftime("%Y-%m-%d %H:%M:%S")
+        response["age_seconds"] = round(age, 3)
+        response["stale"] = stale
+        return response
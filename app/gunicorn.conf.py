@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Конфигурация gunicorn и хуки для multiprocess метрик Prometheus
+Файл подхватывается gunicorn автоматически из рабочей директории (/app)
+
+С preload_app (GUNICORN_PRELOAD=true, по умолчанию для gthread) create_app() и прогрев
+выполняются один раз в мастере, воркеры получают готовое приложение через fork.
+
+Режим обслуживания выбирается переменными окружения:
+    GUNICORN_WORKER_CLASS=gthread (по умолчанию) - потоки; пробы уходят в отдельный пул с таймаутом
+    GUNICORN_WORKER_CLASS=gevent - тысячи соединений на воркер; нужен пакет gevent (образ с SERVING_MODE=gevent)
+"""
+
+import os
+
+from metrics_registry import MULTIPROC_DIR, prepare_multiproc_dir, compact_dead_worker
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+# gthread: долгие SSE соединения (/api/system/stream) и медленные пробы не занимают воркер целиком
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+# gevent: предел одновременных соединений на воркер
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+# gevent патчит threading/socket в воркере - модули, импортированные мастером раньше, остались бы непатченными
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false' if worker_class == 'gevent' else 'true').lower() == 'true'
+
+if MULTIPROC_DIR:
+    # С preload метрики создаются при импорте приложения, еще до on_starting;
+    # файлы мастера с наблюдениями прогрева затем удаляет prepare_multiproc_dir
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def on_starting(server):
+    # Значения от прошлого запуска мастера не должны попасть в новые счетчики
+    prepare_multiproc_dir()
+
+
+def child_exit(server, worker):
+    compact_dead_worker(worker.pid)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Инструментирование HTTP запросов для Prometheus
+Метки берутся из шаблона маршрута (url_rule), а не из сырого пути,
+поэтому сканеры со случайными URL не плодят новые серии.
+"""
+
+import time
+
+from flask import g, request
+from prometheus_client import Counter, Gauge, Histogram
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Все запросы, не попавшие ни в один маршрут (404 от сканеров), схлопываются в одну метку
+UNMATCHED_PATH = "<unmatched>"
+
+KNOWN_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+def parse_buckets(value):
+    """Границы гистограммы из строки вида "0.01,0.1,1" (например, из переменной окружения)"""
+    if not value:
+        return DEFAULT_BUCKETS
+    return tuple(sorted(float(item) for item in value.split(',') if item.strip()))
+
+
+class RequestInstrumentation:
+    """Счетчик запросов, гистограмма длительности и число запросов в обработке"""
+
+    def __init__(self, app=None, buckets=DEFAULT_BUCKETS):
+        self.requests_total = Counter(
+            "http_requests_total", "HTTP requests total", ["method", "path", "status"]
+        )
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "HTTP request duration in seconds",
+            ["method", "path"], buckets=buckets
+        )
+        # livesum: в multiprocess режиме суммируются только живые воркеры
+        self.in_flight = Gauge(
+            "app_active_connections", "Number of requests being processed", multiprocess_mode="livesum"
+        )
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        # teardown вызывается и при необработанном исключении - счетчик in-flight не "утекает"
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        self.in_flight.dec()
+        duration = time.perf_counter() - start
+        status = g.pop('_metrics_status', 500 if exc is not None else 200)
+        rule = request.url_rule
+        path = rule.rule if rule is not None else UNMATCHED_PATH
+        method = request.method if request.method in KNOWN_METHODS else "OTHER"
+        self.requests_total.labels(method=method, path=path, status=str(status)).inc()
+        self.request_duration.labels(method=method, path=path).observe(duration)
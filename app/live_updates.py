@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events для дашборда мониторинга
+Изменения публикуются один раз и раздаются всем подписчикам воркера
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event, data):
+    """Сериализует событие в формат text/event-stream"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """Очередь событий одного клиента"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Клиент, не успевающий читать, отключается и переподключается за свежим снимком
+        self.overflowed = False
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class UpdateBroadcaster:
+    """Раздает события всем подписанным SSE клиентам"""
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        sub = Subscription(self.max_queue)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait((event, data))
+            except queue.Full:
+                sub.overflowed = True
+                self.unsubscribe(sub)
+
+
+class PolledTopic:
+    """Периодически вычисляет значение и публикует его только при изменении"""
+
+    def __init__(self, name, compute, broadcaster, interval=30.0):
+        self.name = name
+        self.compute = compute
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self._last = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Потоки не переживают fork, поэтому запускаем в каждом воркере отдельно
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name=f"topic-{self.name}", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+    def poll(self):
+        try:
+            value = self.compute()
+        except Exception as e:
+            logger.warning("Ошибка обновления %s: %s", self.name, e)
+            return None
+        if value is None:
+            # Значение пока недоступно (например, таймаут пробы) - клиентам нечего отправлять
+            return self._last
+        if value != self._last:
+            self._last = value
+            self.broadcaster.publish(self.name, value)
+        return value
+
+    def current(self):
+        """Текущее значение для начального снимка нового клиента"""
+        if self._last is None:
+            return self.poll()
+        return self._last
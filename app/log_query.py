@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Прокси LogQL запросов к Loki для страницы /loki
+Диапазон режется на окна по фиксированной сетке, окна запрашиваются параллельно
+через общий пул соединений, а строки отдаются клиенту по мере готовности в порядке времени.
+В памяти одновременно не больше parallelism окон; закрытые окна (старше окна свежести)
+кешируются - повторный поиск по вчерашним логам не доходит до Loki.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Histogram
+
+from query_frontend import LRUCache, QueryError
+from spans import bind_context, span
+
+LOG_SHARDS = Counter("app_log_query_shards_total", "LogQL shard queries by cache result", ["result"])
+LOKI_DURATION = Histogram(
+    "app_log_query_upstream_seconds", "Loki query_range request duration in seconds",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+NS = 1_000_000_000
+
+
+def parse_time_ns(value, default):
+    """Время Loki API: наносекунды, unix секунды или RFC3339"""
+    if value in (None, ""):
+        return default
+    text = str(value)
+    if text.isdigit() and len(text) > 12:
+        return int(text)
+    try:
+        return int(float(text) * NS)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp() * NS)
+    except ValueError:
+        raise QueryError(400, "bad_data", f"invalid time {value!r}")
+
+
+def shard_range(start, end, interval, backward=True):
+    """Окна [a, b) по сетке, кратной interval, в порядке выдачи (новые первыми при backward)"""
+    shards = []
+    block = start // interval * interval
+    while block < end:
+        shards.append((max(start, block), min(end, block + interval)))
+        block += interval
+    return shards[::-1] if backward else shards
+
+
+def merge_streams(streams, backward=True):
+    """Строки всех потоков окна в порядке времени: (ts, метки, строка)
+
+    Внутри потока Loki уже отдает строки в порядке direction, поэтому достаточно слияния куч.
+    """
+    def entries(stream):
+        labels = stream.get("stream", {})
+        return ((int(ts), labels, line) for ts, line in stream.get("values", []))
+
+    return heapq.merge(*(entries(stream) for stream in streams), key=lambda entry: entry[0], reverse=backward)
+
+
+class LogQueryProxy:
+    """query_range Loki с разбиением по времени, потоковой выдачей и кешем закрытых окон"""
+
+    def __init__(self, base_url, shard_interval=900, parallelism=4, timeout=30,
+                 cache_entries=256, cache_lines=200_000, freshness=300, max_limit=5000):
+        self.base_url = base_url.rstrip("/")
+        self.shard_interval_ns = int(shard_interval * NS)
+        self.parallelism = parallelism
+        self.timeout = timeout
+        # В последние минуты Loki еще принимает строки (задержка promtail) - такие окна не кешируем
+        self.freshness_ns = int(freshness * NS)
+        self.max_limit = max_limit
+        self.cache = LRUCache(cache_entries, cache_lines)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._pool = None
+
+    def _resources(self):
+        # Ни соединения, ни потоки не переживают fork - каждый воркер создает свои
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.parallelism)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+                self._pool = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="log-query")
+            return self._session, self._pool
+
+    def _fetch_shard(self, query, start, end, limit, direction):
+        session, _ = self._resources()
+        started = time.perf_counter()
+        try:
+            with span("loki.query_range"):
+                response = session.get(f"{self.base_url}/loki/api/v1/query_range", timeout=self.timeout, params={
+                    "query": query, "start": str(start), "end": str(end), "limit": str(limit), "direction": direction
+                })
+        except requests.RequestException as e:
+            raise QueryError(502, "unavailable", f"Loki недоступен: {e}")
+        finally:
+            LOKI_DURATION.observe(time.perf_counter() - started)
+        if response.status_code != 200:
+            # Loki отдает ошибки разбора LogQL текстом, а не JSON
+            raise QueryError(response.status_code if response.status_code < 500 else 502,
+                             "bad_data" if response.status_code == 400 else "unavailable",
+                             response.text.strip()[:500] or f"HTTP {response.status_code}")
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            # HTML страница прокси или обрезанный ответ со статусом 200
+            raise QueryError(502, "bad_response", f"Loki вернул не JSON (HTTP {response.status_code})")
+        data = payload.get("data", {})
+        if data.get("resultType") != "streams":
+            raise QueryError(400, "bad_data", "поддерживаются только запросы логов (resultType streams)")
+        return data.get("result", []), []
+
+    def _shard(self, query, start, end, limit, direction, cacheable):
+        key = (query, start, end, limit, direction)
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None:
+                LOG_SHARDS.labels(result="hit").inc()
+                return None, cached
+        LOG_SHARDS.labels(result="miss").inc()
+        _, pool = self._resources()
+        return pool.submit(bind_context(self._fetch_shard), query, start, end, limit, direction), key if cacheable else None
+
+    def prepare(self, params):
+        """Проверяет параметры до начала потоковой выдачи: ошибка придет обычным ответом 400"""
+        query = params.get("query")
+        if not query:
+            raise QueryError(400, "bad_data", "parameter \"query\" is required")
+        now = time.time_ns()
+        end = parse_time_ns(params.get("end"), now)
+        start = parse_time_ns(params.get("start"), end - 3600 * NS)
+        if end <= start:
+            raise QueryError(400, "bad_data", "end timestamp must be after start time")
+        try:
+            limit = int(params.get("limit", 1000))
+        except ValueError:
+            raise QueryError(400, "bad_data", f"invalid limit {params.get('limit')!r}")
+        if limit <= 0:
+            raise QueryError(400, "bad_data", "limit must be a positive number")
+        direction = params.get("direction", "backward")
+        if direction not in ("backward", "forward"):
+            raise QueryError(400, "bad_data", f"invalid direction {direction!r}")
+        return query, start, end, min(limit, self.max_limit), direction
+
+    def stream(self, query, start, end, limit, direction):
+        """Генератор строк NDJSON: записи в порядке времени, последней строкой - итог
+
+        Окна запрашиваются с опережением не больше parallelism, поэтому память ограничена
+        несколькими окнами независимо от длины диапазона; после limit строк остальные отменяются.
+        """
+        backward = direction == "backward"
+        cache_before = time.time_ns() - self.freshness_ns
+        shards = iter(shard_range(start, end, self.shard_interval_ns, backward))
+        window = []
+        sent = hits = total = 0
+        started = time.perf_counter()
+
+        def submit_next():
+            nonlocal total
+            for a, b in shards:
+                total += 1
+                window.append(self._shard(query, a, b, limit, direction, b <= cache_before))
+                return
+
+        try:
+            for _ in range(self.parallelism):
+                submit_next()
+            while window and sent < limit:
+                future, cached = window.pop(0)
+                submit_next()
+                if future is None:
+                    hits += 1
+                    result = cached
+                else:
+                    result = future.result()
+                    if cached is not None:
+                        self.cache.put(cached, result)
+                for ts, labels, line in merge_streams(result[0], backward):
+                    yield json.dumps({"ts": str(ts), "labels": labels, "line": line}, ensure_ascii=False) + "\n"
+                    sent += 1
+                    if sent >= limit:
+                        break
+            summary = {"lines": sent, "shards": total, "cache_hits": hits, "limit_reached": sent >= limit,
+                       "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+            yield json.dumps({"summary": summary}) + "\n"
+        except QueryError as e:
+            yield json.dumps({"error": str(e), "errorType": e.error_type}, ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился или лимит набран: невыбранные окна Loki больше не нужны
+            for future, _ in window:
+                if future is not None:
+                    future.cancel()
+
+    def stats(self):
+        return dict(self.cache.stats(), upstream=self.base_url, shard_interval_seconds=self.shard_interval_ns / NS)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Реестр метрик Prometheus для нескольких gunicorn воркеров
+Если задан PROMETHEUS_MULTIPROC_DIR, каждый воркер пишет значения в mmap файлы,
+а /metrics агрегирует их, какой бы воркер ни ответил на запрос.
+"""
+
+import glob
+import gzip
+import os
+import shutil
+import threading
+import time
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.mmap_dict import MmapedDict
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Файлы с накопленными значениями завершившихся воркеров
+ARCHIVE_SUFFIX = "archive"
+
+_exposition_registry = None
+
+
+def is_multiprocess():
+    return bool(MULTIPROC_DIR)
+
+
+def exposition_registry():
+    """Реестр для /metrics: в multiprocess режиме собирает значения всех воркеров"""
+    global _exposition_registry
+    if not is_multiprocess():
+        return REGISTRY
+    if _exposition_registry is None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+        _exposition_registry = registry
+    return _exposition_registry
+
+
+def register_collector(collector):
+    """Регистрирует collector, вычисляемый при скрейпе, в реестре для /metrics"""
+    exposition_registry().register(collector)
+
+
+def generate_metrics(registry=None, encoder=generate_latest):
+    registry = registry or exposition_registry()
+    try:
+        return encoder(registry)
+    except FileNotFoundError:
+        # Файл завершившегося воркера мог быть сжат в архив между glob и чтением
+        return encoder(registry)
+
+
+class ExpositionCache:
+    """Кеш сериализованного ответа /metrics с коротким TTL
+
+    Частые скрейпы (несколько Prometheus, ручные curl) в пределах TTL отдают готовые байты.
+    Кешируется отдельно для каждого формата (text/OpenMetrics) и сжатия.
+    """
+
+    def __init__(self, ttl=5.0, registry=None):
+        self.ttl = ttl
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def render(self, accept_header, accept_encoding):
+        """Возвращает (body, headers) с учетом Accept и Accept-Encoding"""
+        encoder, content_type = choose_encoder(accept_header or '')
+        use_gzip = 'gzip' in (accept_encoding or '')
+        key = (content_type, use_gzip)
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is None or now - entry[0] >= self.ttl:
+            # Один поток сериализует, остальные ждут готовый результат
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or now - entry[0] >= self.ttl:
+                    body = generate_metrics(self.registry, encoder)
+                    if use_gzip:
+                        body = gzip.compress(body, compresslevel=6)
+                    entry = (time.monotonic(), body)
+                    self._entries[key] = entry
+
+        headers = {"Content-Type": content_type, "Vary": "Accept, Accept-Encoding"}
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+        return entry[1], headers
+
+
+def prepare_multiproc_dir(path=MULTIPROC_DIR):
+    """Очищает директорию при старте мастера: значения прошлого запуска не должны попасть в новый"""
+    if not path:
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def compact_dead_worker(pid, path=MULTIPROC_DIR):
+    """Переносит значения завершившегося воркера в архивные файлы
+
+    Счетчики и гистограммы должны оставаться монотонными после рестарта воркера,
+    но хранить по файлу на каждый когда-либо живший pid нельзя - иначе стоимость
+    скрейпа растет с каждым перезапуском. Вызывается из мастера (child_exit).
+    """
+    if not path:
+        return
+    multiprocess.mark_process_dead(pid, path)
+
+    for dead_file in glob.glob(os.path.join(path, f'*_{pid}.db')):
+        typ = os.path.basename(dead_file).split('_')[0]
+        if typ in ('counter', 'histogram', 'summary'):
+            archive = MmapedDict(os.path.join(path, f'{typ}_{ARCHIVE_SUFFIX}.db'))
+            try:
+                for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(dead_file):
+                    current, _ = archive.read_value(key)
+                    archive.write_value(key, current + value, timestamp)
+            finally:
+                archive.close()
+        # Значения не-live gauge мертвого воркера больше не актуальны
+        os.remove(dead_file)
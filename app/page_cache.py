@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Кеш отрендеренных страниц
+Страница зависит только от языка, поэтому HTML рендерится один раз на (шаблон, язык)
+и отдается с ETag; повторный визит получает 304 без тела.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from flask import Response, render_template, request
+
+from spans import span
+
+
+class PageCache:
+    """Кеш HTML страниц с инвалидацией по mtime шаблонов и версии данных (каталога переводов)
+
+    watch_dirs - каталоги, любой файл которых входит в подпись каждой страницы
+    (каталог шаблонов: правка base.html обновляет и страницы, которые его расширяют).
+    """
+
+    def __init__(self, app, watch_dirs=(), check_interval=2.0, cache_control="private, no-cache"):
+        self.app = app
+        self.watch_dirs = list(watch_dirs)
+        self.check_interval = check_interval
+        self.cache_control = cache_control
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._signatures = {}
+        self._checked_at = {}
+
+    def _template_path(self, template_name):
+        return os.path.join(self.app.root_path, self.app.template_folder, template_name)
+
+    def _signature(self, template_name):
+        # mtime шаблона и всех файлов переводов; пересчитывается не чаще раза в check_interval
+        now = time.monotonic()
+        if now - self._checked_at.get(template_name, float('-inf')) < self.check_interval:
+            return self._signatures[template_name]
+
+        paths = [self._template_path(template_name)]
+        for directory in self.watch_dirs:
+            try:
+                paths.extend(entry.path for entry in os.scandir(directory) if entry.is_file())
+            except OSError:
+                continue
+
+        signature = []
+        for path in sorted(paths):
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                signature.append((path, None))
+
+        signature = tuple(signature)
+        self._signatures[template_name] = signature
+        self._checked_at[template_name] = now
+        return signature
+
+    def render(self, template_name, variant, context_factory, version=None):
+        """Отдает страницу из кеша или рендерит ее и кладет в кеш"""
+        signature = (self._signature(template_name), version)
+        key = (template_name, variant)
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] != signature:
+            if entry is not None and entry[0][0] != signature[0] and self.app.jinja_env.cache is not None:
+                # Без debug Flask не включает auto_reload, и Jinja отдала бы старый скомпилированный шаблон
+                self.app.jinja_env.cache.clear()
+            with span("render.template"):
+                body = render_template(template_name, **context_factory()).encode('utf-8')
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            entry = (signature, body, etag)
+            with self._lock:
+                self._entries[key] = entry
+
+        _, body, etag = entry
+        response = Response(body, mimetype="text/html")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = self.cache_control
+        # Язык берется из cookie сессии и Accept-Language
+        response.vary.add("Accept-Language")
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._signatures.clear()
+            self._checked_at.clear()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Системные пробы (диск, Docker, бэкапы) с таймаутами вне потока запроса
+Проба выполняется в отдельном пуле, результат кешируется на несколько секунд.
+Запрос ждет пробу не дольше таймаута и при превышении получает последний удачный
+результат с пометкой stale. Одна проба выполняется не больше чем в одном экземпляре
+на воркер, поэтому медленный daemon или volume не забирает все потоки gunicorn
+и не мешает отдавать страницы и /metrics.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from prometheus_client import Counter, Histogram
+
+from spans import bind_context, span
+
+logger = logging.getLogger(__name__)
+
+# value - результат (или последний удачный при таймауте/ошибке), fresh - получен ли он сейчас,
+# status - ok, timeout (не уложилась или еще выполняется) или error
+ProbeResult = namedtuple("ProbeResult", ["value", "fresh", "error", "age_seconds", "status"])
+
+PROBE_DURATION = Histogram(
+    "app_probe_duration_seconds", "System probe duration in seconds", ["probe"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+PROBE_TIMEOUTS = Counter("app_probe_timeouts_total", "System probes that exceeded their timeout", ["probe"])
+
+
+def _executor_class():
+    # Под gevent обычные потоки становятся гринлетами, а statvfs/stat блокируют весь воркер.
+    # Пробы уводим в настоящие потоки из пула gevent.
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor
+    except ImportError:
+        pass
+    return ThreadPoolExecutor
+
+
+class ProbeRunner:
+    """Пул для проб: single-flight по имени, короткий кеш, таймаут ожидания и последний удачный результат
+
+    Ждать пробу (не дольше таймаута) может только запрос, который ее запустил, или запросы,
+    у которых еще нет никакого результата. Остальные сразу получают последний удачный результат.
+    Если выполняющаяся проба уже превысила таймаут, ее больше никто не ждет - поэтому
+    медленная проба держит не больше одного потока запроса.
+    """
+
+    def __init__(self, max_workers=4, ttl=2.0):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._inflight = {}
+        self._last = {}
+
+    def _executor(self):
+        # Пул не переживает fork - каждый воркер создает свой
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = _executor_class()(max_workers=self.max_workers)
+            self._inflight = {}
+        return self._pool
+
+    def _execute(self, name, fn):
+        started = time.perf_counter()
+        try:
+            value = fn()
+            with self._lock:
+                self._last[name] = (value, time.time())
+            return value
+        finally:
+            PROBE_DURATION.labels(probe=name).observe(time.perf_counter() - started)
+            with self._lock:
+                self._inflight.pop(name, None)
+
+    def _begin(self, name, fn):
+        """Запускает пробу (или присоединяется к выполняющейся); готовый результат - если есть свежий кеш"""
+        with self._lock:
+            last = self._last.get(name)
+            if last is not None and time.time() - last[1] < self.ttl:
+                return ProbeResult(last[0], True, None, round(time.time() - last[1], 1), "ok"), None
+            pool = self._executor()
+            inflight = self._inflight.get(name)
+            started_here = inflight is None
+            if started_here:
+                # [future, превысила ли таймаут]
+                # Фазы пробы (docker.cli, backups.catalog...) попадают в разбивку запроса, который ее запустил
+                inflight = [pool.submit(bind_context(self._execute), name, fn), False]
+                self._inflight[name] = inflight
+            wait = started_here or (last is None and not inflight[1])
+            return None, (inflight, last, wait)
+
+    def _finish(self, name, pending, timeout, remaining=None):
+        """Ждет пробу до срока: remaining - сколько осталось от таймаута, если часть уже прошла"""
+        inflight, last, wait = pending
+        if wait:
+            try:
+                with span(f"probe.{name}"):
+                    value = inflight[0].result(timeout=timeout if remaining is None else remaining)
+                return ProbeResult(value, True, None, 0.0, "ok")
+            except FutureTimeout:
+                inflight[1] = True
+                PROBE_TIMEOUTS.labels(probe=name).inc()
+                status, error = "timeout", f"Проба {name} не ответила за {timeout} с"
+                logger.warning("Проба %s не ответила за %s с", name, timeout)
+            except Exception as e:
+                status, error = "error", str(e)
+                logger.warning("Ошибка пробы %s: %s", name, error)
+            with self._lock:
+                last = self._last.get(name)
+        else:
+            status, error = "timeout", f"Проба {name} еще выполняется"
+
+        if last is None:
+            return ProbeResult(None, False, error, None, status)
+        value, collected_at = last
+        return ProbeResult(value, False, error, round(time.time() - collected_at, 1), status)
+
+    def call(self, name, fn, timeout):
+        """Результат пробы; при таймауте сама проба продолжает работу и обновит кеш для следующих запросов"""
+        result, pending = self._begin(name, fn)
+        if result is not None:
+            return result
+        return self._finish(name, pending, timeout)
+
+    def gather(self, calls):
+        """Несколько проб параллельно: calls - {имя: (fn, таймаут)}
+
+        Все пробы запускаются сразу, у каждой свой срок от общего старта, поэтому
+        общее ожидание - максимум таймаутов, а не их сумма. Возвращает {имя: (ProbeResult, секунд)}.
+        """
+        started = time.perf_counter()
+        finished = {}
+        begun = {}
+        for name, (fn, timeout) in calls.items():
+            result, pending = self._begin(name, fn)
+            if result is not None:
+                finished[name] = (result, time.perf_counter() - started)
+                continue
+            done_at = {}
+            pending[0][0].add_done_callback(lambda _f, done_at=done_at: done_at.setdefault("t", time.perf_counter()))
+            begun[name] = (pending, timeout, done_at)
+
+        for name, (pending, timeout, done_at) in begun.items():
+            remaining = max(0.0, started + timeout - time.perf_counter())
+            result = self._finish(name, pending, timeout, remaining)
+            # Время завершения самой пробы, а не момент, когда до нее дошла очередь ожидания
+            duration = done_at["t"] - started if result.fresh and "t" in done_at else time.perf_counter() - started
+            finished[name] = (result, max(0.0, duration))
+        return {name: finished[name] for name in calls}
+
+    def cached(self, name):
+        """Последний удачный результат без запуска пробы (fresh - в пределах ttl); None, если его нет"""
+        with self._lock:
+            last = self._last.get(name)
+        if last is None:
+            return None
+        age = time.time() - last[1]
+        if age < self.ttl:
+            return ProbeResult(last[0], True, None, round(age, 1), "ok")
+        return ProbeResult(last[0], False, None, round(age, 1), "stale")
+
+    def value(self, name, fn, timeout):
+        """Только значение (свежее или последнее удачное) - для фоновых тем live updates и /metrics"""
+        return self.call(name, fn, timeout).value
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Кеширующий фронтенд PromQL запросов перед Prometheus
+Range запрос выравнивается по шагу и режется на подынтервалы по фиксированной сетке.
+Подынтервалы запрашиваются параллельно через общий пул соединений, а закрытые
+(целиком старше окна свежести) кладутся в ограниченный LRU кеш. Панели дашборда
+с одинаковыми запросами и сдвигающимся окном пересчитывают в Prometheus только хвост.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Histogram
+
+from spans import bind_context, span
+
+logger = logging.getLogger(__name__)
+
+SUBQUERIES = Counter(
+    "app_query_frontend_subqueries_total", "PromQL sub-range queries by cache result", ["result"]
+)
+UPSTREAM_DURATION = Histogram(
+    "app_query_frontend_upstream_seconds", "Prometheus API request duration in seconds", ["endpoint"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+DURATION_UNITS = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000, "w": 604800000, "y": 31536000000}
+
+
+class QueryError(Exception):
+    """Ошибка в формате Prometheus API: {"status": "error", "errorType": ..., "error": ...}"""
+
+    def __init__(self, status_code, error_type, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_type = error_type
+
+    def payload(self):
+        return {"status": "error", "errorType": self.error_type, "error": str(self)}
+
+
+def parse_time_ms(value):
+    """Время Prometheus API (unix секунды или RFC3339) в миллисекундах"""
+    try:
+        return int(round(float(value) * 1000))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(round(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp() * 1000))
+    except ValueError:
+        raise QueryError(400, "bad_data", f"invalid time {value!r}")
+
+
+def parse_duration_ms(value):
+    """Шаг в миллисекундах: секунды ("15", "0.5") или длительность Prometheus ("1m30s")"""
+    try:
+        result = int(round(float(value) * 1000))
+    except (TypeError, ValueError):
+        result, number = 0, ""
+        text = str(value or "")
+        i = 0
+        while i < len(text):
+            if text[i].isdigit():
+                number += text[i]
+                i += 1
+                continue
+            unit = "ms" if text.startswith("ms", i) else text[i]
+            if not number or unit not in DURATION_UNITS:
+                raise QueryError(400, "bad_data", f"invalid duration {value!r}")
+            result += int(number) * DURATION_UNITS[unit]
+            number = ""
+            i += len(unit)
+        if number or not text:
+            raise QueryError(400, "bad_data", f"invalid duration {value!r}")
+    if result <= 0:
+        raise QueryError(400, "bad_data", "zero or negative query resolution step widths are not accepted")
+    return result
+
+
+def format_time(ms):
+    return f"{ms / 1000:.3f}"
+
+
+def align_range(start, end, step):
+    """Начало и конец кратны шагу: одинаковые панели с разным "сейчас" дают одинаковые точки"""
+    return start // step * step, end // step * step
+
+
+def split_range(start, end, step, interval, max_splits=None):
+    """Подынтервалы [a, b] по сетке, кратной interval; точки на границах не дублируются
+
+    Сетка зависит только от шага и интервала, а не от запроса, поэтому один и тот же
+    час прошлого имеет один и тот же ключ в кеше для всех запросов.
+    """
+    # Интервал кратен шагу, иначе точки не совпадали бы с границами подынтервалов
+    interval = max(step, interval // step * step)
+    if max_splits:
+        while (end - start) // interval + 1 > max_splits:
+            interval *= 2
+    ranges = []
+    block = start // interval * interval
+    while block <= end:
+        ranges.append((max(start, block), min(end, block + interval - step)))
+        block += interval
+    return ranges
+
+
+def merge_matrix(parts):
+    """Склеивает результаты подынтервалов по набору меток серии, сохраняя порядок появления"""
+    merged = OrderedDict()
+    for result in parts:
+        for series in result:
+            key = tuple(sorted(series.get("metric", {}).items()))
+            target = merged.get(key)
+            if target is None:
+                target = merged[key] = {"metric": series.get("metric", {})}
+            for field in ("values", "histograms"):
+                if field in series:
+                    target.setdefault(field, []).extend(series[field])
+    return list(merged.values())
+
+
+class LRUCache:
+    """Потокобезопасный LRU: предел по числу записей и по суммарному числу точек"""
+
+    def __init__(self, max_entries=512, max_samples=2_000_000):
+        self.max_entries = max_entries
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._samples = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(value):
+        return sum(len(s.get("values", ())) + len(s.get("histograms", ())) for s in value[0]) + 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self._size(value)
+        if size > self.max_samples:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._samples -= self._size(old)
+            self._entries[key] = value
+            self._samples += size
+            while len(self._entries) > self.max_entries or self._samples > self.max_samples:
+                _, evicted = self._entries.popitem(last=False)
+                self._samples -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._samples = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "samples": self._samples, "hits": self.hits, "misses": self.misses}
+
+
+class QueryFrontend:
+    """query и query_range Prometheus API с выравниванием, разбиением и кешем"""
+
+    def __init__(self, base_url, split_interval=3600, max_splits=64, cache_entries=512,
+                 cache_samples=2_000_000, parallelism=4, timeout=30, freshness=300):
+        self.base_url = base_url.rstrip("/")
+        self.split_interval_ms = int(split_interval * 1000)
+        self.max_splits = max_splits
+        self.parallelism = parallelism
+        self.timeout = timeout
+        # Данные моложе окна свежести еще могут дописываться (скрейп, запаздывающие точки) - не кешируем
+        self.freshness_ms = int(freshness * 1000)
+        self.cache = LRUCache(cache_entries, cache_samples)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._pool = None
+        self._inflight = {}
+
+    def _resources(self):
+        # Ни соединения, ни потоки не переживают fork - каждый воркер создает свои
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.parallelism)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+                self._pool = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="query-frontend")
+                self._inflight = {}
+            return self._session, self._pool
+
+    def _request(self, endpoint, params, method="POST"):
+        session, _ = self._resources()
+        # Путь passthrough приходит от клиента - в метки только известные методы
+        label = endpoint if endpoint in ("query", "query_range") else "other"
+        started = time.perf_counter()
+        try:
+            with span(f"prometheus.{label}"):
+                # POST: длинные PromQL выражения не упираются в предел длины URL
+                response = session.request(method, f"{self.base_url}/api/v1/{endpoint}", timeout=self.timeout,
+                                           **({"data": params} if method == "POST" else {"params": params}))
+        except requests.RequestException as e:
+            raise QueryError(502, "unavailable", f"Prometheus недоступен: {e}")
+        finally:
+            UPSTREAM_DURATION.labels(endpoint=label).observe(time.perf_counter() - started)
+        try:
+            payload = response.json()
+        except ValueError:
+            raise QueryError(502, "bad_response", f"Prometheus вернул не JSON (HTTP {response.status_code})")
+        if payload.get("status") != "success":
+            raise QueryError(response.status_code if response.status_code >= 400 else 502,
+                             payload.get("errorType", "bad_response"), payload.get("error", "unknown error"))
+        return payload
+
+    def _fetch_range(self, query, start, end, step):
+        payload = self._request("query_range", {
+            "query": query, "start": format_time(start), "end": format_time(end), "step": format_time(step)
+        })
+        data = payload.get("data", {})
+        if data.get("resultType") != "matrix":
+            raise QueryError(502, "bad_response", f"unexpected resultType {data.get('resultType')!r}")
+        return data.get("result", []), payload.get("warnings", [])
+
+    def _subquery(self, query, start, end, step, cacheable):
+        """Будущий результат подынтервала; одинаковые подынтервалы параллельных запросов выполняются один раз"""
+        key = (query, start, end, step)
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None:
+                SUBQUERIES.labels(result="hit").inc()
+                return cached, True
+        SUBQUERIES.labels(result="miss").inc()
+        _, pool = self._resources()
+        with self._lock:
+            future = self._inflight.get(key)
+            started_here = future is None
+            if started_here:
+                future = pool.submit(bind_context(self._fetch_range), query, start, end, step)
+                self._inflight[key] = future
+        if started_here:
+            # Вне блокировки: у уже завершенного future callback вызывается сразу в этом потоке
+            future.add_done_callback(lambda f: self._done(key, f, cacheable))
+        return future, False
+
+    def _done(self, key, future, cacheable):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if cacheable and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def query_range(self, params):
+        """Аналог /api/v1/query_range; возвращает (ответ, статистика кеша)"""
+        query = params.get("query")
+        if not query:
+            raise QueryError(400, "bad_data", "parameter \"query\" is required")
+        start = parse_time_ms(params.get("start"))
+        end = parse_time_ms(params.get("end"))
+        step = parse_duration_ms(params.get("step"))
+        if end < start:
+            raise QueryError(400, "bad_data", "end timestamp must not be before start time")
+        start, end = align_range(start, end, step)
+
+        cache_before = int(time.time() * 1000) - self.freshness_ms
+        ranges = split_range(start, end, step, self.split_interval_ms, self.max_splits)
+        pending = [self._subquery(query, a, b, step, b < cache_before) for a, b in ranges]
+
+        parts, warnings = [], []
+        for item, _ in pending:
+            result, part_warnings = item if isinstance(item, tuple) else item.result()
+            parts.append(result)
+            warnings.extend(w for w in part_warnings if w not in warnings)
+
+        hits = sum(1 for _, hit in pending if hit)
+        response = {"status": "success", "data": {"resultType": "matrix", "result": merge_matrix(parts)}}
+        if warnings:
+            response["warnings"] = warnings
+        return response, {"subqueries": len(ranges), "hits": hits}
+
+    def query(self, params):
+        """Аналог /api/v1/query; кешируется только запрос на момент старше окна свежести"""
+        query = params.get("query")
+        if not query:
+            raise QueryError(400, "bad_data", "parameter \"query\" is required")
+        upstream = {"query": query}
+        if params.get("time"):
+            upstream["time"] = format_time(parse_time_ms(params["time"]))
+        if params.get("timeout"):
+            upstream["timeout"] = params["timeout"]
+
+        cacheable = "time" in upstream and parse_time_ms(upstream["time"]) < time.time() * 1000 - self.freshness_ms
+        key = ("instant", json.dumps(upstream, sort_keys=True))
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None:
+                SUBQUERIES.labels(result="hit").inc()
+                return cached[1], {"subqueries": 1, "hits": 1}
+        SUBQUERIES.labels(result="miss").inc()
+        response = self._request("query", upstream)
+        if cacheable:
+            # Формат записи как у подынтервала: ([серии для подсчета размера], ответ)
+            result = response.get("data", {}).get("result")
+            self.cache.put(key, (result if isinstance(result, list) else [], response))
+        return response, {"subqueries": 1, "hits": 0}
+
+    def passthrough(self, endpoint, params):
+        """Остальные методы API (labels, series, metadata...) - без кеша, через тот же пул соединений"""
+        return self._request(endpoint, list(params.items(multi=True)), method="GET"), {"subqueries": 1, "hits": 0}
+
+    def stats(self):
+        return dict(self.cache.stats(), upstream=self.base_url,
+                    split_interval_seconds=self.split_interval_ms / 1000)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Тайминг фаз запроса (span) и профилирование одного запроса по секретному заголовку
+span("docker.cli") измеряет фазу: длительность всегда попадает в гистограмму
+app_span_duration_seconds, а если фаза выполняется в рамках запроса (в том числе
+в пуле проб - контекст переносится при submit), то и в разбивку этого запроса.
+Запрос дольше порога пишет разбивку в лог. Профилировщик включается только
+заголовком X-Profile с секретом из PROFILE_SECRET и отвечает collapsed stacks
+(формат flamegraph.pl / speedscope) вместо тела страницы.
+"""
+
+import contextvars
+import functools
+import hmac
+import logging
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+SPAN_DURATION = Histogram(
+    "app_span_duration_seconds", "Duration of request phases in seconds", ["span"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+# Список фаз текущего запроса: (имя, начало от старта запроса, длительность); None вне запроса
+_recorder = contextvars.ContextVar("span_recorder", default=None)
+
+
+@contextmanager
+def span(name):
+    """Измеряет фазу; вне запроса - только гистограмма"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        finished = time.perf_counter()
+        SPAN_DURATION.labels(span=name).observe(finished - started)
+        recorder = _recorder.get()
+        if recorder is not None:
+            # list.append атомарен - фазы из потоков пула дописываются без блокировки
+            recorder[1].append((name, started - recorder[0], finished - started))
+
+
+def bind_context(fn):
+    """fn, выполняемая в контексте текущего запроса (для submit в пул потоков)"""
+    if _recorder.get() is None:
+        return fn
+    # Своя копия контекста на каждую задачу: один контекст нельзя войти из двух потоков сразу
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def collapse_stack(frame, root_file):
+    """Стек в формате collapsed: "модуль:функция;модуль:функция" от корня к листу"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+        frame = frame.f_back
+    parts.reverse()
+    # Кадры gunicorn до входа во Flask (flask/app.py:wsgi_app) одинаковы у всех выборок - отрезаем
+    for i, part in enumerate(parts):
+        if part.startswith(root_file):
+            return ";".join(parts[i:])
+    return ";".join(parts)
+
+
+class SamplingProfiler:
+    """Фоновый поток раз в interval снимает стек потока запроса"""
+
+    def __init__(self, thread_id, interval=0.005, root_file="app.py:wsgi_app"):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_file = root_file
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame, self.root_file)] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _threads_patched():
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched("threading")
+    except ImportError:
+        return False
+
+
+class SpanTiming:
+    """Разбивка медленных запросов по фазам и профилирование по заголовку X-Profile"""
+
+    def __init__(self, app=None, slow_ms=500.0, profile_secret=None, profile_interval=0.005):
+        self.slow_ms = slow_ms
+        self.profile_secret = profile_secret
+        self.profile_interval = profile_interval
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def _profile_requested(self):
+        if not self.profile_secret:
+            return False
+        header = request.headers.get("X-Profile")
+        return bool(header) and hmac.compare_digest(header.encode(), self.profile_secret.encode())
+
+    def _before_request(self):
+        recorder = (time.perf_counter(), [])
+        g._span_token = _recorder.set(recorder)
+        g._span_recorder = recorder
+        # Под gevent запрос выполняется в гринлете, а не в отдельном потоке - стек снимать нечем
+        if self._profile_requested() and not _threads_patched():
+            g._profiler = SamplingProfiler(threading.get_ident(), self.profile_interval).start()
+
+    def _after_request(self, response):
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return response
+        profiler.stop()
+        if response.is_streamed:
+            # SSE и потоковые ответы профилируются только до начала выдачи - тело не подменяем
+            response.headers["X-Profile-Samples"] = str(profiler.samples)
+            return response
+        profiled = Response(profiler.collapsed(), mimetype="text/plain")
+        profiled.headers["X-Profile-Samples"] = str(profiler.samples)
+        profiled.headers["X-Profile-Interval-Ms"] = str(self.profile_interval * 1000)
+        profiled.headers["X-Profile-Status"] = str(response.status_code)
+        profiled.headers["Cache-Control"] = "no-store"
+        return profiled
+
+    def _teardown_request(self, exc):
+        token = g.pop("_span_token", None)
+        recorder = g.pop("_span_recorder", None)
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.stop()
+        if token is None:
+            return
+        started, spans = recorder
+        try:
+            _recorder.reset(token)
+        except ValueError:
+            # Контекст сменился (поток ответа) - запись просто перестанет использоваться
+            pass
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.slow_ms:
+            return
+        breakdown = [{"span": name, "offset_ms": round(offset * 1000, 2), "duration_ms": round(seconds * 1000, 2)}
+                     for name, offset, seconds in sorted(list(spans), key=lambda item: item[1])]
+        rule = request.url_rule
+        logger.warning("Slow request %s %s: %.0f ms", request.method, request.path, duration_ms, extra={
+            "route": rule.rule if rule is not None else None,
+            "duration_ms": round(duration_ms, 2),
+            "spans": breakdown,
+        })
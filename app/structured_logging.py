@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Структурированные JSON логи без блокировки потоков запросов
+Поток запроса только фильтрует запись (выборка, ограничение частоты), добавляет
+request_id и кладет ее в ограниченную очередь; сериализация в JSON и запись в stdout
+(откуда логи забирает promtail) выполняются в отдельном потоке QueueListener.
+При переполнении очереди запись отбрасывается и учитывается в метрике, а не ждет.
+
+Переменные окружения:
+    LOG_LEVEL         - уровень корневого логгера (по умолчанию INFO)
+    LOG_FORMAT        - json (по умолчанию) или text
+    LOG_QUEUE_SIZE    - размер очереди записей (по умолчанию 10000)
+    LOG_SAMPLING      - доля сохраняемых записей ниже WARNING по логгерам: "access=0.1,probes=0.5"
+    LOG_RATE_LIMIT    - не больше N одинаковых сообщений за LOG_RATE_INTERVAL секунд (по умолчанию 10 за 60)
+    LOG_SLOW_REQUEST_MS - запросы дольше порога пишутся в access лог всегда, с уровнем WARNING
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+from prometheus_client import Counter
+
+LOG_RECORDS_DROPPED = Counter(
+    "app_log_records_dropped_total", "Log records not written", ["reason"]
+)
+
+# Атрибуты LogRecord, которые не попадают в JSON как дополнительные поля
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+ACCESS_LOGGER = "access"
+
+
+def parse_sampling(value):
+    """"access=0.1,probes=0.5" -> {"access": 0.1, "probes": 0.5}"""
+    rates = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """request_id текущего запроса - в потоке запроса, пока контекст Flask еще доступен"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id") and has_request_context():
+            request_id = g.get("request_id")
+            if request_id:
+                record.request_id = request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Сохраняет долю записей ниже WARNING; доля задается по имени логгера или его префиксу"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, parts = 1.0, name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            if rate < 1.0:
+                record.sample_rate = rate
+            return True
+        LOG_RECORDS_DROPPED.labels(reason="sampled").inc()
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше burst одинаковых сообщений (логгер + шаблон) за interval секунд
+
+    Ключ - шаблон до подстановки аргументов, поэтому сообщения нужно писать
+    с ленивыми аргументами (logger.warning("... %s", value)), а не f-строками.
+    Первая запись после паузы получает поле suppressed с числом пропущенных.
+    Access лог не ограничивается: у всех его записей один шаблон, объем задает выборка.
+    """
+
+    def __init__(self, burst=10, interval=60.0, max_keys=10000, exempt=(ACCESS_LOGGER,)):
+        super().__init__()
+        self.burst = burst
+        self.exempt = frozenset(exempt)
+        self.interval = interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if self.burst <= 0 or record.name in self.exempt:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                suppressed = window[2] if window is not None else 0
+                # [начало окна, записано, пропущено]
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+        LOG_RECORDS_DROPPED.labels(reason="rate_limited").inc()
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при полной очереди отбрасывает запись вместо ожидания"""
+
+    def prepare(self, record):
+        # Аргументы подставляются здесь: в очередь уходит готовая строка, а не ссылки на объекты запроса
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+
+class LoggingPipeline:
+    """Очередь, фильтры и поток записи; поток перезапускается в каждом процессе после fork"""
+
+    def __init__(self, level="INFO", fmt="json", queue_size=10000, sampling=None, rate_limit=10,
+                 rate_interval=60.0, stream=None):
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.formatter = JsonFormatter() if fmt == "json" else logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(ContextFilter())
+        self.handler.addFilter(SamplingFilter(sampling or {}))
+        self.handler.addFilter(RateLimitFilter(rate_limit, rate_interval))
+        self._listener = None
+        self._pid = None
+
+    def install(self):
+        root = logging.getLogger()
+        root.setLevel(self.level)
+        for handler in list(root.handlers):
+            if isinstance(handler, NonBlockingQueueHandler):
+                root.removeHandler(handler)
+        root.addHandler(self.handler)
+        self.start()
+        if hasattr(os, "register_at_fork"):
+            # Поток записи не переживает fork (gunicorn --preload) - в дочернем процессе запускаем заново
+            os.register_at_fork(after_in_child=self._restart_in_child)
+        atexit.register(self.stop)
+        return self
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        output = logging.StreamHandler(self.stream)
+        output.setFormatter(self.formatter)
+        self._listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=True)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def _restart_in_child(self):
+        # Очередь могла быть захвачена потоком родителя в момент fork - создаем новую
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.handler.queue = self.queue
+        self._listener = None
+        self.start()
+
+    def stop(self):
+        """Дописывает оставшиеся записи (при завершении процесса)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+_pipeline = None
+
+
+def setup_logging():
+    """Настраивает корневой логгер один раз на процесс; повторный вызов (тесты, reload) ничего не меняет"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = LoggingPipeline(
+            level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+            fmt=os.environ.get('LOG_FORMAT', 'json'),
+            queue_size=int(os.environ.get('LOG_QUEUE_SIZE', '10000')),
+            sampling=parse_sampling(os.environ.get('LOG_SAMPLING', 'access=0.1')),
+            rate_limit=int(os.environ.get('LOG_RATE_LIMIT', '10')),
+            rate_interval=float(os.environ.get('LOG_RATE_INTERVAL', '60')),
+        ).install()
+    return _pipeline
+
+
+class RequestLogging:
+    """request_id для каждого запроса (из X-Request-ID или новый) и access лог с длительностью
+
+    Обычные запросы попадают в лог с выборкой (LOG_SAMPLING для логгера access),
+    ошибки 5xx и медленные запросы - всегда.
+    """
+
+    def __init__(self, app=None, slow_ms=1000.0):
+        self.slow_ms = slow_ms
+        self.logger = logging.getLogger(ACCESS_LOGGER)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        incoming = request.headers.get("X-Request-ID", "")
+        # Чужой заголовок принимаем, только если он похож на идентификатор
+        g.request_id = incoming if 0 < len(incoming) <= 64 and incoming.replace("-", "").isalnum() else uuid.uuid4().hex
+        g._log_start = time.perf_counter()
+
+    def _after_request(self, response):
+        response.headers["X-Request-ID"] = g.get("request_id", "")
+        started = g.pop("_log_start", None)
+        if started is None:
+            return response
+        duration_ms = round((time.perf_counter() - started) * 1000, 2)
+        rule = request.url_rule
+        # Быстрый отказ по перегрузке (g.shed) - INFO: иначе объем лога рос бы вместе с отказами,
+        # а WARNING не проходит через выборку
+        shed = g.get("shed")
+        level = logging.INFO
+        if (response.status_code >= 500 and shed is None) or duration_ms >= self.slow_ms:
+            level = logging.WARNING
+        extra = {
+            "method": request.method,
+            "path": request.path,
+            "route": rule.rule if rule is not None else None,
+            "status": response.status_code,
+            "duration_ms": duration_ms,
+        }
+        if shed is not None:
+            extra["shed"] = shed
+        self.logger.log(level, "%s %s %s", request.method, request.path, response.status_code, extra=extra)
+        return response
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Системные метрики, вычисляемые в момент скрейпа
+Запросы к приложению не тратят время на обновление gauge - значения собираются только для /metrics.
+"""
+
+import shutil
+import time
+
+from prometheus_client.core import GaugeMetricFamily
+
+
+class SystemCollector:
+    """Uptime, использование диска, бэкапы и контейнеры - из уже имеющихся в памяти снимков"""
+
+    def __init__(self, start_time, backup_catalog=None, container_state=None, disk_path='/', store_stats=None,
+                 probes=None, probe_timeout=2.0):
+        self.start_time = start_time
+        self.backup_catalog = backup_catalog
+        self.store_stats = store_stats
+        self.container_state = container_state
+        self.disk_path = disk_path
+        # Диск и каталог бэкапов читаются через ProbeRunner: медленный volume не задерживает скрейп
+        self.probes = probes
+        self.probe_timeout = probe_timeout
+
+    def _probe(self, name, fn):
+        if self.probes is None:
+            return fn()
+        return self.probes.value(name, fn, self.probe_timeout)
+
+    def describe(self):
+        # Без describe() реестр при регистрации вызывает collect(): пробы запустили бы пул и потоки Docker
+        # в create_app - при preload в мастере gunicorn, до fork. Семейства метрик зависят от данных.
+        return []
+
+    def collect(self):
+        yield GaugeMetricFamily("app_uptime_seconds", "Application uptime in seconds",
+                                value=time.time() - self.start_time)
+
+        try:
+            usage = self._probe("metrics_disk", lambda: shutil.disk_usage(self.disk_path))
+        except OSError:
+            usage = None
+        if usage is not None:
+            for name, value in (("total", usage.total), ("used", usage.used), ("free", usage.free)):
+                disk = GaugeMetricFamily(f"app_disk_{name}_bytes", f"Disk {name} bytes", labels=["mount"])
+                disk.add_metric([self.disk_path], value)
+                yield disk
+
+        snapshot = self._probe("backup_catalog", self.backup_catalog.snapshot) if self.backup_catalog else None
+        if snapshot is not None:
+            yield GaugeMetricFamily("app_backups_total", "Number of backup archives", value=snapshot.count)
+            yield GaugeMetricFamily("app_backups_size_bytes", "Total size of backup archives",
+                                    value=snapshot.total_size)
+            if snapshot.newest is not None:
+                yield GaugeMetricFamily("app_backup_last_timestamp_seconds", "Modification time of the newest backup",
+                                        value=snapshot.newest.mtime)
+                yield GaugeMetricFamily("app_backup_age_seconds", "Age of the newest backup",
+                                        value=time.time() - snapshot.newest.mtime)
+
+        stats = self.store_stats.get() if self.store_stats is not None else None
+        if stats:
+            yield GaugeMetricFamily("app_backup_store_logical_bytes", "Total size of all incremental backups",
+                                    value=stats["logical_size"])
+            yield GaugeMetricFamily("app_backup_store_physical_bytes", "Disk usage of the deduplicated backup store",
+                                    value=stats["physical_size"])
+
+        if self.container_state is not None:
+            # Берем только готовый снимок, скрейп не должен ждать Docker
+            snapshot = self.container_state.peek()
+            # Статический fallback - не реальные данные, в метрики его не отдаем
+            if snapshot is not None and snapshot.get("debug", {}).get("method") != "static_fallback":
+                counts = {"running": 0, "stopped": 0}
+                for container in snapshot.get("containers", []):
+                    state = "running" if container.get("State") == "running" else "stopped"
+                    counts[state] += 1
+                containers = GaugeMetricFamily("app_containers", "Containers by state", labels=["state"])
+                for state, count in counts.items():
+                    containers.add_metric([state], count)
+                yield containers
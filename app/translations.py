@@ -1,89 +1,258 @@
 # -*- coding: utf-8 -*-
 """
 Система переводов для DevOps Portfolio
-Поддерживает русский и английский языки
+Языки определяются по файлам translations/*.json, каталоги загружаются лениво
+и перечитываются при изменении файла без перезапуска воркеров
 """
 
-from flask import request, session
+from flask import request, session, g, has_request_context
+from functools import lru_cache
 import json
+import logging
 import os
+import threading
+import time
+from string import Formatter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = 'ru'
+
+
+def _flatten(data, prefix=''):
+    """Разворачивает вложенный словарь в плоский с ключами через точку: nav.home"""
+    flat = {}
+    for key, value in data.items():
+        dotted = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{dotted}."))
+        else:
+            flat[dotted] = value
+    return flat
+
+
+@lru_cache(maxsize=256)
+def parse_accept_language(header, supported):
+    """Выбирает язык из Accept-Language с учетом q-значений; результат мемоизируется по заголовку"""
+    best_lang = None
+    best_q = 0.0
+    for part in header.split(','):
+        tag, _, params = part.strip().partition(';')
+        lang = tag.strip().lower().split('-')[0]
+        if lang not in supported:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        # При равных q побеждает язык, указанный раньше
+        if q > best_q:
+            best_lang, best_q = lang, q
+    return best_lang
+
+
+def _compile_template(text):
+    """Разбирает строку с плейсхолдерами один раз; None - если нужен полноценный str.format"""
+    try:
+        parsed = list(Formatter().parse(text))
+    except ValueError:
+        return None
+    pieces = []
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            pieces.append((True, literal))
+        if field is not None:
+            if spec or conversion or not field.isidentifier():
+                return None
+            pieces.append((False, field))
+    return tuple(pieces)
+
+
+class Catalog:
+    """Неизменяемый каталог одного языка: исходные данные, плоские ключи и разобранные шаблоны"""
+
+    def __init__(self, lang, data, version):
+        self.lang = lang
+        self.data = data
+        self.version = version
+        self.flat = _flatten(data)
+        self.templates = {
+            key: _compile_template(value)
+            for key, value in self.flat.items()
+            if isinstance(value, str) and '{' in value
+        }
+
+    def format(self, key, kwargs):
+        translation = self.flat.get(key, key)
+        pieces = self.templates.get(key)
+        if pieces is not None:
+            try:
+                return ''.join(value if is_literal else str(kwargs[value]) for is_literal, value in pieces)
+            except KeyError:
+                return translation
+        if key in self.flat and key not in self.templates:
+            # Строка без плейсхолдеров
+            return translation
+        try:
+            return translation.format(**kwargs)
+        except (KeyError, ValueError, IndexError):
+            return translation
+
+
+EMPTY_CATALOG = Catalog(None, {}, None)
+
+
+class CatalogStore:
+    """Лениво загружает каталоги из translations/*.json и подменяет их при изменении файла"""
+
+    def __init__(self, translations_dir, check_interval=2.0):
+        self.translations_dir = translations_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._catalogs = {}
+        self._checked_at = {}
+        self._languages = ()
+        self._languages_checked_at = float('-inf')
+
+    def _path(self, lang):
+        return os.path.join(self.translations_dir, f'{lang}.json')
+
+    def languages(self):
+        """Языки, для которых есть JSON файл в директории переводов"""
+        now = time.monotonic()
+        if now - self._languages_checked_at >= self.check_interval:
+            try:
+                names = sorted(os.listdir(self.translations_dir))
+            except OSError as e:
+                logger.error("Translations directory %s is not readable: %s", self.translations_dir, e)
+                names = []
+            self._languages = tuple(name[:-5] for name in names if name.endswith('.json'))
+            self._languages_checked_at = now
+        return self._languages
+
+    def get(self, lang):
+        """Каталог языка; файл перепроверяется не чаще раза в check_interval"""
+        catalog = self._catalogs.get(lang)
+        now = time.monotonic()
+        if catalog is not None and now - self._checked_at.get(lang, float('-inf')) < self.check_interval:
+            return catalog
+        if lang not in self.languages():
+            return EMPTY_CATALOG
+
+        with self._lock:
+            catalog = self._catalogs.get(lang)
+            try:
+                version = os.stat(self._path(lang)).st_mtime_ns
+            except OSError:
+                version = None
+            if catalog is None or catalog.version != version:
+                catalog = self._load(lang, version, catalog)
+                # Каталог неизменяем, поэтому читатели без блокировки видят либо старый, либо новый целиком
+                self._catalogs[lang] = catalog
+            self._checked_at[lang] = now
+        return catalog
+
+    def _load(self, lang, version, previous):
+        file_path = self._path(lang)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.warning("Translation file %s not found", file_path)
+            data = {}
+        except Exception as e:
+            # Битый файл посреди правки не должен ломать страницы - оставляем прежний каталог
+            logger.error("Error loading translation file %s: %s", file_path, e)
+            if previous is not None:
+                return Catalog(lang, previous.data, version)
+            data = {}
+        logger.info("Loaded translations for %s (%s)", lang, file_path)
+        return Catalog(lang, data, version)
+
+    def preload(self):
+        for lang in self.languages():
+            self.get(lang)
+
 
 class Translations:
-    def __init__(self):
-        self.translations = self._load_translations()
+    def __init__(self, translations_dir=None):
+        self.catalogs = CatalogStore(
+            translations_dir or os.path.join(os.path.dirname(__file__), 'translations'),
+            check_interval=float(os.environ.get('TRANSLATIONS_CHECK_INTERVAL', '2'))
+        )
     
-    def _load_translations(self):
-        """Загружает переводы из JSON файлов"""
-        translations = {}
-        translations_dir = os.path.join(os.path.dirname(__file__), 'translations')
-        
-        for lang in ['ru', 'en']:
-            file_path = os.path.join(translations_dir, f'{lang}.json')
-            try:
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        translations[lang] = json.load(f)
-                else:
-                    print(f"Warning: Translation file {file_path} not found")
-                    translations[lang] = {}
-            except Exception as e:
-                print(f"Error loading translation file {file_path}: {str(e)}")
-                translations[lang] = {}
-        
-        return translations
+    @property
+    def supported(self):
+        return self.catalogs.languages()
+    
+    def has_language(self, lang):
+        return lang in self.catalogs.languages()
+    
+    def catalog(self, lang=None):
+        """Каталог текущего (или указанного) языка"""
+        return self.catalogs.get(lang or self.get_language())
     
     def get_language(self):
-        """Определяет текущий язык"""
+        """Определяет текущий язык (один раз за запрос, дальше из g)"""
+        if not has_request_context():
+            return DEFAULT_LANGUAGE
+        lang = g.get('_language')
+        if lang is None:
+            lang = self._resolve_language()
+            g._language = lang
+        return lang
+    
+    def _resolve_language(self):
         # 1. Проверяем параметр в URL
-        if request.args.get('lang'):
-            return request.args.get('lang')
+        lang = request.args.get('lang')
+        if lang:
+            return lang
         
         # 2. Проверяем сессию
         if 'language' in session:
             lang = session['language']
-            print(f"Language from session: {lang}")
+            logger.debug("Language from session: %s", lang)
             return lang
         
         # 3. Проверяем заголовок Accept-Language
         accept_language = request.headers.get('Accept-Language', '')
-        if 'en' in accept_language.lower():
-            return 'en'
+        if accept_language:
+            lang = parse_accept_language(accept_language, self.supported)
+            if lang:
+                return lang
         
         # 4. По умолчанию русский
-        return 'ru'
+        return DEFAULT_LANGUAGE
     
     def set_language(self, lang):
         """Устанавливает язык в сессии"""
         try:
-            if lang in self.translations:
+            if self.has_language(lang):
                 session['language'] = lang
+                g._language = lang
                 return True
             return False
         except Exception as e:
-            print(f"Error setting language {lang}: {str(e)}")
+            logger.error("Error setting language %s: %s", lang, e)
             return False
     
     def translate(self, key, **kwargs):
-        """Переводит ключ на текущий язык"""
-        lang = self.get_language()
-        translation = self.translations.get(lang, {}).get(key, key)
-        
-        # Заменяем плейсхолдеры
-        if kwargs:
-            try:
-                translation = translation.format(**kwargs)
-            except (KeyError, ValueError):
-                pass
-        
-        return translation
+        """Переводит ключ на текущий язык; вложенные ключи записываются через точку"""
+        catalog = self.catalog()
+        if not kwargs:
+            return catalog.flat.get(key, key)
+        # Плейсхолдеры подставляются по заранее разобранному шаблону
+        return catalog.format(key, kwargs)
     
     def get_all_translations(self):
         """Возвращает все переводы для текущего языка"""
         lang = self.get_language()
-        translations = self.translations.get(lang, {})
+        translations = self.catalogs.get(lang).data
         if not translations:
-            print(f"Warning: No translations found for language: {lang}")
-            print(f"Available languages: {list(self.translations.keys())}")
+            logger.warning("No translations found for language: %s, available: %s", lang, list(self.supported))
         return translations
 
 # Глобальный экземпляр
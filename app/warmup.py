@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Прогрев приложения до приема запросов
+С gunicorn --preload (preload_app в gunicorn.conf.py) create_app() выполняется один раз
+в мастере: каталоги переводов, скомпилированные шаблоны Jinja, отрендеренные страницы
+и модули клиентов проб загружаются до fork и достаются воркерам через copy-on-write.
+Без preload то же самое делает каждый воркер при старте, а не первый запрос к нему.
+Потоки и пулы соединений здесь не создаются - они не переживают fork; число потоков
+мастера после preload проверяет infra/monitoring/startup_bench.py.
+"""
+
+import gc
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Тяжелые модули, которые иначе импортируются при первом обращении к Docker
+PROBE_CLIENT_MODULES = ("docker", "docker.api", "docker.models.containers")
+
+
+def compile_templates(app):
+    """Компилирует все шаблоны в кеш окружения Jinja"""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith(".html")]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def preload_modules(names=PROBE_CLIENT_MODULES):
+    loaded = []
+    for name in names:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            # docker SDK необязателен: без него пробы переходят на docker ps
+            pass
+    return loaded
+
+
+def warm_up(app, translations, render_page, pages):
+    """Загружает все, что иначе загрузил бы первый запрос; возвращает статистику прогрева"""
+    started = time.perf_counter()
+    translations.catalogs.preload()
+    languages = translations.supported
+    templates = compile_templates(app)
+
+    # Страницы рендерятся по одному разу на язык и остаются в PageCache
+    rendered = 0
+    for lang in languages:
+        with app.test_request_context(f"/?lang={lang}"):
+            for page in pages:
+                try:
+                    render_page(page)
+                    rendered += 1
+                except Exception as e:
+                    logger.warning("Прогрев страницы %s (%s) не удался: %s", page, lang, e)
+
+    modules = preload_modules()
+
+    # Все созданные объекты - в постоянное поколение: сборщик мусора в воркерах не трогает
+    # их заголовки, и страницы памяти мастера остаются общими после fork
+    gc.collect()
+    gc.freeze()
+
+    stats = {
+        "languages": list(languages),
+        "templates": len(templates),
+        "pages": rendered,
+        "modules": modules,
+        "frozen_objects": gc.get_freeze_count(),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info("Прогрев завершен за %.3f с", stats["seconds"], extra={"warmup": stats})
+    return stats
@@ -4,59 +4,100 @@
 Запуск: python3 /opt/devops-portfolio/infra/backup/backup-api.py
 """
 
-from flask import Flask, request, jsonify
-import subprocess
+from flask import Flask, request, jsonify, Response
 import os
-import glob
 from datetime import datetime
 import json
 
+from backup_catalog import BackupCatalog, backup_age_text, backup_health, backup_verification
+from cron_status import CronStatusProvider
+from backup_jobs import JobQueueFull, JobRunner, command_runner
+from backup_engine import engine_runner
+from backup_store import StoreStats, store_runner
+from backup_index import verify_runner
+
 app = Flask(__name__)
 
+# Каталог бэкапов живет между запросами: файлы stat'ятся только при изменениях
+backup_catalog = BackupCatalog("/opt/backups")
+# Результат поиска cron задачи кешируется до изменения файлов crontab
+cron_status = CronStatusProvider(markers=('backup.sh',))
+
+# Бэкап выполняется в фоне, воркер API не блокируется на время tar; срок общий для всех движков
+BACKUP_TIMEOUT = int(os.environ.get('BACKUP_TIMEOUT', '300'))  # 5 минут
+# Бэкап и проверки архивов выполняются в общем пуле: не больше BACKUP_JOB_WORKERS одновременно
+backup_jobs = JobRunner(max_history=int(os.environ.get('BACKUP_JOB_HISTORY', '20')),
+                        workers=int(os.environ.get('BACKUP_JOB_WORKERS', '2')),
+                        max_queued=int(os.environ.get('BACKUP_JOB_QUEUE', '8')))
+
+BACKUP_SCRIPT = "/opt/devops-portfolio/infra/backup/backup.sh"
+# script - backup.sh (копия в staging + однопоточный gzip), python - потоковый backup_engine.py,
+# incremental - хранилище с дедупликацией backup_store.py
+BACKUP_ENGINE = os.environ.get('BACKUP_ENGINE', 'script')
+BACKUP_ENGINE_WORKERS = int(os.environ.get('BACKUP_ENGINE_WORKERS', '0')) or None
+BACKUP_STORE_DIR = os.environ.get('BACKUP_STORE_DIR', '/opt/backups/store')
+BACKUP_STORE_KEEP = int(os.environ.get('BACKUP_STORE_KEEP', '30'))
+store_stats = StoreStats(BACKUP_STORE_DIR)
+
+
+def queue_full_response(error):
+    """429: задачи не принимаются, пока очередь не освободится"""
+    return jsonify({
+        "success": False,
+        "message": f"Слишком много задач бэкапа, повторите позже ({error})",
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }), 429, {"Retry-After": "30"}
+
+
 @app.route('/api/backup/create', methods=['POST'])
 def create_backup():
-    """Создает бэкап через скрипт backup.sh"""
+    """Ставит бэкап в очередь и сразу возвращает id задачи"""
     try:
-        backup_script = "/opt/devops-portfolio/infra/backup/backup.sh"
-        
-        if not os.path.exists(backup_script):
+        engine = request.args.get('engine', BACKUP_ENGINE)
+        if engine not in ('script', 'python', 'incremental'):
             return jsonify({
                 "success": False,
-                "message": "Скрипт бэкапа не найден",
+                "message": f"Неизвестный движок бэкапа: {engine}",
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }), 404
-        
-        # Запускаем скрипт бэкапа
-        result = subprocess.run(
-            [backup_script],
-            capture_output=True,
-            text=True,
-            timeout=300,  # 5 минут таймаут
-            cwd=os.path.dirname(backup_script)
-        )
+            }), 400
         
-        if result.returncode == 0:
-            return jsonify({
-                "success": True,
-                "message": "Резервная копия создана успешно",
-                "output": result.stdout,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+        if engine == 'python':
+            run = engine_runner(workers=BACKUP_ENGINE_WORKERS, timeout=BACKUP_TIMEOUT)
+        elif engine == 'incremental':
+            run = store_runner(BACKUP_STORE_DIR, keep=BACKUP_STORE_KEEP, timeout=BACKUP_TIMEOUT)
         else:
-            return jsonify({
-                "success": False,
-                "message": "Ошибка при создании резервной копии",
-                "error": result.stderr,
-                "output": result.stdout,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }), 500
-            
-    except subprocess.TimeoutExpired:
+            if not os.path.exists(BACKUP_SCRIPT):
+                return jsonify({
+                    "success": False,
+                    "message": "Скрипт бэкапа не найден",
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }), 404
+            run = command_runner(
+                [BACKUP_SCRIPT],
+                cwd=os.path.dirname(BACKUP_SCRIPT),
+                timeout=BACKUP_TIMEOUT
+            )
+        
+        # Пока бэкап выполняется, повторный POST возвращает ту же задачу, а не запускает второй tar
+        # Ключ общий для обоих движков - два бэкапа одновременно не пишут в /opt/backups
+        try:
+            job, created = backup_jobs.submit("backup", run, engine=engine)
+        except JobQueueFull as e:
+            return queue_full_response(e)
+        
         return jsonify({
-            "success": False,
-            "message": "Таймаут при создании резервной копии (более 5 минут)",
+            "success": True,
+            "message": "Резервная копия поставлена в очередь" if created else "Резервная копия уже создается",
+            "job_id": job.id,
+            "status": job.status,
+            "deduplicated": not created,
+            # Для дедуплицированного запроса - движок уже выполняющегося бэкапа
+            "engine": job.engine,
+            "status_url": f"/api/backup/jobs/{job.id}",
+            "stream_url": f"/api/backup/jobs/{job.id}/stream",
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }), 500
+        }), 202
+            
     except Exception as e:
         return jsonify({
             "success": False,
@@ -64,12 +105,65 @@ def create_backup():
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }), 500
 
+@app.route('/api/backup/verify/<filename>', methods=['POST'])
+def verify_backup(filename):
+    """Ставит проверку архива по индексу в очередь; результат появится в /api/backup/stats"""
+    # Проверять можно только архив из каталога - имя не превращается в произвольный путь
+    entry = next((entry for entry in backup_catalog.snapshot().entries if entry.filename == filename), None)
+    if entry is None:
+        return jsonify({"success": False, "message": "Бэкап не найден"}), 404
+    
+    try:
+        job, created = backup_jobs.submit(f"verify:{filename}", verify_runner(entry.path))
+    except JobQueueFull as e:
+        return queue_full_response(e)
+    return jsonify({
+        "success": True,
+        "message": "Проверка поставлена в очередь" if created else "Проверка уже выполняется",
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/backup/jobs/{job.id}",
+        "stream_url": f"/api/backup/jobs/{job.id}/stream",
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }), 202
+
+@app.route('/api/backup/jobs', methods=['GET'])
+def list_backup_jobs():
+    """Текущая и последние завершенные задачи"""
+    return jsonify({"jobs": [job.to_dict(include_output=False) for job in backup_jobs.list()]})
+
+@app.route('/api/backup/jobs/<job_id>', methods=['GET'])
+def backup_job_status(job_id):
+    """Статус задачи и ее вывод"""
+    job = backup_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Задача не найдена"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/backup/jobs/<job_id>/stream', methods=['GET'])
+def backup_job_stream(job_id):
+    """Живой вывод задачи (text/plain), соединение закрывается по завершении"""
+    job = backup_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Задача не найдена"}), 404
+    
+    def generate():
+        for item in job.follow():
+            if item is None:
+                # keepalive, чтобы прокси не закрыл соединение
+                yield "\n"
+                continue
+            stream, line = item
+            yield f"[{stream}] {line}\n" if stream == "stderr" else f"{line}\n"
+        yield f"[{job.status}] returncode={job.returncode}\n"
+    
+    return Response(generate(), mimetype="text/plain", headers={"X-Accel-Buffering": "no"})
+
 @app.route('/api/backup/stats', methods=['GET'])
 def backup_stats():
     """Возвращает статистику бэкапов"""
     try:
-        backup_dir = "/opt/backups"
-        
         backup_stats = {
             "total_backups": 0,
             "total_size": "0 MB",
@@ -80,73 +174,41 @@ def backup_stats():
             "backup_health": "Unknown"
         }
         
-        if os.path.exists(backup_dir):
-            # Получаем список файлов бэкапов
-            backup_files = glob.glob(os.path.join(backup_dir, "devops-portfolio-backup-*.tar.gz"))
-            backup_files.sort(key=os.path.getmtime, reverse=True)
+        snapshot = backup_catalog.snapshot()
+        if backup_catalog.exists:
+            backup_stats["total_backups"] = snapshot.count
             
-            backup_stats["total_backups"] = len(backup_files)
-            
-            if backup_files:
+            if snapshot.count:
                 # Размер всех бэкапов
-                total_size = sum(os.path.getsize(f) for f in backup_files)
-                backup_stats["total_size"] = f"{total_size / (1024*1024):.1f} MB"
-                
-                # Последний бэкап
-                last_backup = backup_files[0]
-                last_backup_time = datetime.fromtimestamp(os.path.getmtime(last_backup))
-                backup_stats["last_backup"] = last_backup_time.strftime("%Y-%m-%d %H:%M:%S")
+                backup_stats["total_size"] = f"{snapshot.total_size / (1024*1024):.1f} MB"
                 
-                # Самый старый бэкап
-                oldest_backup = backup_files[-1]
-                oldest_backup_time = datetime.fromtimestamp(os.path.getmtime(oldest_backup))
-                backup_stats["oldest_backup"] = oldest_backup_time.strftime("%Y-%m-%d %H:%M:%S")
+                # Последний и самый старый бэкапы
+                backup_stats["last_backup"] = datetime.fromtimestamp(snapshot.newest.mtime).strftime("%Y-%m-%d %H:%M:%S")
+                backup_stats["oldest_backup"] = datetime.fromtimestamp(snapshot.oldest.mtime).strftime("%Y-%m-%d %H:%M:%S")
                 
                 # Детали по каждому бэкапу
-                for backup_file in backup_files[:10]:  # Показываем только последние 10
-                    file_stat = os.stat(backup_file)
-                    file_size = file_stat.st_size
-                    file_time = datetime.fromtimestamp(file_stat.st_mtime)
-                    
-                    # Определяем возраст бэкапа
-                    age_days = (datetime.now() - file_time).days
-                    if age_days == 0:
-                        age_text = "Сегодня"
-                    elif age_days == 1:
-                        age_text = "Вчера"
-                    else:
-                        age_text = f"{age_days} дн. назад"
-                    
+                now = datetime.now()
+                for entry in snapshot.top(10):  # Показываем только последние 10
                     backup_stats["backups"].append({
-                        "filename": os.path.basename(backup_file),
-                        "size": f"{file_size / (1024*1024):.1f} MB",
-                        "date": file_time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "age": age_text,
-                        "path": backup_file
+                        "filename": entry.filename,
+                        "size": f"{entry.size / (1024*1024):.1f} MB",
+                        "date": datetime.fromtimestamp(entry.mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                        "age": backup_age_text(entry.mtime, now),
+                        "path": entry.path,
+                        "verification": backup_verification(entry)
                     })
-                
-                # Проверяем здоровье бэкапов
-                recent_backup = backup_files[0]
-                recent_backup_time = datetime.fromtimestamp(os.path.getmtime(recent_backup))
-                hours_since_backup = (datetime.now() - recent_backup_time).total_seconds() / 3600
-                
-                if hours_since_backup < 25:  # Бэкап был в последние 25 часов
-                    backup_stats["backup_health"] = "Healthy"
-                elif hours_since_backup < 49:  # Бэкап был в последние 49 часов
-                    backup_stats["backup_health"] = "Warning"
-                else:
-                    backup_stats["backup_health"] = "Critical"
-            else:
-                backup_stats["backup_health"] = "No Backups"
+            
+            # Проверяем здоровье бэкапов
+            backup_stats["backup_health"] = backup_health(snapshot)
+        
+        # Логический и физический размер инкрементального хранилища
+        backup_stats["incremental"] = store_stats.summary(lambda size: f"{size / (1024*1024):.1f} MB")
         
         # Проверяем статус cron задач
         try:
-            result = subprocess.run(['crontab', '-l'], capture_output=True, text=True, timeout=5)
-            if "backup.sh" in result.stdout:
-                backup_stats["cron_status"] = "Active"
-            else:
-                backup_stats["cron_status"] = "Not Found"
-        except:
+            cron_found, _ = cron_status.status()
+            backup_stats["cron_status"] = "Active" if cron_found else "Not Found"
+        except Exception:
             backup_stats["cron_status"] = "Unknown"
         
         return jsonify(backup_stats)
@@ -164,4 +226,5 @@ def backup_stats():
         }), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8001, debug=False)
+    # threaded: статус и поток вывода отвечают, пока идет бэкап
+    app.run(host='0.0.0.0', port=8001, debug=False, threaded=True)
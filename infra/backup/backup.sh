@@ -12,6 +12,7 @@ BACKUP_NAME="devops-portfolio-backup-${DATE}"
 BACKUP_PATH="${BACKUP_DIR}/${BACKUP_NAME}"
 MAX_BACKUPS=3
 LOG_FILE="/var/log/backup.log"
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
 # Цвета для вывода
 RED='\033[0;31m'
@@ -281,7 +282,7 @@ cleanup_old_backups() {
         local files_to_delete=("${backup_files[@]:$MAX_BACKUPS}")
         for file in "${files_to_delete[@]}"; do
             log "Удаление старого бэкапа: $(basename "$file")"
-            rm -f "$file"
+            rm -f "$file" "$file.index.json" "$file.verify.json"
         done
         log "✓ Удалено $((${#backup_files[@]} - MAX_BACKUPS)) старых бэкапов"
     else
@@ -310,6 +311,15 @@ verify_backup() {
             error "Архив слишком мал, возможно поврежден!"
             return 1
         fi
+        
+        # Индекс с контрольными суммами файлов: быстрая проверка и выборочное восстановление
+        if command -v python3 > /dev/null 2>&1 && [ -f "$SCRIPT_DIR/backup_index.py" ]; then
+            if python3 "$SCRIPT_DIR/backup_index.py" verify "${BACKUP_DIR}/${BACKUP_NAME}.tar.gz" > /dev/null 2>&1; then
+                log "✓ Индекс архива создан, контрольные суммы проверены"
+            else
+                warning "Не удалось создать индекс архива"
+            fi
+        fi
     else
         error "Архив не найден!"
         return 1
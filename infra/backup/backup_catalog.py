@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Каталог бэкапов в памяти
+Каждый файл stat'ится один раз, повторный обход директории - только при изменении ее mtime.
+Используется приложением (/api/system/backups) и backup-api.py (/api/backup/stats).
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from backup_index import VERIFY_SUFFIX, load_verification, verify_path
+
+BACKUP_PREFIX = "devops-portfolio-backup-"
+BACKUP_SUFFIX = ".tar.gz"
+
+# Файл, измененный недавно, может еще дописываться tar'ом - его размер перепроверяем
+SETTLE_SECONDS = 600
+
+# verification - результат последней проверки по индексу архива (backup_index.py) или None,
+# verify_mtime - st_mtime_ns файла .verify.json, по которому он прочитан (None - файла нет)
+BackupEntry = namedtuple("BackupEntry", ["path", "filename", "size", "mtime", "verification", "verify_mtime"],
+                         defaults=(None, None))
+
+UNVERIFIED = {"status": "unverified", "verified_at": None}
+
+
+class CatalogSnapshot:
+    """Неизменяемый срез каталога: файлы отсортированы от новых к старым"""
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self.total_size = sum(entry.size for entry in self.entries)
+        self.largest_size = max((entry.size for entry in self.entries), default=0)
+
+    @property
+    def count(self):
+        return len(self.entries)
+
+    @property
+    def newest(self):
+        return self.entries[0] if self.entries else None
+
+    @property
+    def oldest(self):
+        return self.entries[-1] if self.entries else None
+
+    def top(self, n):
+        return self.entries[:n]
+
+    def filter(self, min_size):
+        return CatalogSnapshot(entry for entry in self.entries if entry.size > min_size)
+
+    def intervals(self, n):
+        """Интервалы в секундах между n последними бэкапами"""
+        recent = self.entries[:n]
+        return [recent[i].mtime - recent[i + 1].mtime for i in range(len(recent) - 1)]
+
+
+class BackupCatalog:
+    """Инкрементальный индекс директории бэкапов"""
+
+    def __init__(self, backup_dir, prefix=BACKUP_PREFIX, suffix=BACKUP_SUFFIX, settle_seconds=SETTLE_SECONDS):
+        self.backup_dir = backup_dir
+        self.prefix = prefix
+        self.suffix = suffix
+        self.settle_seconds = settle_seconds
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        self._entries = {}
+        self._snapshot = CatalogSnapshot([])
+
+    @property
+    def exists(self):
+        return self._dir_mtime is not None
+
+    @staticmethod
+    def _verify_mtime(path, dir_entry=None):
+        try:
+            st = dir_entry.stat() if dir_entry is not None else os.stat(verify_path(path))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns
+
+    @staticmethod
+    def _with_verification(entry, verify_mtime):
+        # .verify.json читается, только если он изменился с прошлого раза
+        if entry.verify_mtime == verify_mtime:
+            return entry
+        verification = load_verification(entry.path) if verify_mtime is not None else None
+        return entry._replace(verification=verification, verify_mtime=verify_mtime)
+
+    def _stat_entry(self, path, name, previous=None):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        entry = BackupEntry(path, name, st.st_size, st.st_mtime)
+        if previous is not None:
+            entry = entry._replace(verification=previous.verification, verify_mtime=previous.verify_mtime)
+        return self._with_verification(entry, self._verify_mtime(path))
+
+    def _rescan(self):
+        # Новые файлы stat'им, известные берем из памяти.
+        # Запись .verify.json меняет mtime директории - результат проверки перечитываем, только если
+        # изменился сам файл (его mtime берется из того же обхода)
+        archives = {}
+        sidecars = {}
+        with os.scandir(self.backup_dir) as it:
+            for dir_entry in it:
+                name = dir_entry.name
+                if name.startswith(self.prefix) and name.endswith(self.suffix):
+                    archives[name] = dir_entry
+                elif name.startswith(self.prefix) and name.endswith(self.suffix + VERIFY_SUFFIX):
+                    sidecars[name[:-len(VERIFY_SUFFIX)]] = dir_entry
+
+        entries = {}
+        for name, dir_entry in archives.items():
+            entry = self._entries.get(name)
+            if entry is not None:
+                sidecar = sidecars.get(name)
+                entry = self._with_verification(entry, self._verify_mtime(entry.path, sidecar) if sidecar else None)
+            else:
+                entry = self._stat_entry(dir_entry.path, name)
+            if entry is not None:
+                entries[name] = entry
+        return entries
+
+    def _restat_unsettled(self):
+        now = time.time()
+        changed = False
+        for name, entry in list(self._entries.items()):
+            if now - entry.mtime >= self.settle_seconds:
+                continue
+            fresh = self._stat_entry(entry.path, name, previous=entry)
+            if fresh is None:
+                del self._entries[name]
+                changed = True
+            elif fresh != entry:
+                self._entries[name] = fresh
+                changed = True
+        return changed
+
+    def refresh(self):
+        """Синхронизирует каталог с диском: один stat директории в обычном случае"""
+        with self._lock:
+            try:
+                dir_mtime = os.stat(self.backup_dir).st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime = None
+
+            if dir_mtime is None:
+                changed = self._dir_mtime is not None or bool(self._entries)
+                self._entries = {}
+            elif dir_mtime != self._dir_mtime:
+                self._entries = self._rescan()
+                self._restat_unsettled()
+                changed = True
+            else:
+                changed = self._restat_unsettled()
+
+            self._dir_mtime = dir_mtime
+            if changed:
+                ordered = sorted(self._entries.values(), key=lambda entry: entry.mtime, reverse=True)
+                self._snapshot = CatalogSnapshot(ordered)
+            return self._snapshot
+
+    def snapshot(self):
+        return self.refresh()
+
+
+def backup_age_text(mtime, now=None):
+    """Возраст бэкапа в человекочитаемом виде"""
+    now = now or datetime.now()
+    age_days = (now - datetime.fromtimestamp(mtime)).days
+    if age_days == 0:
+        return "Сегодня"
+    elif age_days == 1:
+        return "Вчера"
+    return f"{age_days} дн. назад"
+
+
+def backup_verification(entry):
+    """Статус проверки для листинга бэкапов"""
+    return entry.verification or UNVERIFIED
+
+
+def backup_health(snapshot, now=None):
+    """Здоровье бэкапов по времени последнего бэкапа и результату его проверки"""
+    newest = snapshot.newest
+    if newest is None:
+        return "No Backups"
+    if backup_verification(newest)["status"] == "corrupt":
+        return "Critical"
+    now = now or datetime.now()
+    hours_since_backup = (now - datetime.fromtimestamp(newest.mtime)).total_seconds() / 3600
+    if hours_since_backup < 25:  # Бэкап был в последние 25 часов
+        return "Healthy"
+    elif hours_since_backup < 49:  # Бэкап был в последние 49 часов
+        return "Warning"
+    return "Critical"
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Потоковый движок бэкапов на Python
+Источники пишутся в tar напрямую (без промежуточной копии в ${BACKUP_PATH}),
+а gzip сжимает независимые блоки параллельно в пуле потоков.
+Результат - обычный devops-portfolio-backup-*.tar.gz (многочленный gzip),
+который понимают tar -xzf, restore.sh и листинг бэкапов в приложении.
+
+Запуск: python3 /opt/devops-portfolio/infra/backup/backup_engine.py [--workers N]
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tarfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from backup_jobs import command_runner
+from backup_index import HashingReader, INDEX_SUFFIX, VERIFY_SUFFIX, member_entry, verify_archive, write_index
+
+BACKUP_DIR = "/opt/backups"
+BACKUP_PREFIX = "devops-portfolio-backup-"
+MAX_BACKUPS = 3
+
+# Блок 1 MiB: достаточно крупный для хорошего сжатия и мелкий для равномерной загрузки ядер
+BLOCK_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 6
+
+PROJECT_ROOTS = ["/opt/devops-portfolio", "/app"]
+
+
+class PaddedReader:
+    """Ровно size байт файла для tarfile: если файл уменьшился или перестал читаться после записи
+    заголовка, остаток заполняется нулями, как в GNU tar - иначе в потоке остался бы битый член"""
+
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self.remaining = size
+        self.padded = 0
+        self.error = None
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = b""
+        if not self.padded and self.error is None:
+            try:
+                data = self._fileobj.read(size)
+            except OSError as e:
+                self.error = e
+        if len(data) < size:
+            self.padded += size - len(data)
+            data += bytes(size - len(data))
+        self.remaining -= size
+        return data
+
+
+class ParallelGzipWriter:
+    """Файлоподобный объект: блоки сжимаются в пуле потоков и пишутся отдельными gzip членами
+
+    zlib отпускает GIL, поэтому потоки реально используют несколько ядер.
+    Число блоков в работе ограничено - память не растет с размером бэкапа.
+    """
+
+    def __init__(self, fileobj, workers=None, block_size=BLOCK_SIZE, level=COMPRESS_LEVEL):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.level = level
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gzip")
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._submitted = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Начало каждого gzip члена: [смещение в .tar.gz, смещение в tar] - для индекса архива
+        self.blocks = []
+
+    def _compress_block(self, data):
+        # Каждый блок - полноценный gzip член (RFC 1952): заголовок, deflate, CRC32 и длина
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = compressor.compress(data) + compressor.flush()
+        header = b'\x1f\x8b\x08\x00' + struct.pack('<I', 0) + b'\x00\xff'
+        trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+        return header + body + trailer
+
+    def _submit(self, data):
+        self._pending.append((self._submitted, self._pool.submit(self._compress_block, data)))
+        self._submitted += len(data)
+        # Не держим в памяти больше 2 блоков на поток
+        while len(self._pending) > self.workers * 2:
+            self._write_result(*self._pending.popleft())
+
+    def _write_result(self, offset, future):
+        chunk = future.result()
+        self.blocks.append([self.bytes_out, offset])
+        self.fileobj.write(chunk)
+        self.bytes_out += len(chunk)
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_result(*self._pending.popleft())
+        self._pool.shutdown()
+
+
+def _first_existing(candidates, kind):
+    check = os.path.isdir if kind == "dir" else os.path.isfile
+    return next((path for path in candidates if check(path)), None)
+
+
+def default_sources(roots=PROJECT_ROOTS):
+    """Источники бэкапа и пути в архиве - та же раскладка, что создает backup.sh"""
+    sources = []
+
+    def add(candidates, arcname, kind="dir"):
+        path = _first_existing(candidates, kind)
+        if path:
+            sources.append((path, arcname))
+
+    add([f"{root}/docker-compose.yml" for root in roots], "docker/docker-compose.yml", "file")
+    for name in ("nginx", "monitoring", "logging"):
+        add([f"{root}/infra/{name}" for root in roots] + [f"{roots[0]}/{name}"], f"docker/{name}")
+    add([f"{roots[0]}/app", "/app"], "app")
+    add([f"{roots[0]}/static", "/app/static", f"{roots[0]}/app/static"], "static")
+    for name in ("README.md", "LICENSE", "Dockerfile", "docker-compose.yml"):
+        add([f"{root}/{name}" for root in roots] + [f"{root}/infra/{name}" for root in roots], name, "file")
+
+    # Все .yml/.yaml из infra с сохранением относительных путей
+    infra = _first_existing([f"{root}/infra" for root in roots], "dir")
+    if infra:
+        base = os.path.dirname(infra)
+        for dirpath, _, filenames in os.walk(infra):
+            for filename in filenames:
+                if filename.endswith((".yml", ".yaml")):
+                    path = os.path.join(dirpath, filename)
+                    sources.append((path, os.path.relpath(path, base)))
+
+    add(["/var/lib/docker/volumes/grafana-data"], "grafana/grafana-data")
+    add(["/var/lib/docker/volumes/loki-data"], "loki/loki-data")
+    return sources
+
+
+class BackupEngine:
+    """Создает архив бэкапа потоково, без промежуточной копии"""
+
+    def __init__(self, backup_dir=BACKUP_DIR, workers=None, level=COMPRESS_LEVEL,
+                 block_size=BLOCK_SIZE, max_backups=MAX_BACKUPS, log=None):
+        self.backup_dir = backup_dir
+        self.workers = workers
+        self.level = level
+        self.block_size = block_size
+        self.max_backups = max_backups
+        self.log = log or (lambda message: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}"))
+
+    def _add_member(self, tar, path, arcname, members):
+        info = tar.gettarinfo(path, arcname)
+        if info is None:
+            # Сокеты и прочие специальные файлы tar не сохраняет
+            return
+        header_offset = tar.offset
+        digest = None
+        if info.isreg():
+            # Файл открываем до записи заголовка: без прав на чтение в архив не попадет ничего
+            with open(path, "rb") as f:
+                source = PaddedReader(f, info.size)
+                reader = HashingReader(source)
+                tar.addfile(info, reader)
+            if source.padded:
+                reason = f"ошибка чтения: {source.error}" if source.error else "файл уменьшился во время чтения"
+                self.log(f"WARNING: {path}: {reason}, дополнен нулями {source.padded} байт")
+            digest = reader.hash.hexdigest()
+            data_offset = tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        else:
+            tar.addfile(info)
+            data_offset = tar.offset
+        members.append(member_entry(info, header_offset, data_offset, digest))
+
+    def _add(self, tar, path, arcname, members):
+        """Добавляет файл или дерево; недоступные файлы пропускаются с предупреждением"""
+        try:
+            self._add_member(tar, path, arcname, members)
+            if os.path.isdir(path) and not os.path.islink(path):
+                names = sorted(os.listdir(path))
+            else:
+                names = []
+        except OSError as e:
+            # Как в backup.sh: нет прав на данные Grafana/Loki - предупреждаем и продолжаем
+            self.log(f"WARNING: не удалось добавить {path}: {e}")
+            return False
+        for name in names:
+            self._add(tar, os.path.join(path, name), f"{arcname}/{name}", members)
+        return True
+
+    def create(self, sources=None, name=None):
+        """Создает архив и возвращает статистику; архив появляется под финальным именем атомарно"""
+        sources = default_sources() if sources is None else sources
+        name = name or f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        os.makedirs(self.backup_dir, exist_ok=True)
+        final_path = os.path.join(self.backup_dir, f"{name}.tar.gz")
+        # Временное имя не совпадает с шаблоном бэкапов - листинги не увидят недописанный архив
+        partial_path = os.path.join(self.backup_dir, f".{name}.tar.gz.partial")
+
+        # Остатки запуска, убитого по таймауту: except ниже в нем не выполнился
+        for entry in os.scandir(self.backup_dir):
+            if entry.name.startswith(f".{BACKUP_PREFIX}") and entry.name.endswith(".partial"):
+                self.log(f"Удаление недописанного архива: {entry.name}")
+                os.remove(entry.path)
+
+        started = time.perf_counter()
+        self.log(f"Создание архива {final_path} ({len(sources)} источников)")
+        members = []
+        try:
+            with open(partial_path, "wb") as raw:
+                writer = ParallelGzipWriter(raw, workers=self.workers, block_size=self.block_size, level=self.level)
+                try:
+                    with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                        for path, arcname in sources:
+                            if self._add(tar, path, f"{name}/{arcname}", members):
+                                self.log(f"✓ {arcname} <- {path}")
+                finally:
+                    writer.close()
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.chmod(partial_path, 0o600)
+            os.replace(partial_path, final_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        # Индекс рядом с архивом: смещения членов и sha256 файлов для быстрой проверки и выборочного восстановления
+        write_index(final_path, writer.blocks, members, writer.bytes_in)
+
+        elapsed = time.perf_counter() - started
+        stats = {
+            "path": final_path,
+            "bytes_in": writer.bytes_in,
+            "bytes_out": writer.bytes_out,
+            "seconds": round(elapsed, 3),
+            "mb_per_second": round(writer.bytes_in / (1024 * 1024) / elapsed, 2) if elapsed else None,
+            "workers": writer.workers,
+            "files": sum(1 for member in members if member["type"] == "file"),
+        }
+        self.log(f"✓ Архив создан: {final_path} ({writer.bytes_out / (1024 * 1024):.1f} MB, "
+                 f"{stats['mb_per_second']} MB/s, потоков: {writer.workers})")
+        return stats
+
+    def verify(self, path):
+        """Параллельная проверка CRC блоков и sha256 файлов по индексу; результат - в .verify.json"""
+        return verify_archive(path, workers=self.workers)
+
+    def cleanup(self):
+        """Оставляем только max_backups последних бэкапов"""
+        backups = sorted(
+            (entry for entry in os.scandir(self.backup_dir)
+             if entry.name.startswith(BACKUP_PREFIX) and entry.name.endswith(".tar.gz")),
+            key=lambda entry: entry.stat().st_mtime, reverse=True
+        )
+        for entry in backups[self.max_backups:]:
+            self.log(f"Удаление старого бэкапа: {entry.name}")
+            os.remove(entry.path)
+            for suffix in (INDEX_SUFFIX, VERIFY_SUFFIX):
+                if os.path.exists(entry.path + suffix):
+                    os.remove(entry.path + suffix)
+
+    def run(self, sources=None):
+        """Полный цикл: архив, проверка, ротация"""
+        stats = self.create(sources)
+        result = self.verify(stats["path"])
+        if result["status"] != "verified":
+            raise RuntimeError(f"Архив поврежден: {'; '.join(result['errors'])}")
+        self.log(f"✓ Архив корректен: проверено файлов {result['checked_files']} за {result['seconds']} с")
+        stats["verification"] = result
+        self.cleanup()
+        return stats
+
+
+def engine_runner(workers=None, timeout=300):
+    """Функция задачи для JobRunner (backup-api.py): движок в отдельном процессе с тем же сроком, что у backup.sh
+
+    Зависший на чтении источника процесс убивается по таймауту и освобождает ключ задачи;
+    недописанный .partial такого запуска удаляет следующий.
+    """
+    args = [sys.executable, "-u", os.path.abspath(__file__)]
+    if workers:
+        args += ["--workers", str(workers)]
+    return command_runner(args, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковый бэкап DevOps Portfolio с параллельным сжатием")
+    parser.add_argument("--output-dir", default=BACKUP_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="потоков сжатия (по умолчанию - число ядер)")
+    parser.add_argument("--level", type=int, default=COMPRESS_LEVEL)
+    parser.add_argument("--max-backups", type=int, default=MAX_BACKUPS)
+    args = parser.parse_args(argv)
+
+    engine = BackupEngine(args.output_dir, workers=args.workers, level=args.level, max_backups=args.max_backups)
+    engine.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
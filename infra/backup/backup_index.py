@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Индекс архива бэкапа: смещения членов tar и контрольные суммы файлов
+Рядом с архивом лежат два файла:
+    <name>.tar.gz.index.json  - блоки gzip, смещения и sha256 файлов (пишется при создании)
+    <name>.tar.gz.verify.json - результат последней проверки (verified/corrupt, verified_at)
+
+Архивы backup_engine.py состоят из независимых gzip членов, поэтому проверка распаковывает
+блоки параллельно, а восстановление одного файла начинается с нужного блока, без распаковки всего архива.
+Для архивов backup.sh (один gzip член, движок по умолчанию) индекс строится одним потоковым
+проходом, и проверка и восстановление остаются последовательными - ускорение только для BACKUP_ENGINE=python.
+
+Запуск: python3 backup_index.py verify ARCHIVE | index ARCHIVE | restore ARCHIVE PATH TARGET
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import sys
+import tarfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+INDEX_SUFFIX = ".index.json"
+VERIFY_SUFFIX = ".verify.json"
+INDEX_VERSION = 1
+
+# Сколько ошибок сохраняем в результате проверки
+MAX_ERRORS = 20
+READ_SIZE = 1024 * 1024
+
+
+def index_path(archive):
+    return archive + INDEX_SUFFIX
+
+
+def verify_path(archive):
+    return archive + VERIFY_SUFFIX
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+
+
+def member_type(info):
+    if info.isdir():
+        return "dir"
+    if info.issym():
+        return "symlink"
+    if info.isfile():
+        return "file"
+    return "other"
+
+
+def member_entry(info, header_offset, data_offset, sha256=None):
+    entry = {
+        "name": info.name,
+        "type": member_type(info),
+        "offset": header_offset,
+        "data_offset": data_offset,
+        "size": info.size if info.isfile() else 0,
+        "mode": info.mode,
+        "mtime": info.mtime,
+    }
+    if info.issym():
+        entry["linkname"] = info.linkname
+    if sha256 is not None:
+        entry["sha256"] = sha256
+    return entry
+
+
+def write_index(archive, blocks, members, uncompressed_size):
+    """blocks - [[смещение в .tar.gz, смещение в распакованном tar], ...] начала каждого gzip члена"""
+    _write_json(index_path(archive), {
+        "version": INDEX_VERSION,
+        "archive": os.path.basename(archive),
+        "archive_size": os.path.getsize(archive),
+        "uncompressed_size": uncompressed_size,
+        "created_at": time.time(),
+        "blocks": blocks,
+        "members": members,
+    })
+
+
+def load_index(archive):
+    with open(index_path(archive)) as f:
+        return json.load(f)
+
+
+class HashingReader:
+    """Считает sha256 данных, которые tarfile читает из файла"""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+
+def build_index(archive):
+    """Индекс для архива без него (backup.sh): один потоковый проход, весь архив - один блок"""
+    members = []
+    with tarfile.open(archive, mode="r|gz") as tar:
+        for info in tar:
+            digest = None
+            if info.isfile():
+                digest = hashlib.sha256()
+                source = tar.extractfile(info)
+                for data in iter(lambda: source.read(READ_SIZE), b""):
+                    digest.update(data)
+                digest = digest.hexdigest()
+            members.append(member_entry(info, info.offset, info.offset_data, digest))
+        uncompressed_size = tar.offset
+    write_index(archive, [[0, 0]], members, uncompressed_size)
+    return load_index(archive)
+
+
+def _decompress_member(data):
+    """Распаковка одного gzip члена; zlib сам проверяет CRC32 и длину из трейлера"""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    result = decompressor.decompress(data)
+    if not decompressor.eof:
+        raise zlib.error("gzip блок обрезан")
+    return result
+
+
+def _stream_from(f, compressed_offset):
+    """Распакованные данные начиная с блока по смещению; переходит через границы gzip членов"""
+    f.seek(compressed_offset)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    pending = False
+    for data in iter(lambda: f.read(READ_SIZE), b""):
+        while data:
+            pending = True
+            yield decompressor.decompress(data)
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                pending = False
+            else:
+                data = b""
+    if pending:
+        raise zlib.error("gzip блок обрезан")
+
+
+def _iter_uncompressed(archive, index, workers):
+    """(смещение, данные) по порядку; независимые gzip члены распаковываются параллельно"""
+    blocks = index["blocks"]
+    archive_size = index["archive_size"]
+    if len(blocks) == 1:
+        # Один gzip член (архив backup.sh) - только последовательно
+        with open(archive, "rb") as f:
+            position = 0
+            for data in _stream_from(f, 0):
+                yield position, data
+                position += len(data)
+        return
+
+    ends = [block[0] for block in blocks[1:]] + [archive_size]
+    sizes = [block[1] for block in blocks[1:]] + [index["uncompressed_size"]]
+    fd = os.open(archive, os.O_RDONLY)
+    try:
+        def load(i):
+            offset = blocks[i][0]
+            return _decompress_member(os.pread(fd, ends[i] - offset, offset))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Окно ограничено - в памяти не больше 2 блоков на поток
+            window = workers * 2
+            futures = [pool.submit(load, i) for i in range(min(window, len(blocks)))]
+            for i in range(len(blocks)):
+                data = futures[i].result()
+                futures[i] = None
+                if i + window < len(blocks):
+                    futures.append(pool.submit(load, i + window))
+                if blocks[i][1] + len(data) != sizes[i]:
+                    raise zlib.error(f"Размер блока {i} не совпадает с индексом")
+                yield blocks[i][1], data
+    finally:
+        os.close(fd)
+
+
+def verify_archive(archive, workers=None, record=True):
+    """Проверяет CRC всех gzip блоков и sha256 всех файлов; результат пишется в .verify.json"""
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    errors = []
+    checked = 0
+    try:
+        index = load_index(archive) if os.path.exists(index_path(archive)) else build_index(archive)
+        if os.path.getsize(archive) != index["archive_size"]:
+            raise ValueError("Размер архива не совпадает с индексом")
+
+        files = sorted((m for m in index["members"] if m["type"] == "file" and "sha256" in m),
+                       key=lambda m: m["data_offset"])
+        current = 0
+        digest = hashlib.sha256()
+        for offset, data in _iter_uncompressed(archive, index, workers):
+            end = offset + len(data)
+            while current < len(files):
+                member = files[current]
+                start, stop = member["data_offset"], member["data_offset"] + member["size"]
+                if start >= end:
+                    break
+                digest.update(data[max(start, offset) - offset:min(stop, end) - offset])
+                if stop > end:
+                    break
+                if digest.hexdigest() != member["sha256"]:
+                    errors.append(f"Контрольная сумма не совпадает: {member['name']}")
+                checked += 1
+                current += 1
+                digest = hashlib.sha256()
+        if current < len(files):
+            errors.append(f"Архив обрезан: не проверено файлов {len(files) - current}")
+    except (OSError, EOFError, ValueError, KeyError, zlib.error, tarfile.TarError) as e:
+        errors.append(f"Архив поврежден: {e}")
+
+    result = {
+        "status": "corrupt" if errors else "verified",
+        "verified_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "checked_files": checked,
+        "seconds": round(time.perf_counter() - started, 3),
+        "errors": errors[:MAX_ERRORS],
+    }
+    if record:
+        _write_json(verify_path(archive), result)
+    return result
+
+
+def load_verification(archive):
+    """Результат последней проверки или None"""
+    try:
+        with open(verify_path(archive)) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {"status": data.get("status"), "verified_at": data.get("verified_at")}
+
+
+def verify_runner(archive, workers=None):
+    """Функция задачи для JobRunner (backup-api.py): проверка архива по индексу"""
+
+    def run(job):
+        job.write("stdout", f"Проверка {os.path.basename(archive)}...")
+        result = verify_archive(archive, workers=workers)
+        for error in result["errors"]:
+            job.write("stderr", error)
+        job.write("stdout", f"Статус: {result['status']}, файлов проверено: {result['checked_files']}, "
+                            f"{result['seconds']} с")
+        return 0 if result["status"] == "verified" else 1
+
+    return run
+
+
+def _relative_name(name):
+    # В архиве все лежит под <BACKUP_NAME>/ - путь для восстановления указываем без него
+    return name.split("/", 1)[1] if "/" in name else ""
+
+
+def _inside(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def restore_path(archive, path, target):
+    """Восстанавливает файл или директорию из архива, распаковывая только нужные блоки"""
+    index = load_index(archive) if os.path.exists(index_path(archive)) else build_index(archive)
+    path = path.strip("/")
+    selected = [m for m in index["members"]
+                if _relative_name(m["name"]) == path or _relative_name(m["name"]).startswith(path + "/")]
+    if not selected:
+        raise FileNotFoundError(f"В архиве нет {path}")
+
+    block_starts = [block[1] for block in index["blocks"]]
+    restored = 0
+    root = os.path.realpath(target)
+    with open(archive, "rb") as f:
+        for member in selected:
+            destination = os.path.join(target, member["name"])
+            # Путь проверяется с разрешением ссылок: восстановленная ранее ссылка dir -> /etc
+            # не должна увести запись X/dir/passwd за пределы target
+            checked = destination if member["type"] == "dir" else os.path.dirname(destination)
+            if (not _inside(os.path.abspath(destination), os.path.abspath(target))
+                    or not _inside(os.path.realpath(checked), root)):
+                raise ValueError(f"Небезопасный путь в архиве: {member['name']}")
+            if member["type"] == "dir":
+                os.makedirs(destination, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if os.path.islink(destination):
+                # Иначе open() записал бы файл туда, куда указывает ссылка
+                os.remove(destination)
+            if member["type"] == "symlink":
+                linkname = member["linkname"]
+                if (os.path.isabs(linkname) or
+                        not _inside(os.path.realpath(os.path.join(os.path.dirname(destination), linkname)), root)):
+                    raise ValueError(f"Небезопасная ссылка в архиве: {member['name']} -> {linkname}")
+                if os.path.lexists(destination):
+                    os.remove(destination)
+                os.symlink(linkname, destination)
+                continue
+            if member["type"] != "file":
+                continue
+
+            # Ближайший gzip член, в котором начинаются данные файла
+            block = index["blocks"][bisect.bisect_right(block_starts, member["data_offset"]) - 1]
+            skip = member["data_offset"] - block[1]
+            remaining = member["size"]
+            digest = hashlib.sha256()
+            with open(destination, "wb") as out:
+                for data in _stream_from(f, block[0]):
+                    if skip >= len(data):
+                        skip -= len(data)
+                        continue
+                    data = data[skip:skip + remaining]
+                    skip = 0
+                    out.write(data)
+                    digest.update(data)
+                    remaining -= len(data)
+                    if not remaining:
+                        break
+            if remaining or ("sha256" in member and digest.hexdigest() != member["sha256"]):
+                raise ValueError(f"Файл {member['name']} в архиве поврежден")
+            os.chmod(destination, member["mode"])
+            os.utime(destination, (member["mtime"], member["mtime"]))
+            restored += 1
+    return restored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка и выборочное восстановление бэкапов по индексу")
+    commands = parser.add_subparsers(dest="command", required=True)
+    verify = commands.add_parser("verify")
+    verify.add_argument("archive")
+    verify.add_argument("--workers", type=int, default=None)
+    index = commands.add_parser("index")
+    index.add_argument("archive")
+    restore = commands.add_parser("restore")
+    restore.add_argument("archive")
+    restore.add_argument("path", help="путь внутри бэкапа, например docker/nginx")
+    restore.add_argument("target")
+    args = parser.parse_args(argv)
+
+    if args.command == "verify":
+        result = verify_archive(args.archive, workers=args.workers)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return 0 if result["status"] == "verified" else 1
+    if args.command == "index":
+        index = build_index(args.archive)
+        print(f"Индекс построен: {len(index['members'])} членов")
+        return 0
+    restored = restore_path(args.archive, args.path, args.target)
+    print(f"Восстановлено файлов: {restored}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновые задачи бэкапа для backup-api.py
+POST сразу возвращает id задачи, задача выполняется в небольшом пуле потоков.
+Одновременно выполняется не больше одной задачи с тем же ключом (single-flight),
+а очередь ограничена: сверх нее submit отказывает (JobQueueFull), API отвечает 429.
+"""
+
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Сколько строк вывода храним на задачу
+MAX_OUTPUT_LINES = 5000
+
+
+class JobQueueFull(Exception):
+    """Все потоки заняты и очередь задач заполнена"""
+
+    def __init__(self, active, limit):
+        super().__init__(f"Очередь задач заполнена: {active} из {limit}")
+        self.active = active
+        self.limit = limit
+
+
+class BackupJob:
+    """Одна задача: статус, время и построчный вывод"""
+
+    def __init__(self, key, engine=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        # Движок бэкапа: дедуплицированный запрос получает движок уже выполняющейся задачи
+        self.engine = engine
+        self.status = "queued"
+        self.returncode = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lines = deque(maxlen=MAX_OUTPUT_LINES)
+        # Номер первой строки в deque - чтобы читатель не терял позицию после вытеснения старых строк
+        self._first_line = 0
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed", "timeout")
+
+    def write(self, stream, line):
+        with self._cond:
+            if len(self._lines) == self._lines.maxlen:
+                self._first_line += 1
+            self._lines.append((stream, line.rstrip('\n')))
+            self._cond.notify_all()
+
+    def _set_status(self, status, returncode=None, error=None):
+        with self._cond:
+            self.status = status
+            if status == "running":
+                self.started_at = time.time()
+            if self.finished:
+                self.returncode = returncode
+                self.error = error
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def output(self, stream=None):
+        with self._cond:
+            return '\n'.join(text for name, text in self._lines if stream is None or name == stream)
+
+    def follow(self, timeout=15.0):
+        """Генератор строк вывода по мере появления; None - keepalive, пока новых строк нет"""
+        position = 0
+        while True:
+            with self._cond:
+                if position - self._first_line >= len(self._lines) and not self.finished:
+                    self._cond.wait(timeout)
+                position = max(position, self._first_line)
+                pending = list(self._lines)[position - self._first_line:]
+                position += len(pending)
+                done = self.finished and position - self._first_line >= len(self._lines)
+            if not pending and not done:
+                yield None
+            for item in pending:
+                yield item
+            if done:
+                return
+
+    def to_dict(self, include_output=True):
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
+
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "returncode": self.returncode,
+            "created_at": fmt(self.created_at),
+            "started_at": fmt(self.started_at),
+            "finished_at": fmt(self.finished_at),
+            "duration_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+        }
+        if self.engine:
+            data["engine"] = self.engine
+        if self.error:
+            data["error"] = self.error
+        if include_output:
+            data["output"] = self.output("stdout")
+            data["stderr"] = self.output("stderr")
+        return data
+
+
+def command_runner(args, cwd=None, timeout=300):
+    """Функция задачи, запускающая внешнюю команду и транслирующая ее stdout/stderr в задачу"""
+
+    def run(job):
+        process = subprocess.Popen(
+            args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1
+        )
+
+        def pump(pipe, stream):
+            for line in pipe:
+                job.write(stream, line)
+            pipe.close()
+
+        readers = [
+            threading.Thread(target=pump, args=(process.stdout, "stdout"), daemon=True),
+            threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            for reader in readers:
+                reader.join(timeout=5)
+        return returncode
+
+    return run
+
+
+class JobRunner:
+    """Выполняет задачи в пуле из workers потоков, дедуплицирует одинаковые и хранит ограниченную историю
+
+    Бэкап и проверки читают те же диски - одновременно их не больше workers, еще до max_queued ждут в очереди.
+    """
+
+    def __init__(self, max_history=20, workers=2, max_queued=8):
+        self.max_history = max_history
+        self.workers = workers
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._active = {}
+        self._jobs = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backup-job")
+
+    def submit(self, key, run, engine=None):
+        """Возвращает (задача, создана_ли_новая); пока задача с key активна, новая не запускается
+
+        JobQueueFull - если выполняются workers задач и max_queued уже ждут.
+        """
+        with self._lock:
+            active = self._active.get(key)
+            if active is not None:
+                return active, False
+            limit = self.workers + self.max_queued
+            if len(self._active) >= limit:
+                raise JobQueueFull(len(self._active), limit)
+            job = BackupJob(key, engine)
+            self._active[key] = job
+            self._jobs[job.id] = job
+            self._trim_history()
+            self._pool.submit(self._execute, job, run)
+        return job, True
+
+    def _execute(self, job, run):
+        job._set_status("running")
+        try:
+            returncode = run(job)
+            job._set_status("succeeded" if returncode == 0 else "failed", returncode=returncode)
+        except subprocess.TimeoutExpired as e:
+            job._set_status("timeout", error=f"Таймаут: задача выполнялась дольше {e.timeout} секунд")
+        except Exception as e:
+            job._set_status("failed", error=str(e))
+        finally:
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+                self._trim_history()
+
+    def _trim_history(self):
+        # Удаляем самые старые завершенные задачи сверх лимита
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, key):
+        with self._lock:
+            return self._active.get(key)
+
+    def list(self):
+        with self._lock:
+            return list(reversed(self._jobs.values()))
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Инкрементальное хранилище бэкапов с дедупликацией
+Файлы режутся на чанки по содержимому (gear hash), каждый уникальный чанк хранится
+один раз под своим sha256, на каждый бэкап пишется небольшой манифест.
+Неизмененные файлы (тот же размер и mtime) вообще не читаются - берутся чанки из прошлого манифеста.
+
+Раскладка:
+    ${BACKUP_DIR}/store/chunks/ab/abcdef...   - чанк, сжатый zlib
+    ${BACKUP_DIR}/store/manifests/<name>.json - манифест бэкапа
+    ${BACKUP_DIR}/store/stats.json            - логический/физический размер для API
+
+Запуск: python3 backup_store.py backup | list | stats | prune --keep N | restore NAME TARGET | export NAME | check
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import sys
+import tarfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from backup_engine import BACKUP_DIR, BACKUP_PREFIX, default_sources
+from backup_jobs import command_runner
+
+STORE_DIR = os.path.join(BACKUP_DIR, "store")
+KEEP_SNAPSHOTS = 30
+
+# Границы чанков: минимум 256 KiB, в среднем ~1 MiB, максимум 4 MiB
+MIN_CHUNK = 256 * 1024
+AVG_CHUNK_BITS = 20
+MAX_CHUNK = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# Таблица gear hash должна быть одинаковой между запусками, иначе границы чанков "поплывут"
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") for i in range(256)]
+# Младшие биты gear hash зависят только от последних байт - маску берем по старшим
+CUT_MASK = ((1 << AVG_CHUNK_BITS) - 1) << (32 - AVG_CHUNK_BITS)
+
+
+# Gear hash без цикла по байтам в интерпретаторе. Хеш после байта i - это
+# sum(GEAR[data[i - k]] << k, k < 32) mod 2^32: старшие слагаемые вытесняются сдвигом.
+# Блок байт раскладывается в одно большое целое, где каждому байту отведена 64-битная
+# "дорожка" со значением GEAR, и окно в 32 байта суммируется пятью сдвигами со сложением
+# (h += h << 65 * w: соседняя дорожка со сдвигом на бит). Сумма в дорожке меньше 2^64 и не
+# переносится в соседнюю, младшие 32 бита дорожки равны хешу. Границы те же, что у
+# побайтового цикла (_find_cut_bytewise), поэтому уже сохраненные чанки дедуплицируются.
+GEAR_PLANES = [bytes((g >> (8 * j)) & 0xFF for g in GEAR) for j in range(4)]
+HIGH_NIBBLE = bytes(b & 0xF0 for b in range(256))
+GEAR_WINDOW = 32
+SCAN_BLOCK = 32 * 1024
+
+
+def _find_cut_bytewise(data, start, end):
+    """Эталонный побайтовый find_cut - для самопроверки"""
+    if end - start <= MIN_CHUNK:
+        return end
+    gear = GEAR
+    mask = CUT_MASK
+    h = 0
+    for i in range(start + MIN_CHUNK, end):
+        h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+        if not h & mask:
+            return i + 1
+    return end
+
+
+def find_cut(data, start, end):
+    """Позиция конца чанка в data[start:end] по содержимому (или end, если граница не найдена)"""
+    if end - start <= MIN_CHUNK:
+        return end
+    # Хеш начинается с нуля после MIN_CHUNK байт, как в побайтовом цикле
+    base = start + MIN_CHUNK
+    view = memoryview(data)
+    position = base
+    while position < end:
+        stop = min(end, position + SCAN_BLOCK)
+        # Хвост прошлого блока: хеш в начале блока зависит от предыдущих 31 байта
+        lo = max(base, position - (GEAR_WINDOW - 1))
+        block = view[lo:stop].tobytes()
+        n = len(block)
+        lanes = bytearray(8 * n)
+        for j, plane in enumerate(GEAR_PLANES):
+            lanes[j::8] = block.translate(plane)
+        h = int.from_bytes(lanes, "little")
+        width = 1
+        while width < GEAR_WINDOW:
+            h += h << (65 * width)
+            width *= 2
+        out = h.to_bytes((h.bit_length() + 7) // 8, "little")
+        # Нулевой байт - дорожка, где все биты маски (12..31) нулевые
+        hits = (int.from_bytes(out[1:8 * n:8].translate(HIGH_NIBBLE), "little")
+                | int.from_bytes(out[2:8 * n:8], "little")
+                | int.from_bytes(out[3:8 * n:8], "little")).to_bytes(n, "little")
+        k = hits.find(0, position - lo)
+        if k >= 0:
+            return lo + k + 1
+        position = stop
+    return end
+
+
+def iter_chunks(f):
+    """Чанки файла по содержимому; в памяти не больше MAX_CHUNK + READ_SIZE"""
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK:
+            block = f.read(READ_SIZE)
+            if not block:
+                eof = True
+            buffer += block
+        if not buffer:
+            return
+        cut = find_cut(buffer, 0, min(len(buffer), MAX_CHUNK))
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BackupStore:
+    """Хранилище чанков и манифестов"""
+
+    def __init__(self, store_dir=STORE_DIR, log=None):
+        self.store_dir = store_dir
+        self.chunks_dir = os.path.join(store_dir, "chunks")
+        self.manifests_dir = os.path.join(store_dir, "manifests")
+        self.stats_path = os.path.join(store_dir, "stats.json")
+        self.log = log or (lambda message: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}"))
+
+    @contextmanager
+    def _locked(self):
+        # Бэкап и очистка не должны идти одновременно: GC удалил бы чанки нового бэкапа
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(os.path.join(self.store_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _manifest_path(self, name):
+        return os.path.join(self.manifests_dir, f"{name}.json")
+
+    def snapshots(self):
+        """Имена бэкапов от новых к старым"""
+        try:
+            names = [name[:-5] for name in os.listdir(self.manifests_dir) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        return sorted(names, reverse=True)
+
+    def load_manifest(self, name):
+        with open(self._manifest_path(name)) as f:
+            return json.load(f)
+
+    def _put_chunk(self, data):
+        """Сохраняет чанк, если его еще нет; возвращает (digest, записано_байт)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        _write_atomic(path, compressed)
+        return digest, len(compressed)
+
+    def _iter_source_files(self, sources):
+        for path, arcname in sources:
+            if os.path.isfile(path) or os.path.islink(path):
+                yield path, arcname
+                continue
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                rel = os.path.relpath(dirpath, path)
+                base = arcname if rel == "." else os.path.join(arcname, rel)
+                yield dirpath, base
+                for filename in sorted(filenames):
+                    yield os.path.join(dirpath, filename), os.path.join(base, filename)
+
+    def _store_file(self, path, arcname, st, previous):
+        entry = {"path": arcname, "mode": stat.S_IMODE(st.st_mode), "mtime": st.st_mtime}
+        if stat.S_ISLNK(st.st_mode):
+            entry.update(type="symlink", target=os.readlink(path))
+            return entry, 0, False
+        if stat.S_ISDIR(st.st_mode):
+            entry["type"] = "dir"
+            return entry, 0, False
+
+        entry.update(type="file", size=st.st_size)
+        known = previous.get(arcname)
+        # Файл не менялся - не читаем его, если все его чанки на месте
+        if (known and known.get("size") == st.st_size and known.get("mtime_ns") == st.st_mtime_ns
+                and all(os.path.exists(self._chunk_path(digest)) for digest in known["chunks"])):
+            entry.update(mtime_ns=st.st_mtime_ns, chunks=known["chunks"])
+            return entry, 0, False
+
+        chunks = []
+        written = 0
+        with open(path, "rb") as f:
+            for data in iter_chunks(f):
+                digest, size = self._put_chunk(data)
+                chunks.append(digest)
+                written += size
+        entry.update(mtime_ns=st.st_mtime_ns, chunks=chunks)
+        return entry, written, True
+
+    def backup(self, sources=None, name=None):
+        """Инкрементальный бэкап: читаются только измененные файлы, пишутся только новые чанки"""
+        sources = default_sources() if sources is None else sources
+        name = name or f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        started = time.perf_counter()
+
+        with self._locked():
+            os.makedirs(self.chunks_dir, exist_ok=True)
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            snapshots = self.snapshots()
+            previous = {}
+            if snapshots:
+                previous = {entry["path"]: entry for entry in self.load_manifest(snapshots[0])["files"]
+                            if entry["type"] == "file"}
+
+            files = []
+            logical = written = read_files = 0
+            for path, arcname in self._iter_source_files(sources):
+                try:
+                    st = os.lstat(path)
+                    entry, size, was_read = self._store_file(path, arcname, st, previous)
+                except OSError as e:
+                    # Как в backup.sh: нет прав на файл - предупреждаем и продолжаем
+                    self.log(f"WARNING: не удалось добавить {path}: {e}")
+                    continue
+                files.append(entry)
+                logical += entry.get("size", 0)
+                written += size
+                read_files += was_read
+
+            manifest = {
+                "name": name,
+                "created_at": time.time(),
+                "logical_size": logical,
+                "new_bytes": written,
+                "files": files,
+            }
+            # Манифест пишется последним: бэкап без манифеста не виден и будет убран GC
+            _write_atomic(self._manifest_path(name), json.dumps(manifest, separators=(",", ":")).encode())
+            self._update_stats(added=written + os.path.getsize(self._manifest_path(name)))
+
+        elapsed = time.perf_counter() - started
+        self.log(f"✓ Инкрементальный бэкап {name}: {len(files)} записей, прочитано файлов: {read_files}, "
+                 f"логически {logical / (1024 * 1024):.1f} MB, новых данных {written / (1024 * 1024):.1f} MB "
+                 f"за {elapsed:.1f} с")
+        return manifest
+
+    def prune(self, keep=KEEP_SNAPSHOTS):
+        """Оставляет keep последних бэкапов и удаляет чанки, на которые больше никто не ссылается"""
+        with self._locked():
+            snapshots = self.snapshots()
+            for name in snapshots[keep:]:
+                self.log(f"Удаление старого бэкапа: {name}")
+                os.remove(self._manifest_path(name))
+
+            referenced = set()
+            for name in snapshots[:keep]:
+                for entry in self.load_manifest(name)["files"]:
+                    referenced.update(entry.get("chunks", ()))
+
+            removed = 0
+            physical = 0
+            if os.path.isdir(self.chunks_dir):
+                for dir_entry in os.scandir(self.chunks_dir):
+                    for chunk in os.scandir(dir_entry.path):
+                        if chunk.name in referenced:
+                            physical += chunk.stat().st_size
+                        else:
+                            # Недописанные .tmp тоже сюда попадают: под блокировкой их никто не пишет
+                            os.remove(chunk.path)
+                            removed += 1
+            physical += sum(os.path.getsize(self._manifest_path(name)) for name in snapshots[:keep])
+            self._write_stats(physical)
+            self.log(f"✓ Удалено чанков: {removed}, занято {physical / (1024 * 1024):.1f} MB")
+            return removed
+
+    def _write_stats(self, physical_size):
+        snapshots = self.snapshots()
+        logical = 0
+        for name in snapshots:
+            logical += self.load_manifest(name)["logical_size"]
+        _write_atomic(self.stats_path, json.dumps({
+            "snapshots": len(snapshots),
+            "logical_size": logical,
+            "physical_size": physical_size,
+            "newest": snapshots[0] if snapshots else None,
+            "updated_at": time.time(),
+        }).encode())
+
+    def _update_stats(self, added):
+        try:
+            with open(self.stats_path) as f:
+                physical = json.load(f)["physical_size"] + added
+        except (FileNotFoundError, ValueError, KeyError):
+            physical = self._physical_size()
+        self._write_stats(physical)
+
+    def _physical_size(self):
+        total = 0
+        for directory in (self.chunks_dir, self.manifests_dir):
+            for dirpath, _, filenames in os.walk(directory):
+                total += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+        return total
+
+    def _read_chunks(self, digests):
+        for digest in digests:
+            with open(self._chunk_path(digest), "rb") as f:
+                data = zlib.decompress(f.read())
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"Чанк {digest} поврежден")
+            yield data
+
+    def restore(self, name, target, prefix=""):
+        """Восстанавливает бэкап (или его часть по префиксу пути) в target/<name>/..."""
+        manifest = self.load_manifest(name)
+        root = os.path.join(target, name)
+        restored = 0
+        for entry in manifest["files"]:
+            if prefix and not (entry["path"] == prefix or entry["path"].startswith(prefix.rstrip("/") + "/")):
+                continue
+            path = os.path.join(root, entry["path"])
+            if entry["type"] == "dir":
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if entry["type"] == "symlink":
+                if os.path.lexists(path):
+                    os.remove(path)
+                os.symlink(entry["target"], path)
+                continue
+            with open(path, "wb") as f:
+                for data in self._read_chunks(entry["chunks"]):
+                    f.write(data)
+            os.chmod(path, entry["mode"])
+            os.utime(path, (entry["mtime"], entry["mtime"]))
+            restored += 1
+        self.log(f"✓ Восстановлено файлов: {restored} в {root}")
+        return root
+
+    def export(self, name, output_dir=BACKUP_DIR):
+        """Собирает обычный devops-portfolio-backup-*.tar.gz из манифеста (для restore.sh)"""
+        manifest = self.load_manifest(name)
+        output_path = os.path.join(output_dir, f"{name}.tar.gz")
+        with tarfile.open(output_path, "w:gz") as tar:
+            for entry in manifest["files"]:
+                info = tarfile.TarInfo(f"{name}/{entry['path']}")
+                info.mode = entry["mode"]
+                info.mtime = entry["mtime"]
+                if entry["type"] == "dir":
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                elif entry["type"] == "symlink":
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = entry["target"]
+                    tar.addfile(info)
+                else:
+                    info.size = entry["size"]
+                    tar.addfile(info, _ChunkReader(self._read_chunks(entry["chunks"])))
+        os.chmod(output_path, 0o600)
+        self.log(f"✓ Архив собран: {output_path}")
+        return output_path
+
+
+class _ChunkReader:
+    """Файлоподобное чтение последовательности чанков для tarfile.addfile
+
+    Текущий чанк читается через memoryview со смещением без копирования остатка;
+    склейка нужна только для чтения на стыке чанков.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._view = memoryview(b"")
+        self._offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._view):
+                data = next(self._chunks, None)
+                if data is None:
+                    break
+                self._view, self._offset = memoryview(data), 0
+            end = len(self._view) if size < 0 else min(len(self._view), self._offset + size)
+            parts.append(self._view[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return parts[0].tobytes() if len(parts) == 1 else b"".join(parts)
+
+
+class StoreStats:
+    """Логический и физический размер хранилища для API; stats.json читается заново только при изменении"""
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.stats_path = os.path.join(store_dir, "stats.json")
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._stats = None
+
+    def get(self):
+        """Словарь со статистикой или None, если инкрементальных бэкапов нет"""
+        try:
+            mtime = os.stat(self.stats_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.stats_path) as f:
+                        self._stats = json.load(f)
+                except (OSError, ValueError):
+                    return self._stats
+                self._mtime = mtime
+            return self._stats
+
+    def summary(self, format_size):
+        """Блок "incremental" для /api/system/backups и /api/backup/stats"""
+        stats = self.get()
+        if not stats:
+            return None
+        logical, physical = stats["logical_size"], stats["physical_size"]
+        return {
+            "snapshots": stats["snapshots"],
+            "newest": stats["newest"],
+            "logical_size": format_size(logical),
+            "physical_size": format_size(physical),
+            "logical_size_bytes": logical,
+            "physical_size_bytes": physical,
+            "dedup_ratio": round(logical / physical, 2) if physical else None,
+        }
+
+
+def store_runner(store_dir=STORE_DIR, keep=KEEP_SNAPSHOTS, timeout=300):
+    """Функция задачи для JobRunner (backup-api.py): инкрементальный бэкап и ротация в отдельном процессе
+
+    Процесс убивается по таймауту; блокировка хранилища (flock) освобождается вместе с ним.
+    """
+    args = [sys.executable, "-u", os.path.abspath(__file__), "--store", store_dir, "backup", "--keep", str(keep)]
+    return command_runner(args, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=timeout)
+
+
+def run_check(size_mb=32, min_mb_per_second=8.0):
+    """Самопроверка нарезки: границы совпадают с побайтовым циклом, скорость не ниже порога"""
+    import random
+    rng = random.Random(42)
+    size = size_mb * 1024 * 1024
+    data = bytearray(rng.getrandbits(8 * size).to_bytes(size, "little"))
+    # Нули и повторяющийся текст: на них хеш ведет себя иначе, чем на случайных данных
+    data[size // 4:size // 4 + MAX_CHUNK + MIN_CHUNK] = bytes(MAX_CHUNK + MIN_CHUNK)
+    data[size // 2:size // 2 + 2 * MAX_CHUNK] = (b"backup " * (2 * MAX_CHUNK))[:2 * MAX_CHUNK]
+
+    failures = []
+    started = time.perf_counter()
+    cuts = []
+    position = 0
+    while position < size:
+        position = find_cut(data, position, min(size, position + MAX_CHUNK))
+        cuts.append(position)
+    seconds = time.perf_counter() - started
+    mb_per_second = size_mb / seconds
+    print(f"Нарезка на чанки: {mb_per_second:.1f} MB/s ({size_mb} MB, чанков: {len(cuts)}, "
+          f"в среднем {size / len(cuts) / 1024:.0f} KiB)")
+    if mb_per_second < min_mb_per_second:
+        failures.append(f"нарезка {mb_per_second:.1f} MB/s, ожидалось не меньше {min_mb_per_second} MB/s")
+
+    # Эталонный цикл медленный - сверяем границы на первых 16 MB
+    reference = []
+    position = 0
+    while position < min(size, 16 * 1024 * 1024):
+        position = _find_cut_bytewise(data, position, min(size, position + MAX_CHUNK))
+        reference.append(position)
+    if cuts[:len(reference)] != reference:
+        failures.append(f"границы чанков не совпадают с побайтовым циклом: {cuts[:len(reference)]} != {reference}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Инкрементальные бэкапы DevOps Portfolio с дедупликацией")
+    parser.add_argument("--store", default=STORE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    backup = commands.add_parser("backup")
+    backup.add_argument("--keep", type=int, default=int(os.environ.get("BACKUP_STORE_KEEP", KEEP_SNAPSHOTS)))
+    commands.add_parser("list")
+    commands.add_parser("stats")
+    prune = commands.add_parser("prune")
+    prune.add_argument("--keep", type=int, default=KEEP_SNAPSHOTS)
+    restore = commands.add_parser("restore")
+    restore.add_argument("name")
+    restore.add_argument("target")
+    restore.add_argument("--path", default="", help="восстановить только этот файл или директорию")
+    export = commands.add_parser("export")
+    export.add_argument("name")
+    export.add_argument("--output-dir", default=BACKUP_DIR)
+    check = commands.add_parser("check", help="самопроверка нарезки на чанки")
+    check.add_argument("--size-mb", type=int, default=32)
+    check.add_argument("--min-mbps", type=float, default=8.0, help="минимальная скорость нарезки, MB/s")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        failures = run_check(args.size_mb, args.min_mbps)
+        for line in failures:
+            print(f"ОШИБКА: {line}")
+        return 1 if failures else 0
+
+    store = BackupStore(args.store)
+    if args.command == "backup":
+        store.backup()
+        store.prune(args.keep)
+    elif args.command == "list":
+        for name in store.snapshots():
+            manifest = store.load_manifest(name)
+            print(f"{name}  {manifest['logical_size'] / (1024 * 1024):.1f} MB  "
+                  f"новых {manifest['new_bytes'] / (1024 * 1024):.1f} MB")
+    elif args.command == "stats":
+        print(json.dumps(StoreStats(args.store).get(), indent=2))
+    elif args.command == "prune":
+        store.prune(args.keep)
+    elif args.command == "restore":
+        store.restore(args.name, args.target, args.path)
+    elif args.command == "export":
+        store.export(args.name, args.output_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк бэкапа: backup.sh против backup_engine.py на синтетическом дереве
+Способ backup.sh воспроизводится теми же командами: cp -r в staging, tar -czf, rm -rf staging.
+Сам backup.sh не запускается - в нем зашиты пути /opt/backups и /opt/devops-portfolio.
+
+Запуск: python3 infra/backup/benchmark_backup.py --size-mb 512 --workers 1,2,4
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from backup_engine import BackupEngine
+
+
+def build_tree(root, size_mb, seed=42):
+    """Дерево, похожее на реальный бэкап: много мелких конфигов, логи и несжимаемые данные"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10)))
+             for _ in range(2000)]
+    target = size_mb * 1024 * 1024
+    written = 0
+    index = 0
+    while written < target:
+        kind = index % 10
+        directory = os.path.join(root, f"dir{index % 16}", f"sub{index % 5}")
+        os.makedirs(directory, exist_ok=True)
+        if kind < 6:
+            # Конфиги и код: мелкие хорошо сжимаемые файлы
+            size = rng.randint(1, 64) * 1024
+            data = ' '.join(rng.choice(words) for _ in range(size // 6)).encode()[:size]
+            name = f"config{index}.yml"
+        elif kind < 9:
+            # Логи: крупнее, сжимаются хорошо
+            size = rng.randint(1, 8) * 1024 * 1024
+            line = ' '.join(rng.choice(words) for _ in range(20)).encode() + b'\n'
+            data = (line * (size // len(line) + 1))[:size]
+            name = f"app{index}.log"
+        else:
+            # Данные Grafana/Loki: сжимаются плохо
+            size = rng.randint(1, 16) * 1024 * 1024
+            data = os.urandom(size)
+            name = f"chunk{index}.bin"
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        written += len(data)
+        index += 1
+    return written, index
+
+
+def drop_page_cache_hint(path):
+    # Без root сбросить page cache нельзя; прогреваем кеш одинаково для всех вариантов
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename), 'rb') as f:
+                while f.read(1024 * 1024):
+                    pass
+
+
+def run_script_method(source, output_dir, name):
+    """Как backup.sh: копия в ${BACKUP_PATH}, однопоточный tar -czf, удаление staging"""
+    staging = os.path.join(output_dir, name)
+    started = time.perf_counter()
+    subprocess.run(["cp", "-r", source, staging], check=True)
+    subprocess.run(["tar", "-czf", f"{name}.tar.gz", name], cwd=output_dir, check=True)
+    shutil.rmtree(staging)
+    return time.perf_counter() - started, os.path.getsize(os.path.join(output_dir, f"{name}.tar.gz"))
+
+
+def run_engine_method(source, output_dir, name, workers):
+    engine = BackupEngine(output_dir, workers=workers, log=lambda message: None)
+    stats = engine.create(sources=[(source, "data")], name=name)
+    return stats["seconds"], stats["bytes_out"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение MB/s: backup.sh и backup_engine.py")
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="список числа потоков через запятую")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir", default=None, help="где создать дерево (по умолчанию - временная директория)")
+    parser.add_argument("--json", dest="json_path", default=None, help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="backup-bench-", dir=args.workdir)
+    try:
+        source = os.path.join(workdir, "source")
+        output_dir = os.path.join(workdir, "out")
+        os.makedirs(output_dir)
+        size, files = build_tree(source, args.size_mb)
+        print(f"Синтетическое дерево: {size / (1024 * 1024):.0f} MB, файлов: {files}")
+        drop_page_cache_hint(source)
+
+        methods = [("backup.sh (cp + tar -czf)", lambda name: run_script_method(source, output_dir, name))]
+        for workers in sorted({int(item) for item in args.workers.split(',') if item.strip()}):
+            methods.append((f"backup_engine.py, потоков: {workers}",
+                            lambda name, workers=workers: run_engine_method(source, output_dir, name, workers)))
+
+        results = []
+        for label, method in methods:
+            timings = []
+            for attempt in range(args.repeat):
+                name = f"devops-portfolio-backup-bench_{len(results)}_{attempt}"
+                seconds, archive_size = method(name)
+                os.remove(os.path.join(output_dir, f"{name}.tar.gz"))
+                timings.append(seconds)
+            best = min(timings)
+            result = {
+                "method": label,
+                "best_seconds": round(best, 3),
+                "mb_per_second": round(size / (1024 * 1024) / best, 1),
+                "archive_mb": round(archive_size / (1024 * 1024), 1),
+            }
+            results.append(result)
+            print(f"{label:<40} {result['mb_per_second']:>8.1f} MB/s  "
+                  f"{result['best_seconds']:>7.2f} s  архив {result['archive_mb']} MB")
+
+        baseline = results[0]["mb_per_second"]
+        for result in results:
+            result["speedup"] = round(result["mb_per_second"] / baseline, 2) if baseline else None
+
+        if args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump({"size_bytes": size, "files": files, "cpu_count": os.cpu_count(),
+                           "results": results}, f, indent=2, ensure_ascii=False)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Приложение для нагрузочных тестов без Docker и реальных бэкапов
+Запускается тем же gunicorn, что и в продакшене: gunicorn "bench_app:create_app()".
+Docker и каталог бэкапов подменяются заглушками с настраиваемой задержкой,
+чтобы можно было воспроизвести медленный daemon или медленный volume.
+
+Переменные окружения:
+    BENCH_DOCKER_DELAY  - секунд на один опрос Docker (по умолчанию 0)
+    BENCH_BACKUP_DELAY  - секунд на обход директории бэкапов (по умолчанию 0)
+    BENCH_DISK_DELAY    - секунд на statvfs диска (по умолчанию 0)
+    BENCH_CONTAINERS    - число фейковых контейнеров (по умолчанию 12)
+    BENCH_BACKUPS       - число фейковых архивов (по умолчанию 5)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app')
+BACKUP_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backup')
+
+
+def _prepare_backups(count):
+    """Директория с фейковыми архивами: листинг и метрики видят обычные devops-portfolio-backup-*.tar.gz"""
+    backup_dir = tempfile.mkdtemp(prefix="bench-backups-")
+    now = time.time()
+    for i in range(count):
+        path = os.path.join(backup_dir, f"devops-portfolio-backup-{time.strftime('%Y%m%d_%H%M%S', time.localtime(now - i * 86400))}.tar.gz")
+        with open(path, 'wb') as f:
+            f.write(b'\0' * (2 * 1024 * 1024))
+        os.utime(path, (now - i * 86400, now - i * 86400))
+    return backup_dir
+
+
+def _install_stubs():
+    import docker_state
+    from docker_state import ContainerStateCollector, container_view
+    from backup_catalog import BackupCatalog
+
+    docker_delay = float(os.environ.get('BENCH_DOCKER_DELAY', '0'))
+    backup_delay = float(os.environ.get('BENCH_BACKUP_DELAY', '0'))
+    disk_delay = float(os.environ.get('BENCH_DISK_DELAY', '0'))
+    containers = int(os.environ.get('BENCH_CONTAINERS', '12'))
+
+    def collect(self):
+        time.sleep(docker_delay)
+        items = [container_view(f"bench-{i}", "Up 2 hours", i % 4 != 0, "bench:latest") for i in range(containers)]
+        return {"containers": items, "debug": {"method": "bench_stub", "count": len(items)}}
+
+    original_refresh = BackupCatalog.refresh
+
+    # Каталог после первого обхода отвечает из памяти - задержка на каждый вызов имитирует медленный volume
+    def refresh(self):
+        time.sleep(backup_delay)
+        return original_refresh(self)
+
+    original_disk_usage = shutil.disk_usage
+
+    def disk_usage(path):
+        time.sleep(disk_delay)
+        return original_disk_usage(path)
+
+    ContainerStateCollector.collect = collect
+    shutil.disk_usage = disk_usage
+    BackupCatalog.refresh = refresh
+    docker_state.logger.disabled = True
+
+
+def create_app():
+    os.environ.setdefault('DOCKER_EVENTS_ENABLED', 'false')
+    # Статистику контейнеров можно проверить на stub_docker.py: DOCKER_HOST=unix://... CONTAINER_STATS_ENABLED=true
+    os.environ.setdefault('CONTAINER_STATS_ENABLED', 'false')
+    os.environ.setdefault('CRON_ENABLED', 'true')
+    os.environ.setdefault('BACKUP_TOOLS_DIR', BACKUP_TOOLS_DIR)
+    if not os.environ.get('BACKUP_DIR'):
+        os.environ['BACKUP_DIR'] = _prepare_backups(int(os.environ.get('BENCH_BACKUPS', '5')))
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+
+    import app as portfolio
+    _install_stubs()
+    return portfolio.create_app()
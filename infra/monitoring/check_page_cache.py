@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Самопроверка кеша страниц (app/page_cache.py): правка шаблона на диске обновляет страницу
+Приложение Flask без debug (auto_reload выключен, как в gunicorn) с шаблонами во временном
+каталоге: страница рендерится, шаблон и базовый шаблон правятся, тело ответа должно измениться.
+
+Запуск: python3 infra/monitoring/check_page_cache.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    # mtime в подписи страницы: на файловых системах с грубым временем правка могла бы его не сдвинуть
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def run_check():
+    sys.path.insert(0, APP_DIR)
+    from flask import Flask
+    from page_cache import PageCache
+
+    failures = []
+    templates = tempfile.mkdtemp(prefix="page-cache-templates-")
+    write(os.path.join(templates, "base.html"), "<title>base v1</title>{% block body %}{% endblock %}")
+    write(os.path.join(templates, "page.html"), "{% extends 'base.html' %}{% block body %}page v1{% endblock %}")
+
+    app = Flask(__name__, template_folder=templates)
+    cache = PageCache(app, watch_dirs=[templates], check_interval=0)
+
+    @app.route("/")
+    def page():
+        return cache.render("page.html", "ru", dict)
+
+    client = app.test_client()
+
+    def body():
+        return client.get("/").get_data(as_text=True)
+
+    expected = "<title>base v1</title>page v1"
+    if body() != expected:
+        failures.append(f"первый рендер: {body()!r}")
+
+    write(os.path.join(templates, "page.html"), "{% extends 'base.html' %}{% block body %}page v2{% endblock %}")
+    expected = "<title>base v1</title>page v2"
+    if body() != expected:
+        failures.append(f"после правки шаблона: {body()!r}, ожидалось {expected!r}")
+
+    write(os.path.join(templates, "base.html"), "<title>base v2</title>{% block body %}{% endblock %}")
+    expected = "<title>base v2</title>page v2"
+    if body() != expected:
+        failures.append(f"после правки базового шаблона: {body()!r}, ожидалось {expected!r}")
+
+    etag = client.get("/").headers.get("ETag")
+    if client.get("/", headers={"If-None-Match": etag}).status_code != 304:
+        failures.append("повторный запрос с ETag не получил 304")
+    return failures
+
+
+def main():
+    started = time.perf_counter()
+    failures = run_check()
+    for line in failures:
+        print(f"ОШИБКА: {line}")
+    if not failures:
+        print(f"Кеш страниц: правки шаблонов подхватываются ({(time.perf_counter() - started) * 1000:.0f} мс)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест и бенчмарк задержек приложения (asyncio, без внешних зависимостей)
+В отличие от load-test.sh, который нагружает хост ради алертов, здесь измеряется само приложение:
+пропускная способность и p50/p95/p99 по каждому маршруту.
+
+Режимы:
+    closed - N соединений, каждое шлет следующий запрос сразу после ответа (--concurrency)
+    open   - запросы приходят с заданной частотой независимо от ответов (--rate);
+             задержка считается от запланированного момента, очередь тоже попадает в замер
+
+Примеры:
+    # Локальный gunicorn с заглушками Docker/бэкапов (bench_app.py), результат в JSON
+    python3 infra/monitoring/load_bench.py --start --duration 30 --concurrency 32 --output results.json
+    # Открытая модель 200 rps против уже запущенного сервера и сравнение с прошлым прогоном
+    python3 infra/monitoring/load_bench.py --url http://127.0.0.1:8000 --mode open --rate 200 --compare results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+MONITORING_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.normpath(os.path.join(MONITORING_DIR, '..', '..', 'app'))
+
+# Маршруты create_app() и их доля в нагрузке; SSE (/api/system/stream) не входит - это долгие соединения
+DEFAULT_ROUTES = {
+    "/": 4,
+    "/about": 2,
+    "/architecture": 1,
+    "/monitoring": 2,
+    "/metrics": 2,
+    "/api/system/disk": 2,
+    "/api/system/docker": 2,
+    "/api/system/backups": 2,
+    "/api/system/summary": 2,
+}
+
+# Готовые сценарии для --start: переменные bench_app.py и допустимый p95 по маршрутам
+PROFILES = {
+    # Медленные Docker daemon, volume с бэкапами и диск: пробы упираются в таймауты,
+    # а страницы и /metrics должны отвечать как обычно
+    "slow-probes": {
+        "env": {"BENCH_DOCKER_DELAY": "12", "BENCH_BACKUP_DELAY": "8", "BENCH_DISK_DELAY": "8"},
+        "slo_p95_ms": {"/": 250, "/about": 250, "/architecture": 250, "/monitoring": 250, "/metrics": 250},
+    },
+}
+
+
+class HttpConnection:
+    """Минимальный HTTP/1.1 клиент с keep-alive поверх asyncio streams"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def request(self, path, headers=None):
+        """Возвращает (status, размер тела)"""
+        return await asyncio.wait_for(self._request(path, headers or {}), self.timeout)
+
+    async def _request(self, path, headers):
+        if self._writer is not None:
+            try:
+                return await self._exchange(path, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Сервер закрыл простаивавшее keep-alive соединение - повторяем один раз на новом
+                pass
+        await self._connect()
+        return await self._exchange(path, headers)
+
+    async def _exchange(self, path, headers):
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}:{self.port}", "Accept-Language: ru"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        try:
+            self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+            await self._writer.drain()
+            return await self._read_response()
+        except BaseException:
+            # Соединение в неизвестном состоянии - следующий запрос откроет новое
+            self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("Сервер закрыл соединение")
+        status = int(status_line.split()[1])
+        length = None
+        chunked = False
+        keep_alive = True
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "transfer-encoding" and "chunked" in value:
+                chunked = True
+            elif name == "connection" and value == "close":
+                keep_alive = False
+
+        size = 0
+        if chunked:
+            while True:
+                chunk_size = int((await self._reader.readline()).split(b";")[0], 16)
+                if chunk_size == 0:
+                    await self._reader.readline()
+                    break
+                size += len(await self._reader.readexactly(chunk_size))
+                await self._reader.readline()
+        elif length is not None:
+            size = len(await self._reader.readexactly(length))
+        else:
+            size = len(await self._reader.read())
+            keep_alive = False
+        if not keep_alive:
+            self.close()
+        return status, size
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по рангу (nearest-rank) из отсортированного списка"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed):
+    """samples - список (задержка в секундах, ok)"""
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+class LoadGenerator:
+    """Генерирует нагрузку по смеси маршрутов и собирает задержки"""
+
+    def __init__(self, base_url, routes=None, timeout=30.0, seed=None):
+        url = urlsplit(base_url)
+        self.host = url.hostname or "127.0.0.1"
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.routes = routes or DEFAULT_ROUTES
+        self.timeout = timeout
+        self._paths = list(self.routes)
+        self._weights = [self.routes[path] for path in self._paths]
+        self._random = random.Random(seed)
+        self.samples = {}
+        self.failures = {}
+
+    def _pick(self):
+        return self._random.choices(self._paths, self._weights)[0]
+
+    async def _send(self, connection, path, started):
+        ok = False
+        try:
+            status, _ = await connection.request(self.prefix + path)
+            ok = status < 400
+            if not ok:
+                self.failures[f"HTTP {status}"] = self.failures.get(f"HTTP {status}", 0) + 1
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            key = type(e).__name__
+            self.failures[key] = self.failures.get(key, 0) + 1
+        self.samples.setdefault(path, []).append((time.perf_counter() - started, ok))
+
+    async def run_closed(self, concurrency, duration):
+        """Замкнутая модель: concurrency соединений без пауз"""
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            connection = HttpConnection(self.host, self.port, self.timeout)
+            try:
+                while time.perf_counter() < deadline:
+                    await self._send(connection, self._pick(), time.perf_counter())
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    async def run_open(self, rate, duration, max_connections=256, poisson=True):
+        """Открытая модель: rate запросов в секунду, задержка считается от запланированного времени"""
+        pool = asyncio.Queue()
+        for _ in range(max_connections):
+            pool.put_nowait(HttpConnection(self.host, self.port, self.timeout))
+        tasks = []
+
+        async def fire(path, scheduled):
+            connection = await pool.get()
+            try:
+                await self._send(connection, path, scheduled)
+            finally:
+                pool.put_nowait(connection)
+
+        started = time.perf_counter()
+        next_at = started
+        while next_at < started + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(fire(self._pick(), next_at)))
+            next_at += self._random.expovariate(rate) if poisson else 1.0 / rate
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        while not pool.empty():
+            pool.get_nowait().close()
+        return elapsed
+
+    def report(self, elapsed):
+        everything = [sample for samples in self.samples.values() for sample in samples]
+        return {
+            "overall": summarize(everything, elapsed),
+            "routes": {path: summarize(samples, elapsed) for path, samples in sorted(self.samples.items())},
+            "failures": self.failures,
+        }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    """gunicorn с bench_app.py: те же хуки и multiprocess метрики, что в Dockerfile"""
+
+    def __init__(self, workers=2, threads=8, worker_class=None, env=None, extra_args=()):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.args = [sys.executable, "-m", "gunicorn", "bench_app:create_app()",
+                     "-w", str(workers), "--threads", str(threads),
+                     "-b", f"127.0.0.1:{self.port}", "--log-level", "warning", *extra_args]
+        if worker_class:
+            self.args += ["-k", worker_class]
+        env = dict(os.environ, **(env or {}))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [MONITORING_DIR, APP_DIR, env.get("PYTHONPATH")]))
+        env.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="bench-prometheus-"))
+        # None - убрать переменную (PROMETHEUS_MULTIPROC_DIR: None - метрики в памяти процесса)
+        self.env = {name: value for name, value in env.items() if value is not None}
+        self.process = None
+
+    def __enter__(self):
+        # cwd=app: gunicorn подхватит app/gunicorn.conf.py, как в контейнере
+        self.process = subprocess.Popen(self.args, cwd=APP_DIR, env=self.env)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn завершился с кодом {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError("gunicorn не запустился за 30 секунд")
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def compare(current, baseline, threshold):
+    """Сравнение с прошлым прогоном; возвращает список регрессий p95/пропускной способности"""
+    regressions = []
+    same_mode = current.get("meta", {}).get("mode") == baseline.get("meta", {}).get("mode")
+    pairs = [("overall", current["overall"], baseline.get("overall", {}))]
+    pairs += [(path, stats, baseline.get("routes", {}).get(path, {})) for path, stats in current["routes"].items()]
+    for name, now, before in pairs:
+        if not before:
+            continue
+        if before.get("p95_ms") and now.get("p95_ms") and now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        # Пропускная способность сравнима только при той же модели нагрузки
+        if name == "overall" and same_mode and before.get("throughput_rps") and \
+                now["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{name}: {before['throughput_rps']} -> {now['throughput_rps']} rps")
+    return regressions
+
+
+def check_slo(result, slo_p95_ms):
+    """Маршруты, у которых p95 выше допустимого"""
+    violations = []
+    for path, limit in slo_p95_ms.items():
+        stats = result["routes"].get(path)
+        if stats and (stats["p95_ms"] is None or stats["p95_ms"] > limit):
+            violations.append(f"{path}: p95 {stats['p95_ms']} ms > {limit} ms")
+    return violations
+
+
+def print_report(result):
+    header = f"{'маршрут':<24} {'запросов':>9} {'ошибок':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    rows = list(result["routes"].items()) + [("ИТОГО", result["overall"])]
+    for name, stats in rows:
+        print(f"{name:<24} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms'] or '-':>8} {stats['p95_ms'] or '-':>8} {stats['p99_ms'] or '-':>8} "
+              f"{stats['max_ms'] or '-':>8}")
+    if result["failures"]:
+        print(f"Ошибки: {result['failures']}")
+
+
+def parse_routes(value):
+    """"/,/metrics:3" -> {"/": 1, "/metrics": 3}"""
+    if not value:
+        return None
+    routes = {}
+    for item in value.split(","):
+        path, _, weight = item.strip().partition(":")
+        routes[path] = float(weight or 1)
+    return routes
+
+
+async def run_load(url, args):
+    generator = LoadGenerator(url, routes=parse_routes(args.routes), timeout=args.timeout, seed=args.seed)
+    if args.warmup:
+        await LoadGenerator(url, routes=generator.routes, timeout=args.timeout).run_closed(
+            min(args.concurrency, 4), args.warmup)
+    if args.mode == "open":
+        elapsed = await generator.run_open(args.rate, args.duration, max_connections=args.max_connections)
+    else:
+        elapsed = await generator.run_closed(args.concurrency, args.duration)
+    return generator.report(elapsed)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест и бенчмарк задержек DevOps Portfolio")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="уже запущенный сервер, например http://127.0.0.1:8000")
+    target.add_argument("--start", action="store_true", help="запустить локальный gunicorn с bench_app.py")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=16, help="соединений в режиме closed")
+    parser.add_argument("--rate", type=float, default=100.0, help="запросов в секунду в режиме open")
+    parser.add_argument("--max-connections", type=int, default=256, help="предел соединений в режиме open")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="таймаут одного запроса")
+    parser.add_argument("--routes", default=None, help='смесь маршрутов: "/:4,/metrics:2,/api/system/docker"')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn воркеров (с --start)")
+    parser.add_argument("--threads", type=int, default=8, help="потоков на воркер (с --start)")
+    parser.add_argument("--worker-class", default=None, help="класс воркера gunicorn (с --start)")
+    parser.add_argument("--env", action="append", default=[], help="переменная для сервера, NAME=VALUE (с --start)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=None, help="готовый сценарий (с --start)")
+    parser.add_argument("--output", default=None, help="сохранить результат в JSON")
+    parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимое ухудшение при сравнении")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    profile = PROFILES.get(args.profile, {})
+    server_env = dict(profile.get("env", {}))
+    server_env.update(item.split("=", 1) for item in args.env)
+
+    meta = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "mode": args.mode,
+        "concurrency": args.concurrency if args.mode == "closed" else None,
+        "rate": args.rate if args.mode == "open" else None,
+        "duration": args.duration,
+        "routes": parse_routes(args.routes) or DEFAULT_ROUTES,
+        "profile": args.profile,
+    }
+    if args.start:
+        meta["server"] = {"workers": args.workers, "threads": args.threads,
+                          "worker_class": args.worker_class or "default", "env": server_env}
+        with LocalServer(args.workers, args.threads, args.worker_class, env=server_env) as server:
+            result = asyncio.run(run_load(server.url, args))
+    else:
+        meta["server"] = {"url": args.url}
+        result = asyncio.run(run_load(args.url, args))
+
+    result = dict(meta=meta, **result)
+    print_report(result)
+
+    violations = check_slo(result, profile.get("slo_p95_ms", {}))
+    result["slo_violations"] = violations
+    for line in violations:
+        print(f"SLO нарушен: {line}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Результат сохранен: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions:
+            print("Регрессии относительно прошлого прогона:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Регрессий нет")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
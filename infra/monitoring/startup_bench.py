@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк старта приложения: время импорта, время до первого ответа, первые запросы и память воркеров
+Сравниваются варианты запуска gunicorn с bench_app.py (Docker и бэкапы - заглушки):
+    lazy    - без preload и без прогрева (APP_WARMUP=false): все грузит первый запрос воркера
+    warm    - без preload, каждый воркер прогревается сам при старте
+    preload - GUNICORN_PRELOAD=true: прогрев один раз в мастере, воркеры получают его через fork
+    preload-single - то же без PROMETHEUS_MULTIPROC_DIR (метрики в памяти процесса)
+
+Память считается по /proc/<pid>/smaps_rollup: RSS, PSS (общие страницы делятся между процессами)
+и USS (только собственные страницы) - именно USS показывает выигрыш copy-on-write.
+Потоки мастера считаются по /proc/<pid>/task: create_app() и прогрев не должны запускать в нем
+пулов и фоновых потоков (они не переживают fork) - при превышении бенчмарк завершается с кодом 1.
+
+Примеры:
+    python3 infra/monitoring/startup_bench.py
+    python3 infra/monitoring/startup_bench.py --variants preload --workers 4 --output startup.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from load_bench import APP_DIR, LocalServer
+
+VARIANTS = {
+    "lazy": {"GUNICORN_PRELOAD": "false", "APP_WARMUP": "false"},
+    "warm": {"GUNICORN_PRELOAD": "false", "APP_WARMUP": "true"},
+    "preload": {"GUNICORN_PRELOAD": "true", "APP_WARMUP": "true"},
+    # Без multiprocess реестр по умолчанию при регистрации collector вызывает его describe()/collect()
+    "preload-single": {"GUNICORN_PRELOAD": "true", "APP_WARMUP": "true", "PROMETHEUS_MULTIPROC_DIR": None},
+}
+
+# Маршруты первых запросов: страницы (переводы, шаблоны) и пробы (модули клиентов)
+FIRST_REQUEST_PATHS = ("/", "/about", "/monitoring", "/architecture", "/api/system/summary")
+
+# Главный поток и QueueListener структурированного логирования
+MASTER_MAX_THREADS = 2
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(top=10):
+    """python -X importtime для "import app": общее время и самые дорогие модули верхнего уровня"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=APP_DIR,
+                            capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=APP_DIR))
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent)))
+    if not entries:
+        raise RuntimeError(f"import app не удался:\n{result.stderr[-2000:]}")
+    base_indent = min(indent for _, _, _, indent in entries)
+    top_level = [e for e in entries if e[3] == base_indent]
+    app_entry = next((e for e in top_level if e[0] == "app"), None)
+    return {
+        "app_import_ms": round(app_entry[2] / 1000, 1) if app_entry else None,
+        "total_import_ms": round(sum(e[2] for e in top_level) / 1000, 1),
+        "heaviest": [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)}
+                     for name, _, cumulative, _ in sorted(entries, key=lambda e: -e[2])
+                     if name != "app"][:top],
+    }
+
+
+def request_ms(port, path):
+    """Один запрос на новом соединении: gunicorn распределяет их по разным воркерам"""
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    finally:
+        connection.close()
+    return (time.perf_counter() - started) * 1000, status
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Имя процесса в скобках может содержать пробелы - поля считаем после ")"
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def thread_count(pid):
+    return len(os.listdir(f"/proc/{pid}/task"))
+
+
+def memory_mb(pid):
+    """RSS, PSS и USS процесса в мегабайтах"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":"):
+                values[parts[0][:-1]] = int(parts[1])
+    uss = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return {"rss": round(values.get("Rss", 0) / 1024, 1), "pss": round(values.get("Pss", 0) / 1024, 1),
+            "uss": round(uss / 1024, 1)}
+
+
+def measure_variant(name, workers, threads, rounds, steady):
+    env = dict(VARIANTS[name], LOG_LEVEL="WARNING")
+    started = time.perf_counter()
+    with LocalServer(workers, threads, env=env) as server:
+        # LocalServer ждет только открытия порта; готовность - первый ответ воркера.
+        # Несуществующий путь (404) не рендерит страниц и не трогает проб
+        while True:
+            try:
+                request_ms(server.port, "/startup-bench-ready")
+                break
+            except OSError:
+                time.sleep(0.05)
+        boot_seconds = time.perf_counter() - started
+
+        # Первые запросы: каждый маршрут по кругу на новых соединениях, пока их получают все воркеры
+        first = []
+        for _ in range(rounds):
+            for path in FIRST_REQUEST_PATHS:
+                first.append(request_ms(server.port, path)[0])
+        later = [request_ms(server.port, FIRST_REQUEST_PATHS[i % len(FIRST_REQUEST_PATHS)])[0] for i in range(steady)]
+
+        master = server.process.pid
+        master_threads = thread_count(master)
+        master_memory = memory_mb(master)
+        workers_memory = [memory_mb(pid) for pid in worker_pids(master)]
+
+    return {
+        "variant": name,
+        "boot_seconds": round(boot_seconds, 3),
+        "first_requests": {"max_ms": round(max(first), 1), "median_ms": round(statistics.median(first), 1)},
+        "steady": {"max_ms": round(max(later), 1), "median_ms": round(statistics.median(later), 1)},
+        "master_threads": master_threads,
+        "master_memory_mb": master_memory,
+        "workers_memory_mb": workers_memory,
+        "uss_per_worker_mb": round(statistics.mean(m["uss"] for m in workers_memory), 1) if workers_memory else None,
+        "pss_total_mb": round(sum(m["pss"] for m in workers_memory), 1),
+    }
+
+
+def print_report(imports, results):
+    print(f"import app: {imports['app_import_ms']} мс (все модули верхнего уровня: {imports['total_import_ms']} мс)")
+    for item in imports["heaviest"][:5]:
+        print(f"    {item['module']:<40} {item['cumulative_ms']:>8} мс")
+    print()
+    header = (f"{'вариант':<14} {'старт, с':>9} {'первые max':>11} {'первые p50':>11} {'потом p50':>10} "
+              f"{'USS/воркер':>11} {'PSS всего':>10} {'потоков мастера':>16}")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['variant']:<14} {r['boot_seconds']:>9} {r['first_requests']['max_ms']:>11} "
+              f"{r['first_requests']['median_ms']:>11} {r['steady']['median_ms']:>10} "
+              f"{r['uss_per_worker_mb']:>11} {r['pss_total_mb']:>10} {r['master_threads']:>16}")
+    print("(время в мс, память в МБ)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк старта gunicorn воркеров")
+    parser.add_argument("--variants", default="lazy,warm,preload,preload-single", help="через запятую: " + ", ".join(VARIANTS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=4, help="кругов первых запросов по всем маршрутам")
+    parser.add_argument("--steady", type=int, default=50, help="запросов после прогрева для сравнения")
+    parser.add_argument("--output", help="сохранить результат в JSON")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.variants.split(",") if name.strip()]
+    unknown = [name for name in names if name not in VARIANTS]
+    if unknown:
+        parser.error(f"неизвестные варианты: {', '.join(unknown)}")
+
+    imports = measure_imports()
+    results = [measure_variant(name, args.workers, args.threads, args.rounds, args.steady) for name in names]
+    print_report(imports, results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"imports": imports, "variants": results, "workers": args.workers}, f, indent=2,
+                      ensure_ascii=False)
+    failures = [r for r in results if r["master_threads"] > MASTER_MAX_THREADS]
+    for r in failures:
+        print(f"ОШИБКА: {r['variant']}: в мастере {r['master_threads']} потоков, "
+              f"ожидалось не больше {MASTER_MAX_THREADS} - create_app() запускает потоки до fork")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Заглушка Docker Engine API на unix сокете для проверки сбора статистики (app/container_stats.py)
+Отвечает на /containers/json и /containers/{id}/stats: счетчики CPU и сети растут с известной
+скоростью, поэтому CPU% и скорости сети, посчитанные сборщиком, можно сравнить с заданными.
+Задержка ответа /stats имитирует настоящий daemon (около секунды на контейнер без one-shot).
+
+Примеры:
+    # Заглушка с 20 контейнерами; приложение: DOCKER_HOST=unix:///tmp/stub-docker.sock
+    python3 infra/monitoring/stub_docker.py --socket /tmp/stub-docker.sock --containers 20 --delay 0.5
+    # Самопроверка: 40 контейнеров по 0.5 с, пул 8, бюджет сбора 1 с
+    python3 infra/monitoring/stub_docker.py --check
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+APP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+
+ONLINE_CPUS = 4
+MIB = 1024 * 1024
+
+
+def expected_stats(index):
+    """Заданное потребление контейнера: CPU% (от одного ядра), память, скорости сети"""
+    return {
+        "cpu_percent": (index % 4 + 1) * 10.0,
+        "memory_bytes": (index + 1) * 10 * MIB,
+        "net_rx_bps": 1000.0 * (index + 1),
+        "net_tx_bps": 500.0 * (index + 1),
+    }
+
+
+class StubDocker:
+    """Docker Engine API в фоновом потоке; число запросов по путям - в counts"""
+
+    def __init__(self, socket_path, containers=10, delay=0.0):
+        self.socket_path = socket_path
+        self.delay = delay
+        self.started = time.time()
+        self.containers = [(f"stub-{i}", hashlib.sha256(f"stub-{i}".encode()).hexdigest()) for i in range(containers)]
+        self.by_id = {container_id: i for i, (_, container_id) in enumerate(self.containers)}
+        self.counts = {}
+        self.connections = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def address_string(self):
+                # У клиента unix сокета нет адреса
+                return "unix"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                status, body = stub.respond(path)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self.server.daemon_threads = True
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self, index):
+        now = time.time() - self.started
+        expected = expected_stats(index)
+        return {
+            "read": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": int(expected["cpu_percent"] / 100 * now * 1e9)},
+                "system_cpu_usage": int(ONLINE_CPUS * now * 1e9),
+                "online_cpus": ONLINE_CPUS,
+            },
+            "precpu_stats": {},
+            "memory_stats": {
+                "usage": expected["memory_bytes"] + MIB,
+                "limit": 1024 * MIB,
+                "stats": {"inactive_file": MIB},
+            },
+            "networks": {
+                "eth0": {"rx_bytes": int(expected["net_rx_bps"] * now), "tx_bytes": int(expected["net_tx_bps"] * now)},
+            },
+        }
+
+    def respond(self, path):
+        if path == "/containers/json":
+            self._count("list")
+            return 200, [{"Id": container_id, "Names": [f"/{name}"], "State": "running", "Image": "stub:latest"}
+                         for name, container_id in self.containers]
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "containers" and parts[2] == "stats":
+            self._count("stats")
+            if self.delay:
+                time.sleep(self.delay)
+            index = self.by_id.get(parts[1])
+            if index is None:
+                return 404, {"message": f"No such container: {parts[1]}"}
+            return 200, self.stats(index)
+        return 404, {"message": "page not found"}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def run_check(containers, delay, workers, budget):
+    """Сбор на заглушке: время сбора ограничено бюджетом, значения совпадают с заданными"""
+    sys.path.insert(0, APP_DIR)
+    from container_stats import ContainerStatsSampler, DockerEngineClient
+
+    failures = []
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="stub-docker-"), "docker.sock")
+    with StubDocker(socket_path, containers, delay) as stub:
+        sampler = ContainerStatsSampler(DockerEngineClient(f"unix://{socket_path}", timeout=5), interval=1,
+                                        workers=workers, budget=budget)
+        # Каждому контейнеру нужны два ответа; не успевшие в бюджет дописываются между сборами
+        rounds = 2 + math.ceil(2 * containers * delay / workers / max(budget, 1.0))
+        for i in range(rounds):
+            sample = sampler.sample()
+            print(f"сбор {i + 1}: {sample['completed']}/{sample['containers']} за {sample['duration_seconds']} с")
+            if sample["duration_seconds"] > budget + 0.5:
+                failures.append(f"сбор {i + 1} длился {sample['duration_seconds']} с при бюджете {budget} с")
+            time.sleep(max(0.0, 1.0 - sample["duration_seconds"]))
+
+        stats = sampler.stats()
+        if len(stats) != containers:
+            failures.append(f"статистика есть у {len(stats)} контейнеров из {containers}")
+        for index, (name, _) in enumerate(stub.containers):
+            got, expected = stats.get(name, {}), expected_stats(index)
+            for key, value in expected.items():
+                actual = got.get(key)
+                if actual is None or abs(actual - value) > max(1.0, value * 0.05):
+                    failures.append(f"{name} {key}: {actual}, ожидалось {value}")
+                    break
+
+        annotated = sampler.annotate({"containers": [{"Names": "stub-0"}, {"Names": "other"}]})["containers"]
+        if "stats" not in annotated[0] or "stats" in annotated[1]:
+            failures.append(f"annotate: {annotated}")
+        metrics = {family.name: len(family.samples) for family in sampler.collect()}
+        if metrics.get("app_container_cpu_percent") != containers:
+            failures.append(f"метрики: {metrics}")
+        print(f"запросов: {stub.counts}, соединений: {stub.connections} (пул {workers} + список)")
+        if stub.connections > workers + 1:
+            failures.append(f"соединения не переиспользуются: {stub.connections}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка Docker Engine API на unix сокете")
+    parser.add_argument("--socket", default="/tmp/stub-docker.sock")
+    parser.add_argument("--containers", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа /stats, секунд")
+    parser.add_argument("--check", action="store_true", help="самопроверка app/container_stats.py")
+    parser.add_argument("--workers", type=int, default=8, help="пул сборщика для --check")
+    parser.add_argument("--budget", type=float, default=1.0, help="бюджет сбора для --check, секунд")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = run_check(40 if args.containers == 10 else args.containers, args.delay or 0.5,
+                             args.workers, args.budget)
+        for line in failures:
+            print(f"ОШИБКА: {line}")
+        return 1 if failures else 0
+
+    stub = StubDocker(args.socket, args.containers, args.delay)
+    print(f"Заглушка Docker: unix://{args.socket}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
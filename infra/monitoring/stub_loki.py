@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Заглушка Loki HTTP API для проверки прокси поиска по логам (app/log_query.py)
+LogQL не разбирается: любой запрос возвращает строки нескольких потоков с фиксированной
+частотой, зависящие только от времени. limit и direction работают как в Loki, поэтому
+выдачу прокси по окнам можно сравнить с одним запросом всего диапазона.
+
+Примеры:
+    # Заглушка на порту 3100 с задержкой 200 мс на запрос
+    python3 infra/monitoring/stub_loki.py --port 3100 --delay 0.2
+    # Самопроверка прокси: порядок и состав строк, лимит, кеш закрытых окон
+    python3 infra/monitoring/stub_loki.py --check
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+APP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+
+NS = 1_000_000_000
+
+# Потоки и период их строк в секундах
+STREAMS = [
+    ({"job": "docker", "container": "app"}, 10),
+    ({"job": "docker", "container": "nginx"}, 7),
+    ({"job": "docker", "container": "prometheus"}, 60),
+]
+
+
+class StubLoki:
+    """Loki API в фоновом потоке; запросы к заглушке записываются в requests"""
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                with stub._lock:
+                    stub.requests.append((url.path, params))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, body, content_type = stub.respond(url.path, params)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    @staticmethod
+    def query_range(params):
+        """Строки в [start, end), не больше limit самых новых (backward) или самых старых (forward)"""
+        start, end = int(params["start"]), int(params["end"])
+        limit = int(params.get("limit", 100))
+        backward = params.get("direction", "backward") == "backward"
+        entries = []
+        for index, (labels, period) in enumerate(STREAMS):
+            first = -(-start // (period * NS)) * period * NS
+            for ts in range(first, end, period * NS):
+                entries.append((ts, index, f"{labels['container']} GET /metrics 200 t={ts // NS}"))
+        # Строки с одинаковым временем - в порядке потоков, в обоих направлениях
+        entries.sort(key=lambda entry: (-entry[0] if backward else entry[0], entry[1]))
+        entries = entries[:limit]
+        result = []
+        for index, (labels, _) in enumerate(STREAMS):
+            values = [[str(ts), line] for ts, i, line in entries if i == index]
+            if values:
+                result.append({"stream": labels, "values": values})
+        return {"status": "success", "data": {"resultType": "streams", "result": result}}
+
+    def respond(self, path, params):
+        if path == "/ready":
+            return 200, b"ready\n", "text/plain"
+        if path == "/loki/api/v1/query_range":
+            if "error" in params.get("query", ""):
+                return 400, b"parse error at line 1, col 1: syntax error: unexpected IDENTIFIER\n", "text/plain"
+            if "proxy" in params.get("query", ""):
+                # Страница обратного прокси со статусом 200 вместо ответа Loki
+                return 200, b"<html><body>Please sign in</body></html>", "text/html"
+            return 200, json.dumps(self.query_range(params)).encode(), "application/json"
+        return 404, b"404 page not found\n", "text/plain"
+
+    def count(self, path):
+        with self._lock:
+            return sum(1 for p, _ in self.requests if p == path)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def run_check(delay, hours, limit):
+    """Сравнивает выдачу прокси с одним запросом к заглушке; возвращает список расхождений"""
+    sys.path.insert(0, APP_DIR)
+    from log_query import LogQueryProxy
+
+    failures = []
+    with StubLoki(delay=delay) as stub:
+        proxy = LogQueryProxy(stub.url, shard_interval=900, parallelism=4, freshness=300, max_limit=100000)
+        end = time.time_ns()
+        start = end - hours * 3600 * NS
+
+        def collect(args):
+            lines = [json.loads(line) for line in proxy.stream(*args)]
+            return [line for line in lines if "ts" in line], lines[-1]
+
+        for direction, query_limit in (("backward", limit), ("forward", limit), ("backward", 100000)):
+            args = ("{job=\"docker\"}", start, end, query_limit, direction)
+            started = time.perf_counter()
+            entries, summary = collect(args)
+            seconds = time.perf_counter() - started
+            direct = stub.query_range({"start": str(start), "end": str(end), "limit": str(query_limit),
+                                       "direction": direction})["data"]["result"]
+            expected = sorted(([ts, stream["stream"], line] for stream in direct for ts, line in stream["values"]),
+                              key=lambda entry: int(entry[0]), reverse=direction == "backward")
+            got = [[entry["ts"], entry["labels"], entry["line"]] for entry in entries]
+            if [e[0] for e in got] != [e[0] for e in expected] or sorted(map(json.dumps, got)) != sorted(map(json.dumps, expected)):
+                failures.append(f"{direction}, limit {query_limit}: выдача не совпадает с запросом диапазона целиком")
+            print(f"{direction:<9} limit {query_limit:>6}: {summary['summary']['lines']} строк, "
+                  f"окон {summary['summary']['shards']}, из кеша {summary['summary']['cache_hits']}, {seconds * 1000:.0f} мс")
+
+        before = stub.count("/loki/api/v1/query_range")
+        _, summary = collect(("{job=\"docker\"}", start, end, 100000, "backward"))
+        repeated = stub.count("/loki/api/v1/query_range") - before
+        print(f"повтор полного запроса: {repeated} запросов в Loki, из кеша {summary['summary']['cache_hits']}")
+        if repeated > 2:
+            failures.append(f"повторный запрос закрытых окон дошел до Loki {repeated} раз")
+
+        _, summary = collect(("error", start, end, 10, "backward"))
+        if summary.get("errorType") != "bad_data":
+            failures.append(f"ошибка LogQL не передана: {summary}")
+        _, summary = collect(("{job=\"proxy\"}", start, end, 10, "backward"))
+        if summary.get("errorType") != "bad_response":
+            failures.append(f"HTML вместо JSON не передан как ошибка: {summary}")
+        print(f"кеш: {proxy.stats()}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка Loki HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument("--check", action="store_true", help="самопроверка app/log_query.py")
+    parser.add_argument("--hours", type=int, default=6, help="длина диапазона для --check")
+    parser.add_argument("--limit", type=int, default=1000, help="лимит строк для --check")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = run_check(args.delay or 0.05, args.hours, args.limit)
+        for line in failures:
+            print(f"ОШИБКА: {line}")
+        return 1 if failures else 0
+
+    stub = StubLoki(args.host, args.port, args.delay)
+    print(f"Заглушка Loki: {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
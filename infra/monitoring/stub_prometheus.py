@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Заглушка Prometheus HTTP API для проверки кеширующего фронтенда запросов (app/query_frontend.py)
+PromQL не вычисляется: любое выражение возвращает несколько детерминированных серий,
+значение которых зависит только от метрики и времени. Поэтому ответ на разбитый
+и склеенный диапазон можно сравнить с ответом на тот же диапазон целиком.
+
+Примеры:
+    # Заглушка на порту 9090 с задержкой 200 мс на запрос (для ручных экспериментов)
+    python3 infra/monitoring/stub_prometheus.py --port 9090 --delay 0.2
+    # Самопроверка фронтенда: совпадение результатов, попадания в кеш, число запросов в Prometheus
+    python3 infra/monitoring/stub_prometheus.py --check
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+APP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+
+# Серии "результата" любого запроса; последняя существует только в четные часы,
+# чтобы склейка проверялась и на сериях, которые есть не во всех подынтервалах
+SERIES = [
+    {"__name__": "http_requests_total", "path": "/", "instance": "app:8000"},
+    {"__name__": "http_requests_total", "path": "/metrics", "instance": "app:8000"},
+    {"__name__": "app_backup_total", "instance": "app:8000"},
+]
+
+
+def sample(metric, query, t):
+    """Значение серии в момент t (секунды): зависит только от метрики, выражения и времени"""
+    seed = zlib.crc32(json.dumps([metric, query], sort_keys=True).encode())
+    return f"{(seed % 1000) + (t / 15) % 97:.3f}"
+
+
+def series_exists(index, t):
+    return index < len(SERIES) - 1 or int(t // 3600) % 2 == 0
+
+
+class StubPrometheus:
+    """Prometheus API в фоновом потоке; запросы к заглушке записываются в requests"""
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, params):
+                endpoint = urlsplit(self.path).path
+                with stub._lock:
+                    stub.requests.append((endpoint, params))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, payload = stub.respond(endpoint, params)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle(dict(parse_qsl(urlsplit(self.path).query)))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", "0"))
+                self._handle(dict(parse_qsl(self.rfile.read(length).decode())))
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def respond(self, endpoint, params):
+        query = params.get("query", "")
+        if "error" in query:
+            return 422, {"status": "error", "errorType": "execution", "error": "stub execution error"}
+        if endpoint == "/api/v1/query_range":
+            start, end, step = (int(round(float(params[key]) * 1000)) for key in ("start", "end", "step"))
+            result = []
+            for index, metric in enumerate(SERIES):
+                values = []
+                for ms in range(start, end + 1, step):
+                    t = ms / 1000
+                    if series_exists(index, t):
+                        values.append([t, sample(metric, query, t)])
+                if values:
+                    result.append({"metric": metric, "values": values})
+            return 200, {"status": "success", "data": {"resultType": "matrix", "result": result}}
+        if endpoint == "/api/v1/query":
+            t = float(params.get("time", time.time()))
+            result = [{"metric": metric, "value": [t, sample(metric, query, t)]}
+                      for index, metric in enumerate(SERIES) if series_exists(index, t)]
+            return 200, {"status": "success", "data": {"resultType": "vector", "result": result}}
+        if endpoint == "/api/v1/labels":
+            return 200, {"status": "success", "data": sorted({key for metric in SERIES for key in metric})}
+        return 404, {"status": "error", "errorType": "not_found", "error": f"unknown endpoint {endpoint}"}
+
+    def count(self, endpoint):
+        with self._lock:
+            return sum(1 for path, _ in self.requests if path == endpoint)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def run_check(delay, hours):
+    """Сравнивает фронтенд с прямыми запросами к заглушке; возвращает список расхождений"""
+    sys.path.insert(0, APP_DIR)
+    from query_frontend import QueryFrontend, QueryError, align_range
+
+    failures = []
+    with StubPrometheus(delay=delay) as stub:
+        frontend = QueryFrontend(stub.url, split_interval=3600, parallelism=4, freshness=300)
+        now = time.time()
+        params = {"query": "sum(rate(http_requests_total[5m]))", "start": str(now - hours * 3600),
+                  "end": str(now), "step": "15"}
+
+        started = time.perf_counter()
+        cold, cold_cache = frontend.query_range(params)
+        cold_seconds = time.perf_counter() - started
+
+        # Эталон - тот же выровненный диапазон одним запросом
+        start, end = align_range(int(float(params["start"]) * 1000), int(float(params["end"]) * 1000), 15000)
+        _, expected = stub.respond("/api/v1/query_range", {
+            "query": params["query"], "start": f"{start / 1000:.3f}", "end": f"{end / 1000:.3f}", "step": "15"})
+        if cold["data"]["result"] != expected["data"]["result"]:
+            failures.append("склеенный результат не совпадает с запросом диапазона целиком")
+
+        upstream_before = stub.count("/api/v1/query_range")
+        started = time.perf_counter()
+        # Окно сдвинулось на минуту, как при обновлении панели дашборда
+        warm, warm_cache = frontend.query_range(dict(params, start=str(now - hours * 3600 + 60), end=str(now + 60)))
+        warm_seconds = time.perf_counter() - started
+        upstream_warm = stub.count("/api/v1/query_range") - upstream_before
+        if warm_cache["hits"] < warm_cache["subqueries"] - 2:
+            failures.append(f"повторный запрос: попаданий {warm_cache['hits']} из {warm_cache['subqueries']}")
+
+        try:
+            frontend.query_range(dict(params, query="error"))
+            failures.append("ошибка Prometheus не передана")
+        except QueryError as e:
+            if e.status_code != 422 or e.error_type != "execution":
+                failures.append(f"ошибка Prometheus передана как {e.status_code} {e.error_type}")
+
+        # labels, series, metadata - без кеша; параметры как от POST формы Grafana (MultiDict)
+        from werkzeug.datastructures import MultiDict
+        labels, _ = frontend.passthrough("labels", MultiDict([("match[]", "up"), ("match[]", "http_requests_total")]))
+        if labels.get("data") != stub.respond("/api/v1/labels", {})[1]["data"]:
+            failures.append(f"passthrough labels: {labels}")
+
+        print(f"диапазон {hours} ч, шаг 15 с, задержка заглушки {delay * 1000:.0f} мс")
+        print(f"холодный запрос: {cold_cache['subqueries']} подынтервалов, {cold_seconds * 1000:.0f} мс")
+        print(f"сдвиг окна:      {warm_cache['hits']} из {warm_cache['subqueries']} из кеша, "
+              f"{upstream_warm} запросов в Prometheus, {warm_seconds * 1000:.0f} мс")
+        print(f"кеш: {frontend.stats()}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка Prometheus HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9090)
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument("--check", action="store_true", help="самопроверка app/query_frontend.py")
+    parser.add_argument("--hours", type=int, default=24, help="длина диапазона для --check")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = run_check(args.delay or 0.05, args.hours)
+        for line in failures:
+            print(f"ОШИБКА: {line}")
+        return 1 if failures else 0
+
+    stub = StubPrometheus(args.host, args.port, args.delay)
+    print(f"Заглушка Prometheus: {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())